@@ -1,6 +1,77 @@
 from django.contrib import admin
-
-from .models import Author, Genre, Book, BookInstance, Review, UserBookRelation, Language
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import QuerySet
+from django.forms.models import BaseInlineFormSet
+from django.utils.functional import cached_property
+from rest_framework.utils.urls import replace_query_param
+
+from .models import Author, Genre, Book, BookInstance, Fine, Hold, OverdueNotice, Review, UserBookRelation, Language
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Changelist paginator for big tables: an unfiltered changelist on PostgreSQL takes its
+    row count from the planner statistics (kept by autovacuum) instead of counting every
+    row. Counts below estimate_above, and those of filtered or searched changelists, are exact.
+    """
+    estimate_above = 10000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if isinstance(queryset, QuerySet) and not queryset.query.where \
+                and connections[queryset.db].vendor == 'postgresql':
+            with connections[queryset.db].cursor() as cursor:
+                cursor.execute('SELECT reltuples FROM pg_class WHERE oid = %s::regclass',
+                               [queryset.model._meta.db_table])
+                estimate = int(cursor.fetchone()[0])
+            if estimate > self.estimate_above:
+                return estimate
+        return super().count
+
+
+class PaginatedInlineFormSet(BaseInlineFormSet):
+    """
+    Inline formset of one page of per_page related objects, the page given by the
+    ``<prefix>-page`` query parameter (the change form posts back to the same URL).
+    """
+    per_page = 20
+    request = None
+
+    @property
+    def page_param(self):
+        return f'{self.prefix}-page'
+
+    def get_queryset(self):
+        if not hasattr(self, 'page'):
+            self.paginator = Paginator(super().get_queryset(), self.per_page)
+            number = self.request.GET.get(self.page_param) if self.request is not None else None
+            self.page = self.paginator.get_page(number)
+            self._queryset = self.page.object_list
+        return self._queryset
+
+    def page_links(self):
+        """
+        (page number, URL) of the pages around the current one; (ellipsis, None) for the gaps.
+        """
+        self.get_queryset()
+        url = self.request.get_full_path()
+        return [
+            (number, None if number == self.paginator.ELLIPSIS else replace_query_param(url, self.page_param, number))
+            for number in self.paginator.get_elided_page_range(self.page.number)
+        ]
+
+
+class PaginatedTabularInline(admin.TabularInline):
+    formset = PaginatedInlineFormSet
+    template = 'admin/edit_inline/tabular_paginated.html'
+    per_page = 20
+
+    def get_formset(self, request, obj=None, **kwargs):
+        formset = super().get_formset(request, obj, **kwargs)
+        formset.request, formset.per_page = request, self.per_page
+        return formset
 
 
 # class BooksInline(admin.TabularInline):
@@ -11,33 +82,60 @@ from .models import Author, Genre, Book, BookInstance, Review, UserBookRelation,
 @admin.register(Author)
 class AuthorAdmin(admin.ModelAdmin):
     list_display = ('last_name', 'first_name', 'middle_name', 'date_of_birth', 'date_of_death')
+    # Also the lookups of the authors autocomplete of BookAdmin.
+    search_fields = ('last_name', 'first_name')
 
     fields = ['first_name', 'last_name', 'middle_name', 'image', ('date_of_birth', 'date_of_death')]
 
     # inlines = [BooksInline]
 
 
-class BooksInstanceInline(admin.TabularInline):
+class BooksInstanceInline(PaginatedTabularInline):
     model = BookInstance
     extra = 0
+    # A stable order across the pages.
+    ordering = ('due_back', 'id')
+    raw_id_fields = ('borrower',)
+
+    def get_queryset(self, request):
+        # Each row is titled with the copy's __str__(), which shows the book.
+        return super().get_queryset(request).select_related('book')
 
 
 @admin.register(Book)
 class BookAdmin(admin.ModelAdmin):
     list_display = ('title', 'display_author', 'display_genre', 'display_language')
+    search_fields = ('title',)
+    autocomplete_fields = ('authors',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
     inlines = [BooksInstanceInline]
 
+    def get_queryset(self, request):
+        # display_author() and the others slice the prefetched rows: one query per relation for the whole page.
+        return super().get_queryset(request).prefetch_related('authors', 'genre', 'language')
+
 
 @admin.register(UserBookRelation)
 class UserBookRelationAdmin(admin.ModelAdmin):
-    pass
+    list_select_related = ('user', 'book')
+    raw_id_fields = ('user', 'book')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
 
 @admin.register(BookInstance)
 class BookInstanceAdmin(admin.ModelAdmin):
     list_display = ('book', 'status', 'borrower', 'due_back', 'id')
     list_filter = ('status', 'due_back')
+    list_select_related = ('book', 'borrower')
+    # The model's ordering made total, so that the changelist reads copy_due_back_id_idx.
+    ordering = ('due_back', 'id')
+    autocomplete_fields = ('book',)
+    raw_id_fields = ('borrower',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
     fieldsets = (
         (None, {
@@ -49,6 +147,35 @@ class BookInstanceAdmin(admin.ModelAdmin):
     )
 
 
+@admin.register(Hold)
+class HoldAdmin(admin.ModelAdmin):
+    list_display = ('book', 'patron', 'status', 'placed_at', 'expires_at')
+    list_filter = ('status',)
+    list_select_related = ('book', 'patron')
+    raw_id_fields = ('book', 'patron', 'copy')
+
+
+@admin.register(Fine)
+class FineAdmin(admin.ModelAdmin):
+    list_display = ('copy', 'borrower', 'due_back', 'days_overdue', 'amount', 'assessed_on')
+    list_filter = ('assessed_on',)
+    # A copy's __str__() shows its book.
+    list_select_related = ('copy__book', 'borrower')
+    raw_id_fields = ('copy', 'borrower')
+
+
+@admin.register(OverdueNotice)
+class OverdueNoticeAdmin(admin.ModelAdmin):
+    list_display = ('borrower', 'copy', 'due_back', 'days_overdue', 'created_at', 'sent_at')
+    list_filter = ('days_overdue',)
+    list_select_related = ('copy__book', 'borrower')
+    raw_id_fields = ('copy', 'borrower')
+
+
+@admin.register(Review)
+class ReviewAdmin(admin.ModelAdmin):
+    raw_id_fields = ('author', 'book')
+
+
 admin.site.register(Genre)
 admin.site.register(Language)
-admin.site.register(Review)
@@ -0,0 +1,194 @@
+"""
+Async read endpoints for the ASGI deployment (ASYNC_READ_VIEWS).
+
+For the viewsets named in ASYNC_READ_PREFIXES, urlpatterns() puts an async view in
+front of the router's list and detail routes. A plain JSON ``GET`` of a list page or
+of one object - no filters, search, ordering or cursor, only ``page``, ``fields``
+and ``expand`` - is answered with async ORM queries and the viewset's
+books.fastpath plan: it holds a thread only while a query runs (Django's async ORM
+runs them in one), never while it waits on a slow client. Authentication,
+permissions, throttling and the anonymous response cache still go through the
+viewset, in a thread for the few milliseconds they take, and a request they refuse
+gets the viewset's own error response. Every other request, and any request the
+async path can't answer the way the viewset would (bad page, missing object), is
+handed to the viewset itself, so responses are the same bytes either way.
+
+Each request to these routes holds a database connection of its own while it runs,
+however many arrive at once, so a worker runs at most ASYNC_READ_CONCURRENCY of
+them; the rest wait on the event loop, which costs nothing but a little memory.
+"""
+import asyncio
+import math
+import weakref
+from contextlib import nullcontext
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.urls import re_path
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from . import routers
+from .cache import CachedResponseMixin
+from .renderers import FastJSONRenderer
+
+ASYNC_READ_PREFIXES = ('books', 'authors', 'genres', 'reviews')
+READ_ACTIONS = ('list', 'retrieve')
+
+# A semaphore belongs to the event loop it is first awaited in: one per loop.
+_slots = weakref.WeakKeyDictionary()
+
+
+def slots():
+    loop = asyncio.get_running_loop()
+    if loop not in _slots:
+        _slots[loop] = asyncio.Semaphore(settings.ASYNC_READ_CONCURRENCY)
+    return _slots[loop]
+
+
+class AsyncRead:
+    """
+    One list or retrieve request of viewset, as far as it can be answered without the viewset.
+    """
+
+    def __init__(self, viewset, actions, initkwargs, request, kwargs):
+        self.view = viewset(**initkwargs)
+        self.view.action_map = actions
+        for method, action in actions.items():
+            setattr(self.view, method, getattr(self.view, action))
+        self.request = request
+        self.kwargs = kwargs
+        self.plan = self.queryset = None
+
+    def prepare(self):
+        """
+        Run the viewset's checks (sync). Returns the error response of a failed check or the
+        cached response when there is one; otherwise sets self.plan if the async path can
+        answer the request.
+        """
+        view = self.view
+        view.args, view.kwargs, view.format_kwarg = (), self.kwargs, None
+        view.request = request = view.initialize_request(self.request, **self.kwargs)
+        view.headers = view.default_response_headers
+        try:
+            view.initial(request, **self.kwargs)
+        except Exception as exc:
+            # As APIView.dispatch() would: handing the request to the viewset would authenticate
+            # and throttle it a second time.
+            return view.finalize_response(request, view.handle_exception(exc), **self.kwargs)
+        params = {'fields', 'expand'} if view.action == 'retrieve' else {'fields', 'expand', 'page'}
+        if view.action not in READ_ACTIONS or not set(request.query_params) <= params \
+                or type(request.accepted_renderer) is not FastJSONRenderer:
+            return None
+        if view.action == 'list' and (type(view.paginator) is not PageNumberPagination
+                                      or not view.paginator.get_page_size(request)):
+            return None
+        if isinstance(view, CachedResponseMixin) and view.caches(request):
+            response = view.cache_hit(request)
+            if response is not None:
+                return response
+        self.plan = view.fast_plan()
+        if self.plan is not None:
+            self.queryset = view.filter_queryset(view.get_queryset())
+        return None
+
+    async def response(self):
+        """
+        The response, or None to leave the request to the viewset.
+        """
+        response = await sync_to_async(self.prepare)()
+        if response is not None or self.plan is None:
+            return response
+        # A cache miss is served for minutes to come, see CachedResponseMixin.cached().
+        with routers.primary() if getattr(self.view, '_response_cache_key', None) else nullcontext():
+            if self.view.action == 'list':
+                data = await self.list()
+            else:
+                data = await self.retrieve()
+        if data is None:
+            return None
+        return await sync_to_async(self.view.finalize_response)(self.view.request, Response(data), **self.kwargs)
+
+    async def list(self):
+        request, paginator = self.view.request, self.view.paginator
+        page_size = paginator.get_page_size(request)
+        count = await self.queryset.acount()
+        num_pages = max(math.ceil(count / page_size), 1)
+        page = request.query_params.get(paginator.page_query_param, 1)
+        if page in paginator.last_page_strings:
+            page = num_pages
+        try:
+            page = int(page)
+        except ValueError:
+            return None
+        if not 1 <= page <= num_pages:
+            return None
+        offset = (page - 1) * page_size
+        rows = [row async for row in self.queryset[offset:offset + page_size]]
+        url = request.build_absolute_uri()
+        if page == 1:
+            previous = None
+        elif page == 2:
+            previous = remove_query_param(url, paginator.page_query_param)
+        else:
+            previous = replace_query_param(url, paginator.page_query_param, page - 1)
+        return {
+            'count': count,
+            'next': replace_query_param(url, paginator.page_query_param, page + 1) if page < num_pages else None,
+            'previous': previous,
+            'results': await self.plan.aserialize(rows, request),
+        }
+
+    async def retrieve(self):
+        view = self.view
+        lookup_url_kwarg = view.lookup_url_kwarg or view.lookup_field
+        try:
+            row = await self.queryset.filter(**{view.lookup_field: self.kwargs[lookup_url_kwarg]}).aget()
+            await sync_to_async(view.check_object_permissions)(view.request, row)
+        except Exception:
+            # No such object, a malformed key, a denied permission: the viewset answers with the right error.
+            return None
+        return (await self.plan.aserialize([row], view.request))[0]
+
+
+def async_read_view(viewset, actions, **initkwargs):
+    """
+    Async view for one router route of viewset, falling back to the viewset's own view.
+    """
+    fallback = sync_to_async(viewset.as_view(actions, **initkwargs))
+
+    async def view(request, *args, **kwargs):
+        async with slots():
+            response = None
+            if request.method == 'GET':
+                response = await AsyncRead(viewset, actions, initkwargs, request, kwargs).response()
+            if response is None:
+                response = await fallback(request, *args, **kwargs)
+        return response
+
+    view.cls, view.initkwargs, view.actions = viewset, initkwargs, actions
+    # Writes go to the viewset, whose authentication enforces CSRF itself.
+    view.csrf_exempt = True
+    return view
+
+
+def urlpatterns(router, prefixes=ASYNC_READ_PREFIXES):
+    """
+    Async list and detail routes for the viewsets registered on router under prefixes,
+    built like the router's own; include them before router.urls.
+    """
+    patterns = []
+    for prefix, viewset, basename in router.registry:
+        if prefix not in prefixes:
+            continue
+        lookup = router.get_lookup_regex(viewset)
+        for route in router.get_routes(viewset):
+            mapping = router.get_method_map(viewset, route.mapping)
+            if not set(READ_ACTIONS) & set(mapping.values()):
+                continue
+            regex = route.url.format(prefix=prefix, lookup=lookup, trailing_slash=router.trailing_slash)
+            initkwargs = {**route.initkwargs, 'basename': basename, 'detail': route.detail}
+            name = route.name.format(basename=basename)
+            patterns.append(re_path(regex, async_read_view(viewset, mapping, **initkwargs), name=name))
+    return patterns
@@ -0,0 +1,150 @@
+"""
+Telegram bot for the catalogue.
+
+Handlers reach the database only through Catalogue, which reads the few columns
+a reply needs with the async ORM and caps how many queries the bot has in flight,
+so a burst of chats queues up here instead of piling onto the database. Book
+lists are paged - inline keyboards in chats, ``next_offset`` for inline queries -
+rather than sent whole.
+"""
+import asyncio
+
+from django.conf import settings
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, InlineQueryResultArticle, \
+    InputTextMessageContent, Update
+from telegram.ext import ApplicationBuilder, CallbackQueryHandler, CommandHandler, ContextTypes, \
+    InlineQueryHandler, MessageHandler, filters
+
+from .models import Book
+from .search import search_books
+
+PAGE_SIZE = 10
+INLINE_PAGE_SIZE = 20
+SUMMARY_LENGTH = 200
+BOOK_FIELDS = ('pk', 'title', 'isbn', 'available_copies')
+PAGE_CALLBACK = 'books'
+
+
+class Catalogue:
+    """
+    Async, read-only access to the catalogue for the bot.
+    """
+
+    def __init__(self, max_queries):
+        self.slots = asyncio.Semaphore(max_queries)
+
+    async def fetch(self, queryset, offset, limit):
+        """
+        Up to limit rows of queryset from offset on, and whether more follow.
+        """
+        async with self.slots:
+            rows = [row async for row in queryset[offset:offset + limit + 1]]
+        return rows[:limit], len(rows) > limit
+
+    async def book_page(self, offset, limit=PAGE_SIZE):
+        books = Book.objects.order_by('title', 'pk').values(*BOOK_FIELDS)
+        return await self.fetch(books, offset, limit)
+
+    async def search(self, query, offset=0, limit=INLINE_PAGE_SIZE):
+        books = search_books(Book.objects.all(), query).order_by('-search_rank', 'pk') \
+            .values(*BOOK_FIELDS, 'summary', 'search_rank')
+        return await self.fetch(books, offset, limit)
+
+
+def catalogue(context):
+    return context.bot_data['catalogue']
+
+
+def book_line(book):
+    return f"{book['title']} (ISBN {book['isbn']}) - {book['available_copies']} available"
+
+
+def page_reply(books, offset, has_more):
+    text = '\n'.join(f'{offset + n}. {book_line(book)}' for n, book in enumerate(books, 1))
+    buttons = []
+    if offset:
+        buttons.append(InlineKeyboardButton('< Previous', callback_data=f'{PAGE_CALLBACK}:{max(offset - PAGE_SIZE, 0)}'))
+    if has_more:
+        buttons.append(InlineKeyboardButton('Next >', callback_data=f'{PAGE_CALLBACK}:{offset + PAGE_SIZE}'))
+    return text or 'The catalogue is empty.', InlineKeyboardMarkup([buttons]) if buttons else None
+
+
+async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await context.bot.send_message(
+        chat_id=update.effective_chat.id,
+        text="I'm the library bot. /books lists the catalogue, /search <words> finds books, "
+             "and you can search inline from any chat.",
+    )
+
+
+async def get_books(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    books, has_more = await catalogue(context).book_page(0)
+    text, markup = page_reply(books, 0, has_more)
+    await context.bot.send_message(chat_id=update.effective_chat.id, text=text, reply_markup=markup)
+
+
+async def turn_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    offset = query.data.partition(':')[2]
+    offset = int(offset) if offset.isdigit() else 0
+    books, has_more = await catalogue(context).book_page(offset)
+    text, markup = page_reply(books, offset, has_more)
+    await query.answer()
+    await query.edit_message_text(text, reply_markup=markup)
+
+
+async def search(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = ' '.join(context.args)
+    if not query:
+        text = 'Usage: /search <words>'
+    else:
+        books, _ = await catalogue(context).search(query, limit=PAGE_SIZE)
+        text = '\n'.join(book_line(book) for book in books) or 'Nothing found.'
+    await context.bot.send_message(chat_id=update.effective_chat.id, text=text)
+
+
+async def inline_search(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    inline_query = update.inline_query
+    query = inline_query.query.strip()
+    if not query:
+        return
+    offset = int(inline_query.offset) if inline_query.offset.isdigit() else 0
+    books, has_more = await catalogue(context).search(query, offset)
+    results = [
+        InlineQueryResultArticle(
+            id=str(book['pk']),
+            title=book['title'],
+            description=(book['summary'] or '')[:SUMMARY_LENGTH],
+            input_message_content=InputTextMessageContent(book_line(book)),
+        )
+        for book in books
+    ]
+    await inline_query.answer(results, next_offset=str(offset + len(books)) if has_more else '')
+
+
+async def unknown(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await context.bot.send_message(chat_id=update.effective_chat.id, text="Sorry, I didn't understand that command.")
+
+
+def build_application(token=None, base_url=None, concurrent_updates=None, max_queries=None):
+    """
+    The bot's Application; token and API URL default to the TELEGRAM_* settings.
+    """
+    concurrent_updates = concurrent_updates or settings.TELEGRAM_BOT_CONCURRENT_UPDATES
+    application = ApplicationBuilder() \
+        .token(token or settings.TELEGRAM_BOT_TOKEN) \
+        .base_url(base_url or settings.TELEGRAM_API_URL) \
+        .concurrent_updates(concurrent_updates) \
+        .connection_pool_size(concurrent_updates) \
+        .pool_timeout(settings.TELEGRAM_BOT_POOL_TIMEOUT) \
+        .build()
+    application.bot_data['catalogue'] = Catalogue(max_queries or settings.TELEGRAM_BOT_MAX_QUERIES)
+    application.add_handlers([
+        CommandHandler('start', start),
+        CommandHandler(['books', 'get_books'], get_books),
+        CommandHandler('search', search),
+        CallbackQueryHandler(turn_page, pattern=rf'^{PAGE_CALLBACK}:'),
+        InlineQueryHandler(inline_search),
+        MessageHandler(filters.COMMAND, unknown),
+    ])
+    return application
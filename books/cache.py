@@ -0,0 +1,166 @@
+"""
+Response cache for the anonymous read endpoints.
+
+Rendered list/retrieve responses are stored in the ``RESPONSE_CACHE_ALIAS`` cache
+under a key made of the request path, query string and Accept header plus the
+current version of every model the endpoint renders. Saving or deleting one of
+those models bumps its version once the transaction commits (see books.signals),
+so only the entries that depend on it stop being addressed. Versions are per
+model, not per row: any saved book retires every cached book page. Every
+response carries an ETag and a matching ``If-None-Match`` gets a 304.
+"""
+import hashlib
+import time
+from functools import partial
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.http import parse_etags, quote_etag
+
+from . import routers
+
+KEY_PREFIX = 'response-cache'
+HITS_KEY = f'{KEY_PREFIX}:hits'
+MISSES_KEY = f'{KEY_PREFIX}:misses'
+
+
+def get_cache():
+    return caches[settings.RESPONSE_CACHE_ALIAS]
+
+
+def version_key(model):
+    return f'{KEY_PREFIX}:version:{model._meta.label_lower}'
+
+
+def initial_version():
+    # Seeded from the clock so a version key evicted from the cache never comes back
+    # with a value an older entry was stored under.
+    return time.time_ns()
+
+
+def bump_version(model):
+    cache, key = get_cache(), version_key(model)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, initial_version(), None)
+
+
+def bump_version_on_commit(model, using=None):
+    """
+    Bump the version of model when the current transaction commits (at once outside one).
+    Bumped any earlier, a reader could miss the cache, read the rows as they were before
+    the commit and store them under the new version until the next change.
+    """
+    transaction.on_commit(partial(bump_version, model), using=using)
+
+
+def current_versions(models):
+    cache = get_cache()
+    keys = [version_key(model) for model in models]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, initial_version(), None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def count(key):
+    cache = get_cache()
+    try:
+        cache.incr(key)
+    except ValueError:
+        if not cache.add(key, 1, None):
+            cache.incr(key)
+
+
+def stats():
+    counters = get_cache().get_many([HITS_KEY, MISSES_KEY])
+    return {'hits': counters.get(HITS_KEY, 0), 'misses': counters.get(MISSES_KEY, 0)}
+
+
+def etag_matches(request, etag):
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if not if_none_match:
+        return False
+    etags = parse_etags(if_none_match)
+    return '*' in etags or etag in etags or etag in [tag.removeprefix('W/') for tag in etags]
+
+
+class CachedResponseMixin:
+    """
+    Cache anonymous ``list`` and ``retrieve`` responses of a viewset.
+
+    ``cache_models`` lists every model whose rows end up in the response; a
+    change to any of them invalidates the cached responses of this viewset.
+    """
+    cache_models = ()
+
+    def cache_key(self, request):
+        versions = current_versions(self.cache_models)
+        # The bodies carry absolute URLs (links, images), so the host and scheme are part of the key.
+        fingerprint = hashlib.md5('\n'.join([
+            request.scheme,
+            request.get_host(),
+            request.path,
+            request.META.get('QUERY_STRING', ''),
+            request.META.get('HTTP_ACCEPT', ''),
+        ]).encode()).hexdigest()
+        return f'{KEY_PREFIX}:{self.basename}:{self.action}:{"-".join(map(str, versions))}:{fingerprint}'
+
+    def caches(self, request):
+        return bool(self.cache_models) and not request.user.is_authenticated
+
+    def cache_hit(self, request):
+        """
+        The cached response to request, or None after noting the key to store the response under.
+        """
+        key = self.cache_key(request)
+        entry = get_cache().get(key)
+        if entry is None:
+            count(MISSES_KEY)
+            self._response_cache_key = key
+            return None
+        count(HITS_KEY)
+        content, content_type, etag = entry
+        if etag_matches(request, etag):
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(content, content_type=content_type)
+        response['ETag'] = etag
+        response['Vary'] = 'Accept'
+        return response
+
+    def cached(self, handler, request, *args, **kwargs):
+        if not self.caches(request):
+            return handler(request, *args, **kwargs)
+        response = self.cache_hit(request)
+        if response is None:
+            # Served for minutes to come, so not from a replica that may not have the latest write yet.
+            with routers.primary():
+                return handler(request, *args, **kwargs)
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.cached(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached(super().retrieve, request, *args, **kwargs)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        key = getattr(self, '_response_cache_key', None)
+        if key is None or response.status_code != 200:
+            return response
+
+        response.render()
+        etag = quote_etag(hashlib.md5(response.content).hexdigest())
+        get_cache().set(key, (response.content, response['Content-Type'], etag), settings.RESPONSE_CACHE_TIMEOUT)
+        if etag_matches(request, etag):
+            response = HttpResponseNotModified()
+        response['ETag'] = etag
+        response['Vary'] = 'Accept'
+        return response
@@ -0,0 +1,119 @@
+"""
+Streaming export of the catalogue and its copies as CSV, JSON Lines or columnar JSON.
+
+Rows come from server-side cursors (``.iterator(chunk_size=...)``) and are
+encoded chunk by chunk, so memory stays flat and the first bytes are produced
+before the whole table has been read. The columnar format is one JSON object per
+chunk, ``{"columns": {name: [values]}}``, i.e. row groups as in Parquet.
+"""
+import csv
+import io
+import json
+from collections import defaultdict
+from itertools import islice
+
+from .models import Book, BookInstance
+
+CHUNK_SIZE = 2000
+LIST_SEPARATOR = '; '
+
+BOOK_COLUMNS = ('id', 'title', 'isbn', 'authors', 'genres', 'languages', 'pages', 'summary', 'description',
+                *Book.AVAILABILITY_FIELDS)
+COPY_COLUMNS = ('id', 'inventory', 'book_id', 'isbn', 'title', 'imprint', 'status', 'due_back', 'borrower')
+
+
+def author_name(last_name, first_name, middle_name):
+    return f'{last_name}, {" ".join(filter(None, (first_name, middle_name)))}'
+
+
+def related_names(field, book_ids, *columns):
+    """
+    {book id: 'name; name'} for one many-to-many field of the given books.
+    """
+    through = Book._meta.get_field(field).remote_field.through
+    target = Book._meta.get_field(field).m2m_reverse_field_name()
+    rows = through.objects.filter(book_id__in=book_ids).order_by(*(f'{target}__{column}' for column in columns)) \
+        .values_list('book_id', *(f'{target}__{column}' for column in columns))
+    names = defaultdict(list)
+    for book_id, *values in rows:
+        names[book_id].append(author_name(*values) if field == 'authors' else values[0])
+    return {book_id: LIST_SEPARATOR.join(values) for book_id, values in names.items()}
+
+
+def book_rows(chunk_size=CHUNK_SIZE):
+    # Plain tuples plus one query per many-to-many field and chunk: building model
+    # instances and prefetch caches for every book costs several times more.
+    books = Book.objects.order_by('pk').values_list(
+        'pk', 'title', 'isbn', 'pages', 'summary', 'description', *Book.AVAILABILITY_FIELDS,
+    )
+    for chunk in chunks(books.iterator(chunk_size=chunk_size), chunk_size):
+        book_ids = [row[0] for row in chunk]
+        authors = related_names('authors', book_ids, 'last_name', 'first_name', 'middle_name')
+        genres = related_names('genre', book_ids, 'name')
+        languages = related_names('language', book_ids, 'name')
+        for pk, title, isbn, *rest in chunk:
+            yield (pk, title, isbn, authors.get(pk, ''), genres.get(pk, ''), languages.get(pk, ''), *rest)
+
+
+def copy_rows(chunk_size=CHUNK_SIZE):
+    copies = BookInstance.objects.order_by('pk').values_list(
+        'pk', 'inventory', 'book_id', 'book__isbn', 'book__title', 'imprint', 'status', 'due_back',
+        'borrower__username',
+    )
+    yield from copies.iterator(chunk_size=chunk_size)
+
+
+def json_value(value):
+    return value if value is None or isinstance(value, (str, int, float)) else str(value)
+
+
+def encode_csv(columns, rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    yield buffer.getvalue()
+    for chunk in chunks(rows):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(chunk)
+        yield buffer.getvalue()
+
+
+def encode_jsonl(columns, rows):
+    for chunk in chunks(rows):
+        yield ''.join(
+            json.dumps(dict(zip(columns, map(json_value, row))), ensure_ascii=False) + '\n' for row in chunk
+        )
+
+
+def encode_columnar(columns, rows):
+    for chunk in chunks(rows):
+        data = {column: [json_value(value) for value in values] for column, values in zip(columns, zip(*chunk))}
+        yield json.dumps({'columns': data}, ensure_ascii=False) + '\n'
+
+
+def chunks(rows, size=CHUNK_SIZE):
+    rows = iter(rows)
+    while chunk := list(islice(rows, size)):
+        yield chunk
+
+
+DATASETS = {
+    'books': (BOOK_COLUMNS, book_rows),
+    'copies': (COPY_COLUMNS, copy_rows),
+}
+
+FORMATS = {
+    'csv': (encode_csv, 'text/csv', 'csv'),
+    'jsonl': (encode_jsonl, 'application/x-ndjson', 'jsonl'),
+    'columnar': (encode_columnar, 'application/x-ndjson', 'json'),
+}
+
+
+def export(dataset, fmt, chunk_size=CHUNK_SIZE):
+    """
+    Iterator of encoded text chunks for one of DATASETS in one of FORMATS.
+    """
+    columns, rows = DATASETS[dataset]
+    encode = FORMATS[fmt][0]
+    return encode(columns, rows(chunk_size))
@@ -0,0 +1,77 @@
+"""
+Facet counts of the catalogue: the number of books per genre, language and author.
+
+Over the whole catalogue, or over the books with an available copy, they are read
+off FacetCount, a few rows per facet from its (facet, count) indexes. Any other
+filter groups the matching books by each facet's values instead, ranked and cut to
+the limit in SQL, so the cost grows with the number of books matched.
+
+They are served by /books/facets/ (BookViewSet.facets) with the same filters as the
+list, not inside the list's pages: a client fetches them once per change of filters
+rather than with every page, and list responses stay as they are.
+"""
+from itertools import chain
+
+from django.db import connections
+from django.db.models import Count, F, Value
+
+from .models import Author, FacetCount, Genre, Language
+
+FACET_MODELS = {'genre': Genre, 'language': Language, 'author': Author}
+
+
+def stored_counts(limit, available=False):
+    """
+    {facet: [(value id, books)]} of the limit largest values of every facet, from FacetCount.
+    """
+    column = 'available_books' if available else 'books'
+    return {
+        facet: list(FacetCount.objects.filter(facet=facet, **{f'{column}__gt': 0})
+                    .order_by(f'-{column}', 'value_id').values_list('value_id', column)[:limit])
+        for facet in FacetCount.FACETS
+    }
+
+
+def aggregate_counts(books, limit):
+    """
+    {facet: [(value id, books)]} of the limit largest values of every facet among the books
+    of a queryset: one GROUP BY per facet, ordered and limited in SQL, all in one UNION ALL
+    where the database allows LIMIT in a compound query (one query per facet otherwise).
+    """
+    # Grouped from the books' side, so the raw WHERE of a search keeps the table it refers to.
+    books = books.order_by().prefetch_related(None)
+    queries = [
+        books.values(value=F(field)).annotate(facet=Value(facet), books=Count('pk', distinct=True))
+        .filter(value__isnull=False).order_by('-books', 'value').values_list('facet', 'value', 'books')[:limit]
+        for facet, field in FacetCount.FACETS.items()
+    ]
+    if connections[books.db].features.supports_slicing_ordering_in_compound:
+        rows = queries[0].union(*queries[1:], all=True)
+    else:
+        rows = chain.from_iterable(queries)
+    counts = {facet: [] for facet in FacetCount.FACETS}
+    for facet, value_id, n in rows:
+        counts[facet].append((value_id, n))
+    # UNION ALL keeps neither query's order.
+    return {facet: sorted(values, key=lambda count: (-count[1], count[0])) for facet, values in counts.items()}
+
+
+def display_name(value):
+    """
+    The name of a facet value; an author's without the middle name they don't have.
+    """
+    if isinstance(value, Author):
+        return f'{value.last_name}, {" ".join(filter(None, (value.first_name, value.middle_name)))}'
+    return str(value)
+
+
+def named(counts):
+    """
+    Counts as {facet: [{"id", "name", "count"}]}, largest first.
+    """
+    facets = {}
+    for facet, values in counts.items():
+        names = FACET_MODELS[facet].objects.in_bulk([value_id for value_id, _ in values])
+        facets[facet] = [{'id': value_id, 'name': display_name(names[value_id]), 'count': n}
+                         for value_id, n in values if value_id in names]
+    return facets
@@ -0,0 +1,173 @@
+"""
+A local stand-in for the Telegram Bot API, for tests and load tests of books.bot.
+
+FakeTelegramServer speaks just enough HTTP/1.1 and Bot API for an Application to
+poll it: tests queue updates with message(), inline_query() and callback_query(),
+the bot picks them up through getUpdates, and every other call it makes is
+recorded in ``calls`` as (method, params, seconds since the update it answers).
+"""
+import asyncio
+import itertools
+import json
+import time
+from contextlib import asynccontextmanager
+from urllib.parse import parse_qsl
+
+BOT_USER = {'id': 1, 'is_bot': True, 'first_name': 'Library', 'username': 'library_bot'}
+
+
+def user(user_id):
+    return {'id': user_id, 'is_bot': False, 'first_name': f'Reader {user_id}'}
+
+
+def chat(chat_id):
+    return {'id': chat_id, 'type': 'private'}
+
+
+def decode(value):
+    # Bot API clients JSON-encode everything except plain strings.
+    return json.loads(value) if value[:1] in ('{', '[') else value
+
+
+class FakeTelegramServer:
+    token = '123456:fake-token'
+
+    def __init__(self, host='127.0.0.1', port=0, max_poll_wait=1.0):
+        self.host, self.port = host, port
+        self.max_poll_wait = max_poll_wait
+        self.updates = []
+        self.calls = []
+        self.update_ids = itertools.count(1)
+        self.message_ids = itertools.count(1)
+        self.sent_at = {}
+        self.writers = set()
+
+    @property
+    def base_url(self):
+        return f'http://{self.host}:{self.port}/bot'
+
+    async def start(self):
+        self.new_updates = asyncio.Event()
+        self.new_calls = asyncio.Condition()
+        self.server = await asyncio.start_server(self.handle, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self.server.close()
+        for writer in list(self.writers):
+            writer.close()
+        await self.server.wait_closed()
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.stop()
+
+    @asynccontextmanager
+    async def polling(self, application):
+        """
+        Run application against this server for the duration of the block.
+        """
+        async with application:
+            await application.start()
+            await application.updater.start_polling(poll_interval=0, timeout=self.max_poll_wait)
+            try:
+                yield application
+            finally:
+                await application.updater.stop()
+                await application.stop()
+
+    def push(self, *keys, **update):
+        update['update_id'] = next(self.update_ids)
+        self.updates.append(update)
+        for key in keys:
+            self.sent_at[key] = time.perf_counter()
+        self.new_updates.set()
+        return update
+
+    def message(self, chat_id, text):
+        entities = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}] \
+            if text.startswith('/') else []
+        return self.push(('chat', chat_id), message={
+            'message_id': next(self.message_ids), 'date': int(time.time()), 'chat': chat(chat_id),
+            'from': user(chat_id), 'text': text, 'entities': entities,
+        })
+
+    def inline_query(self, user_id, query, offset=''):
+        query_id = f'{user_id}-{next(self.update_ids)}'
+        return self.push(('inline', query_id), inline_query={
+            'id': query_id, 'from': user(user_id), 'query': query, 'offset': offset,
+        })
+
+    def callback_query(self, chat_id, message_id, data):
+        query_id = f'{chat_id}-{next(self.update_ids)}'
+        return self.push(('chat', chat_id), ('callback', query_id), callback_query={
+            'id': query_id, 'from': user(chat_id), 'chat_instance': str(chat_id), 'data': data,
+            'message': {'message_id': message_id, 'date': int(time.time()), 'chat': chat(chat_id), 'text': '-'},
+        })
+
+    async def wait_for_calls(self, count, timeout=30):
+        async with self.new_calls:
+            await asyncio.wait_for(self.new_calls.wait_for(lambda: len(self.calls) >= count), timeout)
+        return self.calls
+
+    def calls_to(self, method):
+        return [params for name, params, _ in self.calls if name == method]
+
+    async def handle(self, reader, writer):
+        self.writers.add(writer)
+        try:
+            while request_line := await reader.readline():
+                path = request_line.decode().split(' ')[1]
+                headers = {}
+                while (line := await reader.readline()).strip():
+                    name, _, value = line.decode().partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+                params = {name: decode(value) for name, value in parse_qsl(body.decode(), keep_blank_values=True)}
+                result = await self.dispatch(path.rsplit('/', 1)[-1], params)
+                payload = json.dumps({'ok': True, 'result': result}).encode()
+                writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n'
+                             b'Content-Length: %d\r\n\r\n%s' % (len(payload), payload))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            pass
+        finally:
+            self.writers.discard(writer)
+            writer.close()
+
+    async def dispatch(self, method, params):
+        if method == 'getMe':
+            return BOT_USER
+        if method == 'deleteWebhook':
+            return True
+        if method == 'getUpdates':
+            return await self.get_updates(int(params.get('offset') or 0), float(params.get('timeout') or 0))
+
+        if 'inline_query_id' in params:
+            started = self.sent_at.get(('inline', params['inline_query_id']))
+        elif 'callback_query_id' in params:
+            started = self.sent_at.get(('callback', params['callback_query_id']))
+        else:
+            started = self.sent_at.get(('chat', int(params.get('chat_id') or 0)))
+        async with self.new_calls:
+            self.calls.append((method, params, time.perf_counter() - started if started else None))
+            self.new_calls.notify_all()
+        if method in ('sendMessage', 'editMessageText'):
+            return {
+                'message_id': int(params.get('message_id') or next(self.message_ids)), 'date': int(time.time()),
+                'chat': chat(int(params['chat_id'])), 'text': params['text'],
+            }
+        return True
+
+    async def get_updates(self, offset, timeout):
+        self.updates = [update for update in self.updates if update['update_id'] >= offset]
+        if not self.updates:
+            self.new_updates.clear()
+            try:
+                await asyncio.wait_for(self.new_updates.wait(), min(timeout, self.max_poll_wait))
+            except asyncio.TimeoutError:
+                pass
+        return self.updates[:100]
@@ -0,0 +1,306 @@
+"""
+Read-only serialization straight from ``.values()`` rows.
+
+For a serializer (with its ``?fields=``/``?expand=`` selection) compile_plan() works
+out once which columns to select, how to convert each one and which nested
+relations to fetch, as one reader function per output field. Nested
+relations are fetched with one ``.values()`` query each, shaped like the prefetch
+queries the serializers' eager-loading plans run, so rows come back in the same
+order; a list serializer with a ``restrict(queryset)`` method (e.g. the latest
+reviews of a book) has it applied to its query. The output renders to the same JSON bytes as the DRF serializer; fields
+that can't be compiled (method fields, dotted sources, ...) make compile_plan()
+raise Unsupported and the view falls back to the serializer.
+"""
+from collections import defaultdict
+from datetime import date
+from functools import lru_cache
+from operator import itemgetter
+
+from django.db.models import FileField as ModelFileField, UUIDField
+from rest_framework import fields as drf_fields
+from rest_framework import ISO_8601, relations, serializers
+from rest_framework.settings import api_settings
+
+from .images import ImageSrcsetField, srcset_urls
+from .metrics import timed
+
+# Fields whose to_representation() is a no-op on the Python value .values() returns.
+PASSTHROUGH_FIELDS = (drf_fields.CharField, drf_fields.IntegerField, drf_fields.BooleanField)
+
+
+class Unsupported(Exception):
+    pass
+
+
+def relation_of(model, source):
+    """
+    (related model, lookup from the related model back to model) for a to-many source.
+    """
+    for rel in model._meta.related_objects:
+        if rel.get_accessor_name() == source:
+            return rel.related_model, rel.field.name
+    field = model._meta.get_field(source)
+    if not field.many_to_many:
+        raise Unsupported(source)
+    return field.related_model, field.related_query_name()
+
+
+def file_url(model_field):
+    # Most rows share a handful of file names (the default images), so the storage URLs are memoized.
+    url = lru_cache(maxsize=4096)(model_field.storage.url)
+
+    def to_url(name, absolute_uri):
+        return absolute_uri(url(name)) if absolute_uri is not None else url(name)
+    return to_url
+
+
+# Field readers: each takes the related data and absolute_uri of a batch of rows and returns
+# the function reading one field from one row.
+
+def constant(get):
+    return lambda related, absolute_uri: get
+
+
+def converted(get, convert):
+    def get_converted(row):
+        value = get(row)
+        return None if value is None else convert(value)
+    return get_converted
+
+
+def related_items(index, get_key):
+    def make(related, absolute_uri):
+        grouped = related[index]
+        return lambda row: grouped.get(get_key(row), [])
+    return make
+
+
+def nested_item(plan, get_key):
+    def make(related, absolute_uri):
+        build = plan.builder(None, absolute_uri)
+        return lambda row: None if get_key(row) is None else build(row)
+    return make
+
+
+def file_item(to_url, get):
+    def make(related, absolute_uri):
+        def get_url(row):
+            name = get(row)
+            return to_url(name, absolute_uri) if name else None
+        return get_url
+    return make
+
+
+def srcset_item(get):
+    return lambda related, absolute_uri: lambda row: srcset_urls(get(row), absolute_uri)
+
+
+class Plan:
+    """
+    Compiled read path for one serializer selection over one model.
+    """
+
+    def __init__(self, serializer, model, prefix=''):
+        self.model = model
+        self.key = model._meta.pk.attname
+        self.columns = [prefix + self.key]
+        self.relations = []
+        self.names, self.getters = [], []
+        for field in serializer._readable_fields:
+            self.names.append(field.field_name)
+            self.getters.append(self.compile_field(field, prefix))
+
+    def column(self, name):
+        if name not in self.columns:
+            self.columns.append(name)
+        return name
+
+    def compile_field(self, field, prefix):
+        """
+        For one output field, the row column it passes through as is, or a function of the
+        related data and absolute_uri of a batch of rows returning the function that reads
+        the field's value from one row.
+        """
+        source = field.source
+        if '.' in source or source == '*':
+            raise Unsupported(field.field_name)
+
+        if isinstance(field, serializers.ListSerializer) or isinstance(field, relations.ManyRelatedField):
+            if prefix:
+                raise Unsupported(field.field_name)
+            model, lookup = relation_of(self.model, source)
+            if isinstance(field, relations.ManyRelatedField):
+                child_relation = field.child_relation
+                if not isinstance(child_relation, relations.PrimaryKeyRelatedField) or child_relation.pk_field:
+                    raise Unsupported(field.field_name)
+                child = None
+            else:
+                child = Plan(field.child, model)
+            self.relations.append((source, model, lookup, child, getattr(field, 'restrict', None)))
+            return related_items(len(self.relations) - 1, itemgetter(self.key))
+
+        if isinstance(field, serializers.BaseSerializer):
+            model_field = self.model._meta.get_field(source)
+            if not model_field.many_to_one:
+                raise Unsupported(field.field_name)
+            nested = Plan(field, model_field.related_model, prefix=f'{prefix}{source}__')
+            if nested.relations:
+                raise Unsupported(field.field_name)
+            self.columns += [column for column in nested.columns if column not in self.columns]
+            # Keyed by its own primary key column: selecting the foreign key as well would read
+            # the same column twice, which the window filters of restrict() can't select.
+            return nested_item(nested, itemgetter(nested.columns[0]))
+
+        column = self.column(prefix + source)
+        get = itemgetter(column)
+        if isinstance(field, relations.PrimaryKeyRelatedField):
+            if field.pk_field is not None:
+                raise Unsupported(field.field_name)
+            return column
+        if isinstance(field, relations.RelatedField) or isinstance(field, serializers.SerializerMethodField) \
+                or isinstance(field, drf_fields.ReadOnlyField):
+            raise Unsupported(field.field_name)
+        if isinstance(field, drf_fields.FileField):
+            model_field = self.model._meta.get_field(source)
+            if not isinstance(model_field, ModelFileField) or not getattr(field, 'use_url', True):
+                raise Unsupported(field.field_name)
+            return file_item(file_url(model_field), get)
+        if isinstance(field, ImageSrcsetField):
+            return srcset_item(get)
+        if type(field) in PASSTHROUGH_FIELDS or isinstance(field, drf_fields.ChoiceField) \
+                and all(isinstance(choice, str) for choice in field.choices):
+            return column
+        # Skip the to_representation() call of the common cases.
+        if type(field) is drf_fields.UUIDField and field.uuid_format == 'hex_verbose':
+            return constant(converted(get, str))
+        if type(field) is drf_fields.DateField and (getattr(field, 'format', api_settings.DATE_FORMAT) or '').lower() == ISO_8601:
+            return constant(converted(get, date.isoformat))
+        return constant(converted(get, field.to_representation))
+
+    def builder(self, related, absolute_uri):
+        """
+        Function building the output dict of one row, for the related data of its batch.
+        """
+        names = self.names
+        # Plain columns come out of the row in one itemgetter() call; the other fields replace
+        # their placeholders (the key column) after it. The trailing key keeps it a tuple.
+        read = itemgetter(*[self.key if callable(getter) else getter for getter in self.getters], self.key)
+        computed = [(index, make(related, absolute_uri)) for index, make in enumerate(self.getters) if callable(make)]
+
+        def build(row):
+            values = list(read(row))
+            for index, get in computed:
+                values[index] = get(row)
+            return dict(zip(names, values))
+        return build
+
+    def values(self, queryset, *extra):
+        """
+        queryset as the .values() rows this plan reads, keeping the default ordering columns.
+        """
+        ordering = [field.lstrip('-') for field in self.model._meta.ordering]
+        columns = list(dict.fromkeys([*self.columns, *extra, *ordering]))
+        return queryset.values(*columns)
+
+    def related_querysets(self, rows):
+        """
+        (lookup, child plan or None, query) for each to-many relation of the given parent rows.
+        """
+        keys = list(dict.fromkeys(row[self.key] for row in rows))
+        for source, model, lookup, child, restrict in self.relations:
+            # Through the parent's primary key, so the IN list is prepared as plain values, not instances.
+            queryset = model.objects.filter(**{f'{lookup}__{self.model._meta.pk.name}__in': keys})
+            if restrict is not None:
+                queryset = restrict(queryset)
+            if not keys:
+                queryset = queryset.none()
+            if child is None:
+                yield lookup, child, queryset.values_list(lookup, 'pk')
+            else:
+                yield lookup, child, child.values(queryset, lookup)
+
+    @staticmethod
+    def group(queryset, lookup, child, fetched, data):
+        """
+        {parent key: [child data]} from the rows fetched by one related query and the data built from them.
+        """
+        grouped = defaultdict(list)
+        if child is None:
+            # The JSON encoder would turn UUIDs into the same strings, one default() call at a time.
+            convert = str if isinstance(queryset.model._meta.pk, UUIDField) else None
+            for parent, pk in fetched:
+                grouped[parent].append(convert(pk) if convert else pk)
+        else:
+            for child_row, item in zip(fetched, data):
+                grouped[child_row[lookup]].append(item)
+        return grouped
+
+    def fetch_related(self, rows, absolute_uri):
+        """
+        For each to-many relation, {parent key: [child data]} for the given parent rows.
+        """
+        related = []
+        for lookup, child, queryset in self.related_querysets(rows):
+            fetched = list(queryset)
+            data = child.build_rows(fetched, absolute_uri) if child is not None else None
+            related.append(self.group(queryset, lookup, child, fetched, data))
+        return related
+
+    async def afetch_related(self, rows, absolute_uri):
+        related = []
+        for lookup, child, queryset in self.related_querysets(rows):
+            fetched = [row async for row in queryset]
+            data = await child.abuild_rows(fetched, absolute_uri) if child is not None else None
+            related.append(self.group(queryset, lookup, child, fetched, data))
+        return related
+
+    def build_rows(self, rows, absolute_uri):
+        rows = list(rows)
+        build = self.builder(self.fetch_related(rows, absolute_uri), absolute_uri)
+        return [build(row) for row in rows]
+
+    async def abuild_rows(self, rows, absolute_uri):
+        build = self.builder(await self.afetch_related(rows, absolute_uri), absolute_uri)
+        return [build(row) for row in rows]
+
+    @staticmethod
+    def absolute_uri(request):
+        return lru_cache(maxsize=None)(request.build_absolute_uri) if request is not None else None
+
+    @timed
+    def serialize(self, rows, request=None):
+        """
+        Response data for the .values() rows, as the serializer would render it for request.
+        """
+        return self.build_rows(rows, self.absolute_uri(request))
+
+    @timed
+    async def aserialize(self, rows, request=None):
+        """
+        serialize() with the nested relations fetched through the async ORM; rows must be a list.
+        """
+        return await self.abuild_rows(rows, self.absolute_uri(request))
+
+
+@lru_cache(maxsize=256)
+def compile_plan(serializer_class, fields=None, expand=()):
+    """
+    Plan for serializer_class with the given sparse fieldset; raises Unsupported.
+    """
+    kwargs = {'fields': fields, 'expand': expand} if hasattr(serializer_class, 'selected_fields') else {}
+    serializer = serializer_class(**kwargs)
+    return Plan(serializer, serializer.Meta.model)
+
+
+def get_plan(serializer_class, fields=None, expand=()):
+    # fields and expand come from the query string: key the cache on the selection they make,
+    # so unknown or reordered names share its plan instead of filling the cache.
+    if hasattr(serializer_class, 'selected_fields'):
+        fields = serializer_class.selected_fields(fields, expand)
+        expand = [name for name in serializer_class.expandable_fields() if name in expand and name in fields]
+    else:
+        fields, expand = None, ()
+    try:
+        return compile_plan(serializer_class, tuple(fields) if fields is not None else None, tuple(expand))
+    except Unsupported:
+        return None
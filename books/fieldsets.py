@@ -0,0 +1,154 @@
+"""
+Sparse fieldsets: ``?fields=`` and ``?expand=`` for the API viewsets.
+
+``?fields=id,title`` trims a response to the named fields. ``?expand=authors`` swaps
+the compact form of a relation listed in a serializer's ``Meta.expandable_fields``
+for its full nested serializer. Viewsets with a ``compact_serializer_class`` use it
+for list actions, so lists stay small unless a client asks for more. The queryset
+loads only what the chosen fields need: ``only()`` for columns, prefetches only
+for relations that will be rendered.
+
+Actions listed in a viewset's ``fast_read_actions`` skip the serializer when
+books.fastpath can compile it: the queryset becomes ``.values()`` rows and the
+compiled plan builds the response data.
+"""
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.response import Response
+
+from .fastpath import get_plan
+from .metrics import serializing
+
+
+class SparseFieldsetSerializerMixin:
+    """
+    ModelSerializer mixin that takes ``fields`` and ``expand`` keyword arguments.
+
+    ``Meta.default_fields`` (default: ``Meta.fields``) is what renders when no fields
+    are asked for; ``Meta.expandable_fields`` maps a field name to a callable
+    returning its expanded field.
+    """
+
+    def __init__(self, *args, fields=None, expand=(), **kwargs):
+        super().__init__(*args, **kwargs)
+        selected = self.selected_fields(fields, expand)
+        for name in list(self.fields):
+            if name not in selected:
+                self.fields.pop(name)
+        for name, make_field in self.expandable_fields().items():
+            if name in selected and name in expand:
+                self.fields[name] = make_field()
+
+    @classmethod
+    def expandable_fields(cls):
+        return getattr(cls.Meta, 'expandable_fields', {})
+
+    @classmethod
+    def selected_fields(cls, fields=None, expand=()):
+        wanted = set(getattr(cls.Meta, 'default_fields', cls.Meta.fields) if fields is None else fields)
+        wanted.update(name for name in expand if name in cls.expandable_fields())
+        return [name for name in cls.Meta.fields if name in wanted]
+
+    @classmethod
+    def columns(cls, queryset, names):
+        """
+        Concrete columns of queryset's model behind the given field names, plus whatever
+        the primary key, default ordering and select_related() need.
+        """
+        opts = queryset.model._meta
+        columns = {opts.pk.name, *(field.lstrip('-') for field in opts.ordering)}
+        if isinstance(queryset.query.select_related, dict):
+            columns.update(queryset.query.select_related)
+        for name in names:
+            field = next((field for field in opts.concrete_fields if field.name == name), None)
+            if field is not None:
+                columns.add(name)
+        return sorted(columns)
+
+    @classmethod
+    def setup_eager_loading(cls, queryset, fields=None, expand=()):
+        """
+        Restrict queryset to the columns the selected fields read; serializers with
+        relations extend this with their prefetch plan.
+        """
+        return queryset.only(*cls.columns(queryset, cls.selected_fields(fields, expand)))
+
+
+class SparseFieldsetMixin:
+    """
+    Viewset mixin feeding ``?fields=``/``?expand=`` to a SparseFieldsetSerializerMixin
+    serializer and loading the queryset to match on safe methods.
+    """
+    compact_serializer_class = None
+    compact_actions = ('list',)
+    fast_read_actions = ()
+    fields_query_param = 'fields'
+    expand_query_param = 'expand'
+
+    def requested_names(self, param):
+        value = self.request.query_params.get(param)
+        if value is None:
+            return None
+        return [name.strip() for name in value.split(',') if name.strip()]
+
+    def sparse_fieldset(self):
+        if self.request is None or self.request.method not in SAFE_METHODS:
+            return None, ()
+        return self.requested_names(self.fields_query_param), self.requested_names(self.expand_query_param) or ()
+
+    def get_serializer_class(self):
+        if self.compact_serializer_class is not None and self.action in self.compact_actions:
+            return self.compact_serializer_class
+        return super().get_serializer_class()
+
+    def get_serializer(self, *args, **kwargs):
+        if issubclass(self.get_serializer_class(), SparseFieldsetSerializerMixin):
+            fields, expand = self.sparse_fieldset()
+            kwargs.setdefault('fields', fields)
+            kwargs.setdefault('expand', expand)
+        return super().get_serializer(*args, **kwargs)
+
+    def fast_plan(self):
+        """
+        The compiled books.fastpath plan for this request, or None to go through the serializer.
+        """
+        if self.action not in self.fast_read_actions or self.request.method not in SAFE_METHODS:
+            return None
+        return get_plan(self.get_serializer_class(), *self.sparse_fieldset())
+
+    def filter_queryset(self, queryset):
+        # Here rather than in get_queryset() so views that override get_queryset() get it too.
+        queryset = super().filter_queryset(queryset)
+        serializer_class = self.get_serializer_class()
+        plan = self.fast_plan()
+        if plan is not None:
+            queryset = plan.values(queryset, *getattr(self.paginator, 'key_columns', ()))
+        elif self.request.method in SAFE_METHODS and issubclass(serializer_class, SparseFieldsetSerializerMixin):
+            queryset = serializer_class.setup_eager_loading(queryset, *self.sparse_fieldset())
+        return queryset
+
+    def response_data(self, instance, many=False):
+        """
+        Response data for instance (rows with many), built by the fast plan when there is one,
+        timed as serialization for books.metrics.
+        """
+        plan = self.fast_plan()
+        with serializing():
+            if plan is None:
+                return self.get_serializer(instance, many=many).data
+            data = plan.serialize(instance if many else [instance], self.request)
+            return data if many else data[0]
+
+    def list(self, request, *args, **kwargs):
+        return self.list_response(self.get_queryset())
+
+    def list_response(self, queryset):
+        """
+        list() of queryset, for actions listing other rows than get_queryset()'s.
+        """
+        queryset = self.filter_queryset(queryset)
+        page = self.paginate_queryset(queryset)
+        data = self.response_data(queryset if page is None else page, many=True)
+        return Response(data) if page is None else self.get_paginated_response(data)
+
+    def retrieve(self, request, *args, **kwargs):
+        return Response(self.response_data(self.get_object()))
@@ -0,0 +1,76 @@
+import copy
+
+from django_filters import rest_framework as filters
+from rest_framework.filters import SearchFilter
+
+from .models import Book, BookInstance
+from .search import search_authors, search_books
+
+
+class BookSearchFilter(SearchFilter):
+    """
+    ``?search=`` backed by the full-text index in books.search instead of icontains scans.
+    Results are ordered by relevance unless the client asks for an explicit ordering.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        terms = self.get_search_terms(request)
+        if not terms:
+            return queryset
+        queryset = search_books(queryset, ' '.join(terms))
+        if 'ordering' not in request.query_params:
+            queryset = queryset.order_by('-search_rank', 'pk')
+        return queryset
+
+
+class AuthorSearchFilter(SearchFilter):
+    """
+    ``?search=`` on author names through the name index in books.search, prefix-matching
+    every term like the book search.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        terms = self.get_search_terms(request)
+        if not terms:
+            return queryset
+        return search_authors(queryset, ' '.join(terms))
+
+
+class BookFilter(filters.FilterSet):
+    """
+    ``?title=`` and exact/range filters on the counters of Book, e.g. ``?rating_mean__gte=4``.
+    ``?available=`` (``?available__gt=0`` and so on) is short for ``?available_copies=``.
+    """
+    aliases = {'available_copies': 'available'}
+
+    class Meta:
+        model = Book
+        fields = {
+            'title': ['exact'],
+            **{field: ['exact', 'gt', 'gte', 'lt', 'lte']
+               for field in (*Book.AVAILABILITY_FIELDS, *Book.RATING_FIELDS, 'rating_mean')},
+        }
+
+    @classmethod
+    def get_filters(cls):
+        base_filters = super().get_filters()
+        for name, base_filter in list(base_filters.items()):
+            field, _, lookup = name.partition('__')
+            if field in cls.aliases:
+                base_filters['__'.join(filter(None, (cls.aliases[field], lookup)))] = copy.deepcopy(base_filter)
+        return base_filters
+
+
+class BookInstanceFilter(filters.FilterSet):
+    """
+    ``?status=`` and ``?overdue=true|false`` for the copy and loan lists, the latter on
+    the database annotation of BookInstance.is_overdue.
+    """
+    overdue = filters.BooleanFilter(method='filter_overdue')
+
+    class Meta:
+        model = BookInstance
+        fields = ['status']
+
+    def filter_overdue(self, queryset, name, value):
+        return queryset.with_overdue().filter(is_overdue=value)
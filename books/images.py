@@ -0,0 +1,182 @@
+"""
+Resized derivatives of the book covers and author photos.
+
+Each image file is decoded once, off the request, and saved at every width of
+IMAGE_DERIVATIVE_WIDTHS it is wider than (its own width otherwise) in every format
+of IMAGE_DERIVATIVE_FORMATS. A derivative is named after the hash of the source
+image's content and its width, so its URL only ever serves those bytes and can be
+cached as immutable (``Cache-Control: public, max-age=31536000, immutable`` on
+``MEDIA_URL/derivatives/``); the default images shared by most rows are made once.
+
+The names are stored in the ``image_srcset`` column of every row showing the image,
+keyed by format, next to the name of the image they were made from, and
+ImageSrcsetField renders them as ``srcset`` attribute values. Saving a row with a
+new image clears the column and queues the image for the worker threads of the
+process (see books.signals); rows written in bulk, and work lost to a restarting
+worker, are picked up by the process_images command.
+"""
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connections, transaction
+from PIL import Image, ImageOps
+from rest_framework import serializers
+
+from .models import Author, Book
+
+DERIVATIVES_DIR = 'derivatives'
+# Models with an ``image`` and its ``image_srcset``.
+IMAGE_MODELS = (Book, Author)
+# Pillow format and file extension of each derivative format.
+FORMATS = {'webp': ('WEBP', 'webp'), 'jpeg': ('JPEG', 'jpg')}
+
+logger = logging.getLogger(__name__)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def derivative_name(digest, width, fmt):
+    return f'{DERIVATIVES_DIR}/{digest[:2]}/{digest}-{width}w.{FORMATS[fmt][1]}'
+
+
+def open_image(data):
+    image = ImageOps.exif_transpose(Image.open(BytesIO(data)))
+    if image.mode not in ('RGB', 'RGBA'):
+        transparent = 'A' in image.getbands() or 'transparency' in image.info
+        image = image.convert('RGBA' if transparent else 'RGB')
+    return image
+
+
+def encode(image, width, fmt):
+    """
+    image scaled down to width, encoded as fmt.
+    """
+    if image.width > width:
+        image = image.resize((width, max(round(image.height * width / image.width), 1)), Image.Resampling.LANCZOS)
+    if image.mode == 'RGBA' and fmt == 'jpeg':
+        # JPEG has no alpha channel: flatten onto white, not black.
+        background = Image.new('RGB', image.size, 'white')
+        background.paste(image, mask=image.getchannel('A'))
+        image = background
+    buffer = BytesIO()
+    image.save(buffer, FORMATS[fmt][0], quality=settings.IMAGE_DERIVATIVE_QUALITY)
+    return buffer.getvalue()
+
+
+def save_derivative(storage, name, image, width, fmt):
+    """
+    Save image at width as fmt under name unless it exists; returns the name it is stored under.
+    """
+    if storage.exists(name):
+        return name
+    saved = storage.save(name, ContentFile(encode(image, width, fmt)))
+    if saved != name:
+        # The storage renamed this copy: another worker saved the same bytes under name meanwhile.
+        if storage.exists(name):
+            storage.delete(saved)
+        else:
+            return saved
+    return name
+
+
+def make_derivatives(name, storage=default_storage):
+    """
+    The stored srcset of image file name, saving the derivatives that don't exist yet.
+    """
+    with storage.open(name) as source:
+        data = source.read()
+    digest = hashlib.sha256(data).hexdigest()[:32]
+    image = open_image(data)
+    widths = sorted({min(width, image.width) for width in settings.IMAGE_DERIVATIVE_WIDTHS})
+    srcset = {'source': name}
+    for fmt in settings.IMAGE_DERIVATIVE_FORMATS:
+        srcset[fmt] = []
+        for width in widths:
+            derivative = derivative_name(digest, width, fmt)
+            srcset[fmt].append([width, save_derivative(storage, derivative, image, width, fmt)])
+    return srcset
+
+
+def process_image(model, name):
+    """
+    Make the derivatives of image file name and record them on the model rows showing it.
+    Returns the number of rows updated.
+    """
+    try:
+        srcset = make_derivatives(name)
+    except (OSError, ValueError, Image.DecompressionBombError) as error:
+        logger.warning('No derivatives of %s: %s', name, error)
+        return 0
+    # The querysets of IMAGE_MODELS send bulk_changed on update().
+    return model.objects.filter(image=name).exclude(image_srcset=srcset).update(image_srcset=srcset)
+
+
+def process_in_worker(model, name):
+    try:
+        return process_image(model, name)
+    except Exception:
+        logger.exception('Processing %s failed', name)
+        return 0
+    finally:
+        # The connections this worker thread opened.
+        connections.close_all()
+
+
+def pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(settings.IMAGE_WORKERS, thread_name_prefix='images')
+    return _pool
+
+
+def schedule(model, name):
+    """
+    Process image file name of model in the worker threads once the current transaction commits.
+    """
+    transaction.on_commit(lambda: pool().submit(process_in_worker, model, name))
+
+
+def pending_images(model, everything=False):
+    """
+    Names of the images of model rows whose derivatives are missing (every image with everything).
+    """
+    rows = model.objects.order_by().values_list('image', 'image_srcset__source').distinct()
+    return sorted({name for name, source in rows if name and (everything or name != source)})
+
+
+def srcset_urls(stored, absolute_uri=None):
+    """
+    {format: srcset attribute value} of a stored srcset.
+    """
+    urls = {}
+    for fmt in settings.IMAGE_DERIVATIVE_FORMATS:
+        candidates = []
+        for width, name in stored.get(fmt, ()):
+            url = default_storage.url(name)
+            candidates.append(f'{absolute_uri(url) if absolute_uri else url} {width}w')
+        if candidates:
+            urls[fmt] = ', '.join(candidates)
+    return urls
+
+
+class ImageSrcsetField(serializers.Field):
+    """
+    The derivatives of an image as ``{format: "url 160w, url 320w, ..."}``, from its ``image_srcset``;
+    empty until they are made.
+    """
+
+    def __init__(self, **kwargs):
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        request = self.context.get('request')
+        return srcset_urls(value, request.build_absolute_uri if request is not None else None)
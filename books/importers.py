@@ -0,0 +1,408 @@
+"""
+Bulk import of catalogue records from CSV, JSON Lines or MARC21 (ISO 2709).
+
+Every reader yields ``(line, record)`` pairs where record is a plain dict::
+
+    title, isbn, authors [(first, middle, last)], genres [str], languages [str],
+    summary, description, pages, inventory, imprint, status
+
+Rows are imported chunk by chunk, one transaction per chunk: authors, genres and
+languages are resolved with one query per chunk, books are deduplicated on isbn
+and copies on inventory, and everything is written with bulk_create/bulk_update.
+Only the current chunk is held in memory.
+"""
+import csv
+import functools
+import io
+import json
+import re
+import reprlib
+from collections import Counter
+from itertools import islice
+
+from django.core.exceptions import ValidationError
+from django.core.validators import MaxLengthValidator
+from django.db import transaction
+
+from . import search
+from .models import Author, Book, BookInstance, FacetCount, Genre, Language, facet_links_table
+
+LIST_SEPARATOR = ';'
+BOOK_FIELDS = ('title', 'summary', 'description', 'pages')
+COPY_FIELDS = ('book_id', 'imprint', 'status')
+
+
+class RecordError(ValueError):
+    pass
+
+
+def split_list(value):
+    if value is None:
+        return []
+    if isinstance(value, (list, tuple)):
+        return [item for item in value if item]
+    return [item.strip() for item in str(value).split(LIST_SEPARATOR) if item.strip()]
+
+
+def text(value, label, default=''):
+    """
+    value as stripped text: numbers are taken as written, other non-strings are an error.
+    """
+    if value is None:
+        return default
+    if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+        raise RecordError(f'{label} {reprlib.repr(value)} is not text')
+    return str(value).strip() or default
+
+
+@functools.lru_cache(maxsize=None)
+def field_checks(model, name):
+    """
+    The model field, its form field and the model validators the form field doesn't
+    cover (the integer range of the database, for one).
+    """
+    field = model._meta.get_field(name)
+    return field, field.formfield(required=False), [
+        validator for validator in field.validators if not isinstance(validator, MaxLengthValidator)
+    ]
+
+
+def checked(model, name, value, label=None):
+    """
+    value converted and validated as the model field that stores it would be in a form
+    (max_length, range, choices) and by the field's own validators.
+    """
+    field, form_field, validators = field_checks(model, name)
+    try:
+        converted = field.to_python(form_field.clean(value))
+        if converted is not None:
+            for validator in validators:
+                validator(converted)
+    except ValidationError as error:
+        raise RecordError(f'{label or name} {reprlib.repr(value)}: {" ".join(error.messages)}')
+    return converted
+
+
+def parse_author(value):
+    """
+    "Last, First Middle" (or a dict of Author fields) -> (first, middle, last).
+    """
+    if isinstance(value, dict):
+        first, middle, last = (text(value.get(name), f'author {name}')
+                               for name in ('first_name', 'middle_name', 'last_name'))
+    else:
+        last, _, given = (part.strip() for part in text(value, 'author').partition(','))
+        first, _, middle = given.partition(' ')
+    if not last:
+        raise RecordError(f'Author {value!r} has no last name')
+    return tuple(
+        checked(Author, name, part, f'author {name}')
+        for name, part in (('first_name', first.strip()), ('middle_name', middle.strip() or None),
+                           ('last_name', last.strip()))
+    )
+
+
+def clean_record(record):
+    """
+    Validate and normalize a raw record against the model fields it fills, raising
+    RecordError on bad input.
+    """
+    title = text(record.get('title'), 'title')
+    isbn = text(record.get('isbn'), 'isbn')
+    if not title:
+        raise RecordError('title is required')
+    if not isbn:
+        raise RecordError('isbn is required')
+
+    return {
+        'title': checked(Book, 'title', title),
+        'isbn': checked(Book, 'isbn', isbn),
+        'authors': [parse_author(author) for author in split_list(record.get('authors'))],
+        'genres': [checked(Genre, 'name', text(name, 'genre'), 'genre') for name in split_list(record.get('genres'))],
+        'languages': [checked(Language, 'name', text(name, 'language'), 'language')
+                      for name in split_list(record.get('languages'))],
+        'summary': text(record.get('summary'), 'summary', Book._meta.get_field('summary').default),
+        'description': text(record.get('description'), 'description'),
+        'pages': checked(Book, 'pages', text(record.get('pages'), 'pages') or None),
+        'inventory': checked(BookInstance, 'inventory', text(record.get('inventory'), 'inventory') or None),
+        'imprint': checked(BookInstance, 'imprint', text(record.get('imprint'), 'imprint')),
+        'status': checked(BookInstance, 'status', text(record.get('status'), 'status', 'm')),
+    }
+
+
+def text_stream(fileobj):
+    return fileobj if isinstance(fileobj, io.TextIOBase) else io.TextIOWrapper(fileobj, encoding='utf-8-sig')
+
+
+def read_csv(fileobj):
+    reader = csv.DictReader(text_stream(fileobj))
+    for record in reader:
+        yield reader.line_num, record
+
+
+def read_jsonl(fileobj):
+    for line_number, line in enumerate(text_stream(fileobj), start=1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as error:
+            yield line_number, error
+            continue
+        yield line_number, record if isinstance(record, dict) else RecordError('a JSON object is expected')
+
+
+MARC_RECORD_END = b'\x1d'
+MARC_FIELD_END = b'\x1e'
+MARC_SUBFIELD = b'\x1f'
+
+
+def marc_fields(raw):
+    """
+    Parse one ISO 2709 record into {tag: [field]}, a field being the control field
+    text or a list of (code, value) subfields.
+    """
+    base_address = int(raw[12:17])
+    directory = raw[24:base_address - 1]
+    fields = {}
+    for offset in range(0, len(directory) - len(directory) % 12, 12):
+        tag = directory[offset:offset + 3].decode('ascii')
+        length, start = int(directory[offset + 3:offset + 7]), int(directory[offset + 7:offset + 12])
+        data = raw[base_address + start:base_address + start + length].rstrip(MARC_FIELD_END)
+        if tag < '010':
+            fields.setdefault(tag, []).append(data.decode('utf-8', 'replace'))
+        else:
+            subfields = [(chunk[:1].decode('ascii', 'replace'), chunk[1:].decode('utf-8', 'replace').strip())
+                         for chunk in data[2:].split(MARC_SUBFIELD) if chunk]
+            fields.setdefault(tag, []).append(subfields)
+    return fields
+
+
+def subfield_values(fields, tag, codes='a'):
+    return [value for field in fields.get(tag, []) for code, value in field if code in codes and value]
+
+
+def marc_record(fields):
+    strip = ' /:;,.'
+    title = ' '.join(subfield_values(fields, '245', 'ab')).strip(strip)
+    isbn = next(iter(subfield_values(fields, '020')), '').split(' ')[0]
+    languages = subfield_values(fields, '041')
+    if not languages and fields.get('008') and len(fields['008'][0]) >= 38:
+        languages = [fields['008'][0][35:38].strip()]
+    pages = re.search(r'\d+', ' '.join(subfield_values(fields, '300')))
+    publication = subfield_values(fields, '264', 'abc') or subfield_values(fields, '260', 'abc')
+    return {
+        'title': title,
+        'isbn': isbn,
+        'authors': [name.strip(strip) for name in subfield_values(fields, '100') + subfield_values(fields, '700')],
+        'genres': [name.strip(strip) for name in subfield_values(fields, '655') + subfield_values(fields, '650')],
+        'languages': [language for language in languages if language],
+        'summary': ' '.join(subfield_values(fields, '520')),
+        'description': ' '.join([title, *publication, *subfield_values(fields, '300', 'abc')]).strip(),
+        'pages': pages.group() if pages else None,
+        'inventory': next(iter(subfield_values(fields, '852', 'p')), None),
+        'imprint': ' '.join(publication).strip(strip),
+    }
+
+
+def read_marc(fileobj):
+    record_number = 0
+    while True:
+        leader = fileobj.read(5)
+        if not leader.strip():
+            return
+        record_number += 1
+        try:
+            raw = leader + fileobj.read(int(leader) - 5)
+            yield record_number, marc_record(marc_fields(raw))
+        except (ValueError, IndexError) as error:
+            yield record_number, RecordError(f'malformed MARC record: {error}')
+            # Resynchronize on the next record terminator.
+            while (byte := fileobj.read(1)) and byte != MARC_RECORD_END:
+                pass
+
+
+READERS = {
+    'csv': read_csv,
+    'jsonl': read_jsonl,
+    'marc': read_marc,
+}
+
+
+def update_fields(instance, values, fields):
+    """
+    Copy values onto instance, returning whether anything changed.
+    """
+    changed = False
+    for field in fields:
+        if getattr(instance, field) != values[field]:
+            setattr(instance, field, values[field])
+            changed = True
+    return changed
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+class ImportReport:
+    max_errors = 1000
+
+    def __init__(self):
+        self.rows = 0
+        self.created_books = self.updated_books = 0
+        self.created_copies = self.updated_copies = 0
+        self.error_count = 0
+        self.errors = []
+
+    def error(self, line, message):
+        self.error_count += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append({'line': line, 'error': str(message)})
+
+    def as_dict(self):
+        return {
+            'rows': self.rows,
+            'created_books': self.created_books,
+            'updated_books': self.updated_books,
+            'created_copies': self.created_copies,
+            'updated_copies': self.updated_copies,
+            'error_count': self.error_count,
+            'errors': self.errors,
+        }
+
+
+class CatalogueImporter:
+    def __init__(self, chunk_size=2000):
+        self.chunk_size = chunk_size
+        self.report = ImportReport()
+
+    def run(self, rows):
+        """
+        Import (line, record) pairs as produced by one of READERS.
+        """
+        for chunk in chunked(rows, self.chunk_size):
+            records = []
+            for line, record in chunk:
+                self.report.rows += 1
+                try:
+                    if isinstance(record, Exception):
+                        raise record
+                    records.append((line, clean_record(record)))
+                except (RecordError, ValueError) as error:
+                    self.report.error(line, error)
+            if records:
+                with transaction.atomic():
+                    self.import_records(records)
+        return self.report
+
+    def import_records(self, records):
+        book_ids, created, changed = self.save_books(records)
+        relinked = self.link('author', book_ids, records, 'authors', self.resolve_authors(records))
+        self.link('genre', book_ids, records, 'genres', self.resolve_named(Genre, records, 'genres'))
+        self.link('language', book_ids, records, 'languages', self.resolve_named(Language, records, 'languages'))
+        self.save_copies(book_ids, records)
+
+        # New books are indexed straight from the records; changed ones may keep
+        # authors from earlier imports, so their documents are rebuilt from the database.
+        latest = {record['isbn']: record for _, record in records}
+        search.index_documents(
+            (book_ids[isbn], record['title'], ' '.join(' '.join(filter(None, author)) for author in record['authors']),
+             record['summary'], record['description'], isbn)
+            for isbn, record in latest.items() if isbn in created
+        )
+        search.index_books((changed | relinked) - {book_ids[isbn] for isbn in created})
+
+    def save_books(self, records):
+        """
+        Create or update one Book per isbn in the chunk; the last record for an isbn wins.
+        Returns ({isbn: book id}, created isbns, ids of updated books).
+        """
+        latest = {record['isbn']: record for _, record in records}
+        existing = list(Book.objects.filter(isbn__in=latest).only('pk', 'isbn', *BOOK_FIELDS))
+        changed = [book for book in existing if update_fields(book, latest[book.isbn], BOOK_FIELDS)]
+        Book.objects.bulk_update(changed, BOOK_FIELDS)
+        self.report.updated_books += len(changed)
+        book_ids = {book.isbn: book.pk for book in existing}
+
+        new = [Book(isbn=isbn, **{field: record[field] for field in BOOK_FIELDS})
+               for isbn, record in latest.items() if isbn not in book_ids]
+        Book.objects.bulk_create(new)
+        self.report.created_books += len(new)
+        if all(book.pk is not None for book in new):
+            book_ids.update((book.isbn, book.pk) for book in new)
+        else:
+            # The backend can't return ids from bulk inserts.
+            book_ids.update(Book.objects.filter(isbn__in=[book.isbn for book in new]).values_list('isbn', 'pk'))
+        return book_ids, {book.isbn for book in new}, {book.pk for book in changed}
+
+    @staticmethod
+    def author_ids(last_names):
+        known = {}
+        rows = Author.objects.filter(last_name__in=last_names).order_by('pk') \
+            .values_list('first_name', 'middle_name', 'last_name', 'pk')
+        for first, middle, last, pk in rows:
+            known.setdefault((first, middle or None, last), pk)
+        return known
+
+    def resolve_authors(self, records):
+        wanted = {author for _, record in records for author in record['authors']}
+        known = self.author_ids({last for _, _, last in wanted})
+        missing = [key for key in wanted if key not in known]
+        if missing:
+            Author.objects.bulk_create(Author(first_name=first, middle_name=middle, last_name=last)
+                                       for first, middle, last in missing)
+            known.update(self.author_ids({last for _, _, last in missing}))
+            search.index_authors(known[key] for key in missing)
+        return known
+
+    def resolve_named(self, model, records, key):
+        wanted = {name for _, record in records for name in record[key]}
+        known = dict(model.objects.filter(name__in=wanted).values_list('name', 'pk'))
+        if wanted - known.keys():
+            model.objects.bulk_create([model(name=name) for name in wanted - known.keys()], ignore_conflicts=True)
+            known.update(model.objects.filter(name__in=wanted - known.keys()).values_list('name', 'pk'))
+        return known
+
+    def link(self, facet, book_ids, records, key, targets):
+        """
+        Add the missing book links of the chunk to the values of a FacetCount facet, returning
+        the ids of the books that got new ones.
+        """
+        through, target_field = facet_links_table(facet)
+        links = {(book_ids[record['isbn']], targets[target]) for _, record in records for target in record[key]}
+        links -= set(through.objects.filter(book_id__in={book_id for book_id, _ in links})
+                     .values_list('book_id', target_field))
+        through.objects.bulk_create(
+            [through(book_id=book_id, **{target_field: target_id}) for book_id, target_id in links],
+            ignore_conflicts=True,
+        )
+        # bulk_create() sends no m2m_changed.
+        FacetCount.objects.link(facet, links)
+        if facet == 'author':
+            Author.objects.move_book_counts(Counter(author_id for _, author_id in links))
+        return {book_id for book_id, _ in links}
+
+    def save_copies(self, book_ids, records):
+        copies = {record['inventory']: record for _, record in records if record['inventory']}
+        existing = list(BookInstance.objects.filter(inventory__in=copies).only('pk', 'inventory', *COPY_FIELDS))
+        changed = [
+            copy for copy in existing
+            if update_fields(copy, {**copies[copy.inventory], 'book_id': book_ids[copies[copy.inventory]['isbn']]},
+                             COPY_FIELDS)
+        ]
+        BookInstance.objects.bulk_update(changed, COPY_FIELDS)
+        self.report.updated_copies += len(changed)
+
+        known = {copy.inventory for copy in existing}
+        new = [BookInstance(book_id=book_ids[record['isbn']], inventory=inventory, imprint=record['imprint'],
+                            status=record['status'])
+               for inventory, record in copies.items() if inventory not in known]
+        BookInstance.objects.bulk_create(new)
+        self.report.created_copies += len(new)
+
+
+def import_catalogue(fileobj, fmt, chunk_size=2000):
+    return CatalogueImporter(chunk_size).run(READERS[fmt](fileobj))
@@ -0,0 +1,221 @@
+"""
+Loan workflow: checkout, return and renewal of book copies, and the hold queues.
+
+Every change runs in one transaction and locks the rows it touches with
+``SELECT ... FOR UPDATE``, so concurrent requests can't both lend out the same
+copy or overwrite each other's status change. Picking "any available copy" of a
+book is one locked query with ``SKIP LOCKED``: a copy that another transaction
+is handing out right now is skipped instead of waited on. On databases without
+row locks (SQLite) every change takes the database-wide write lock up front,
+which serializes the transactions.
+
+Holds queue up per book, first come, first served. A copy that becomes free goes
+to the head of its book's queue, found with one query on the partial index of
+waiting holds; the hold is then ready until its pickup deadline, after which
+``manage.py reap_holds`` expires it and passes the copy on. Patrons with a ready
+hold check out the copy reserved for them; nobody checks out an available copy
+ahead of the patrons queued for the book before them.
+"""
+import datetime
+import functools
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from .models import BookInstance, Hold
+
+AVAILABLE, ON_LOAN, RESERVED = 'a', 'o', 'r'
+
+
+class LoanError(APIException):
+    """
+    The request conflicts with the current state of the copies.
+    """
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = 'The copy is not in a state that allows this.'
+    default_code = 'conflict'
+
+
+def today():
+    return datetime.date.today()
+
+
+def write_transaction(function):
+    """
+    transaction.atomic() for a loan change. Without row locks the transaction takes the
+    database write lock with its first statement: a deferred transaction that reads first
+    can fail to upgrade its lock when another one writes, instead of waiting for it.
+    """
+    @functools.wraps(function)
+    @transaction.atomic
+    def wrapper(*args, **kwargs):
+        connection = transaction.get_connection()
+        if not connection.features.has_select_for_update:
+            with connection.cursor() as cursor:
+                cursor.execute(f'UPDATE {BookInstance._meta.db_table} SET status = status WHERE 0 = 1')
+        return function(*args, **kwargs)
+    return wrapper
+
+
+def lendable_copy(book):
+    """
+    Lock and return an available copy of book; copies locked by other transactions are skipped.
+    """
+    return BookInstance.objects.select_for_update(skip_locked=True).filter(book=book, status=AVAILABLE).first()
+
+
+def locked_copy(copy_id):
+    """
+    The copy with copy_id, locked for the rest of the transaction (waits for other holders).
+    """
+    return BookInstance.objects.select_for_update().get(pk=copy_id)
+
+
+def change(copy, **fields):
+    for name, value in fields.items():
+        setattr(copy, name, value)
+    copy.save(update_fields=list(fields))
+    return copy
+
+
+def next_hold(book_id):
+    """
+    Lock and return the oldest waiting hold on a book; holds locked by other transactions are skipped.
+    """
+    return Hold.objects.select_for_update(skip_locked=True) \
+        .filter(book_id=book_id, status=Hold.WAITING) \
+        .order_by('placed_at', 'id') \
+        .first()
+
+
+def allocate(copy):
+    """
+    Hand a locked copy that just became free to the next waiting hold on its book, or make it available.
+    """
+    hold = next_hold(copy.book_id)
+    if hold is None:
+        return change(copy, status=AVAILABLE, borrower=None, due_back=None)
+    expires_at = timezone.now() + datetime.timedelta(days=settings.RESERVATION_PERIOD_DAYS)
+    hold.status, hold.copy, hold.expires_at = Hold.READY, copy, expires_at
+    hold.save(update_fields=['status', 'copy', 'expires_at'])
+    return change(copy, status=RESERVED, borrower_id=hold.patron_id, due_back=timezone.localdate(expires_at))
+
+
+def queued_before(book, hold=None):
+    """
+    The waiting holds on book placed before hold (all of them without one).
+    """
+    queue = Hold.objects.filter(book=book, status=Hold.WAITING)
+    if hold is None:
+        return queue
+    return queue.filter(Q(placed_at__lt=hold.placed_at) | Q(placed_at=hold.placed_at, id__lt=hold.pk))
+
+
+@write_transaction
+def checkout(book, borrower):
+    """
+    Lend borrower a copy of book until LOAN_PERIOD_DAYS from today: the copy reserved for
+    them if they have a ready hold, else an available copy if nobody queued before them.
+    The borrower's hold on the book is fulfilled.
+    """
+    # Holds are locked before copies everywhere a lock is waited for, so transactions can't deadlock.
+    hold = Hold.objects.select_for_update().filter(book=book, patron=borrower, status__in=Hold.ACTIVE).first()
+    if hold is not None and hold.status == Hold.READY and hold.copy_id is not None:
+        copy = locked_copy(hold.copy_id)
+    elif queued_before(book, hold).exists():
+        raise LoanError('Other patrons are waiting for this book.')
+    else:
+        copy = lendable_copy(book)
+    if copy is None:
+        raise LoanError('No copy of this book is available.')
+    if hold is not None:
+        hold.status = Hold.FULFILLED
+        hold.save(update_fields=['status'])
+    return change(copy, status=ON_LOAN, borrower=borrower,
+                  due_back=today() + datetime.timedelta(days=settings.LOAN_PERIOD_DAYS))
+
+
+@write_transaction
+def return_copy(copy_id):
+    copy = locked_copy(copy_id)
+    if copy.status != ON_LOAN:
+        raise LoanError('The copy is not on loan.')
+    return allocate(copy)
+
+
+@write_transaction
+def renew(copy_id, borrower=None):
+    """
+    Push the due date of a loan to LOAN_PERIOD_DAYS from today; with borrower, only their own loan.
+    Loans of books other patrons are waiting for can't be renewed.
+    """
+    copy = locked_copy(copy_id)
+    if copy.status != ON_LOAN or borrower is not None and copy.borrower_id != borrower.pk:
+        raise LoanError('The copy is not on loan to this borrower.')
+    if Hold.objects.filter(book_id=copy.book_id, status=Hold.WAITING).exists():
+        raise LoanError('Other patrons are waiting for this book.')
+    due_back = today() + datetime.timedelta(days=settings.LOAN_PERIOD_DAYS)
+    return change(copy, due_back=max(due_back, copy.due_back or due_back))
+
+
+def place_hold(book, patron):
+    """
+    Queue patron for book. If a copy is available it is allocated straight away, so the
+    hold may come back ready.
+    """
+    try:
+        with transaction.atomic():
+            hold = Hold.objects.create(book=book, patron=patron)
+    except IntegrityError:
+        raise LoanError('This patron is already waiting for this book.')
+    allocate_available(book)
+    hold.refresh_from_db()
+    return hold
+
+
+@write_transaction
+def allocate_available(book):
+    """
+    Hand an available copy of book, if any, to the head of its queue.
+    """
+    copy = lendable_copy(book)
+    if copy is not None:
+        allocate(copy)
+
+
+@write_transaction
+def cancel_hold(hold_id, patron=None):
+    """
+    Withdraw an active hold (with patron, only one of theirs); a copy it had ready goes to the next in line.
+    """
+    hold = Hold.objects.select_for_update().filter(pk=hold_id, status__in=Hold.ACTIVE).first()
+    if hold is None or patron is not None and hold.patron_id != patron.pk:
+        raise LoanError('No such active hold.')
+    hold.status = Hold.CANCELLED
+    hold.save(update_fields=['status'])
+    if hold.copy_id is not None:
+        allocate(locked_copy(hold.copy_id))
+    return hold
+
+
+@write_transaction
+def expire_holds(batch_size=500, now=None):
+    """
+    Expire up to batch_size ready holds past their pickup deadline and pass their copies on.
+    Returns how many were expired; holds other transactions are working on are left for the next batch.
+    """
+    holds = list(
+        Hold.objects.select_for_update(skip_locked=True)
+        .filter(status=Hold.READY, expires_at__lt=now or timezone.now())
+        .order_by('expires_at')
+        .values_list('pk', 'copy_id')[:batch_size]
+    )
+    Hold.objects.filter(pk__in=[pk for pk, _ in holds]).update(status=Hold.EXPIRED)
+    copies = BookInstance.objects.select_for_update().filter(pk__in=[copy_id for _, copy_id in holds], status=RESERVED)
+    for copy in copies.order_by('pk'):
+        allocate(copy)
+    return len(holds)
@@ -0,0 +1,149 @@
+import asyncio
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.contrib.auth.models import User
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand, CommandError
+from django.core.wsgi import get_wsgi_application
+from django.db import connections
+
+# (label, CONN_MAX_AGE, CONN_HEALTH_CHECKS) of the connection policies compared.
+MODES = (
+    ('connect per request', 0, False),
+    ('persistent', 60, False),
+    ('persistent + health checks', 60, True),
+)
+
+
+def login_session(username=None):
+    """
+    A saved session logged in as username (default: a superuser, else the first user).
+    """
+    if username is None:
+        user = User.objects.order_by('-is_superuser', 'pk').first()
+    else:
+        user = User.objects.filter(username=username).first()
+    if user is None:
+        raise CommandError('No user to send the requests as')
+    session = SessionStore()
+    session[SESSION_KEY] = str(user.pk)
+    session[BACKEND_SESSION_KEY] = settings.AUTHENTICATION_BACKENDS[0]
+    session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+    session.save()
+    return session
+
+
+class Command(BaseCommand):
+    help = ("Requests per second of one endpoint through the full WSGI or ASGI handler, with a new database "
+            "connection per request and with persistent connections (which only WSGI servers reuse)")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default='/api/v1/genres/', help='Endpoint to request (GET)')
+        parser.add_argument('--user', help='Username to send the requests as (default: a superuser, else the first '
+                                           'user), so they skip the response cache')
+        parser.add_argument('--requests', type=int, default=1000, help='Requests per mode')
+        parser.add_argument('--threads', type=int, default=4,
+                            help='Concurrent requests, like the threads of one gunicorn worker')
+        parser.add_argument('--handler', choices=['wsgi', 'asgi'], default='wsgi')
+
+    def handle(self, *args, path, user, requests, threads, handler, **options):
+        session = login_session(user)
+        cookie = f'{settings.SESSION_COOKIE_NAME}={session.session_key}'
+        run = self.run_wsgi if handler == 'wsgi' else self.run_asgi
+        saved = {alias: dict(connections[alias].settings_dict) for alias in connections}
+        try:
+            for label, max_age, health_checks in MODES:
+                for alias in connections:
+                    connections[alias].settings_dict.update(CONN_MAX_AGE=max_age, CONN_HEALTH_CHECKS=health_checks)
+                connections.close_all()
+                latencies, elapsed = run(path, cookie, requests, threads)
+                latencies.sort()
+                self.stdout.write(
+                    f'{label:>27}: {requests / elapsed:8.1f} req/s, p50 {statistics.median(latencies) * 1000:6.2f} ms, '
+                    f'p95 {latencies[int(len(latencies) * 0.95) - 1] * 1000:6.2f} ms'
+                )
+        finally:
+            for alias, settings_dict in saved.items():
+                connections[alias].settings_dict.update(settings_dict)
+            session.delete()
+
+    def run_wsgi(self, path, cookie, requests, threads):
+        application = get_wsgi_application()
+
+        def request(_):
+            environ = {
+                'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': '', 'SERVER_NAME': 'localhost',
+                'SERVER_PORT': '80', 'HTTP_HOST': 'localhost', 'HTTP_COOKIE': cookie, 'wsgi.version': (1, 0),
+                'wsgi.url_scheme': 'http', 'wsgi.input': BytesIO(), 'wsgi.errors': sys.stderr,
+                'wsgi.multithread': True, 'wsgi.multiprocess': True, 'wsgi.run_once': False,
+            }
+            statuses = []
+            started = time.perf_counter()
+            response = application(environ, lambda status, headers: statuses.append(status))
+            try:
+                b''.join(response)
+            finally:
+                # Sends request_finished, which closes or keeps the connection as a server would.
+                response.close()
+            self.expect_ok(statuses[0].split()[0])
+            return time.perf_counter() - started
+
+        def close_connections(barrier):
+            # One call per thread: each waits until every thread has picked one up.
+            barrier.wait()
+            connections.close_all()
+
+        with ThreadPoolExecutor(threads) as pool:
+            list(pool.map(request, range(threads)))  # warm up
+            started = time.perf_counter()
+            latencies = list(pool.map(request, range(requests)))
+            elapsed = time.perf_counter() - started
+            barrier = threading.Barrier(threads)
+            list(pool.map(lambda _: close_connections(barrier), range(threads)))
+        return latencies, elapsed
+
+    def run_asgi(self, path, cookie, requests, threads):
+        application = get_asgi_application()
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+            'path': path, 'raw_path': path.encode(), 'query_string': b'', 'root_path': '',
+            'headers': [(b'host', b'localhost'), (b'cookie', cookie.encode())],
+            'client': ('127.0.0.1', 50000), 'server': ('localhost', 80),
+        }
+
+        async def request(semaphore):
+            messages = []
+
+            async def receive():
+                return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+            async def send(message):
+                messages.append(message)
+
+            async with semaphore:
+                started = time.perf_counter()
+                await application(dict(scope), receive, send)
+                self.expect_ok(messages[0]['status'])
+                return time.perf_counter() - started
+
+        async def main():
+            semaphore = asyncio.Semaphore(threads)
+            await asyncio.gather(*(request(semaphore) for _ in range(threads)))  # warm up
+            started = time.perf_counter()
+            latencies = await asyncio.gather(*(request(semaphore) for _ in range(requests)))
+            return list(latencies), time.perf_counter() - started
+
+        return asyncio.run(main())
+
+    @staticmethod
+    def expect_ok(status):
+        if int(status) != 200:
+            raise CommandError(f'The endpoint answered {status}')
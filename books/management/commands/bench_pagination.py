@@ -0,0 +1,61 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from books.models import Book
+from books.pagination import BookKeysetPagination
+
+
+class Command(BaseCommand):
+    help = "Compare page-number and keyset pagination of the book catalogue on a shallow and a deep page"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--page', type=int, default=10_000, help='Deep page number to compare with page 1')
+        parser.add_argument('--seed', type=int, default=0,
+                            help='Create this many throwaway books for the run (rolled back afterwards)')
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def handle(self, *args, page, seed, repeat, **options):
+        with transaction.atomic():
+            if seed:
+                Book.objects.bulk_create(
+                    (Book(title=f'Benchmark book {n:08d}', description='-', isbn=f'bench-{n}') for n in range(seed)),
+                    batch_size=5000,
+                )
+            queryset = Book.objects.all()
+            page_size = BookKeysetPagination.page_size
+            total = queryset.count()
+            if total < page * page_size:
+                self.stderr.write(f'Only {total} books, page {page} needs {page * page_size}; use --seed')
+                transaction.set_rollback(True)
+                return
+
+            for number in (1, page):
+                self.report(f'page-number page {number}', repeat, queryset, PageNumberPagination,
+                            self.request(page=number))
+                self.report(f'keyset page {number}', repeat, queryset, BookKeysetPagination,
+                            self.keyset_request(queryset, number))
+            transaction.set_rollback(True)
+
+    def report(self, label, repeat, queryset, pagination_class, request):
+        started = time.perf_counter()
+        for _ in range(repeat):
+            pagination_class().paginate_queryset(queryset, request)
+        elapsed = (time.perf_counter() - started) / repeat
+        self.stdout.write(f'{label:>24}: {elapsed * 1000:8.2f} ms')
+
+    @staticmethod
+    def request(**params):
+        return Request(APIRequestFactory().get('/api/v1/books/', params, HTTP_HOST='localhost'))
+
+    def keyset_request(self, queryset, number):
+        if number == 1:
+            return self.request()
+        # Position the cursor on the last row of the previous page; locating it is not timed.
+        pagination = BookKeysetPagination()
+        previous = queryset.order_by(*pagination.order_by())[(number - 1) * pagination.page_size - 1]
+        return self.request(cursor=pagination.encode_cursor(pagination.key_of(previous), False))
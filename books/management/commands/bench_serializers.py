@@ -0,0 +1,69 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from books.fastpath import get_plan
+from books.models import Author, Book, BookInstance, Review
+from books.renderers import FastJSONRenderer
+from books.serializers import AuthorSerializer, BookInstanceSerializer, BookListSerializer, BookSerializer, \
+    ReviewSerializer
+
+TARGETS = {
+    'books': (BookSerializer, Book),
+    'books-compact': (BookListSerializer, Book),
+    'authors': (AuthorSerializer, Author),
+    'reviews': (ReviewSerializer, Review),
+    'copies': (BookInstanceSerializer, BookInstance),
+}
+
+
+class Command(BaseCommand):
+    help = "Compare serializer and books.fastpath throughput (query, build and render JSON) on the same rows"
+
+    def add_arguments(self, parser):
+        parser.add_argument('targets', nargs='*', help=f'Any of {", ".join(TARGETS)} (default: all)')
+        parser.add_argument('--rows', type=int, default=100, help='Rows serialized per run')
+        parser.add_argument('--repeat', type=int, default=10)
+        parser.add_argument('--fields', help='Comma-separated ?fields= selection')
+        parser.add_argument('--expand', default='', help='Comma-separated ?expand= selection')
+
+    def handle(self, *args, targets, rows, repeat, fields, expand, **options):
+        unknown = set(targets) - set(TARGETS)
+        if unknown:
+            raise CommandError(f'Unknown targets: {", ".join(sorted(unknown))}')
+        request = Request(APIRequestFactory().get('/api/v1/', HTTP_HOST='localhost'))
+        fields = fields.split(',') if fields else None
+        expand = [name for name in expand.split(',') if name]
+        for target in targets or TARGETS:
+            serializer_class, model = TARGETS[target]
+            plan = get_plan(serializer_class, fields, expand)
+            if plan is None:
+                raise CommandError(f'{serializer_class.__name__} with this selection has no fast path')
+            queryset = model.objects.order_by('pk')
+
+            def drf():
+                objects = serializer_class.setup_eager_loading(queryset, fields, expand)[:rows]
+                serializer = serializer_class(objects, many=True, fields=fields, expand=expand,
+                                              context={'request': request})
+                return JSONRenderer().render(serializer.data)
+
+            def fast():
+                return FastJSONRenderer().render(plan.serialize(plan.values(queryset)[:rows], request))
+
+            if drf() != fast():
+                raise CommandError(f'{target}: fast path output differs from {serializer_class.__name__}')
+            drf_time, fast_time = self.time(drf, repeat), self.time(fast, repeat)
+            self.stdout.write(
+                f'{target:>14}: serializer {drf_time * 1000:9.2f} ms, fast path {fast_time * 1000:9.2f} ms '
+                f'per {rows} rows ({drf_time / fast_time:.1f}x)'
+            )
+
+    @staticmethod
+    def time(run, repeat):
+        started = time.perf_counter()
+        for _ in range(repeat):
+            run()
+        return (time.perf_counter() - started) / repeat
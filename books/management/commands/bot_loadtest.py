@@ -0,0 +1,42 @@
+import asyncio
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+
+from books.bot import build_application
+from books.fake_telegram import FakeTelegramServer
+
+
+class Command(BaseCommand):
+    help = "Drive the Telegram bot with many concurrent chats through a local fake Bot API server"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chats', type=int, default=200)
+        parser.add_argument('--query', default='book', help='Inline search sent by every chat')
+        parser.add_argument('--concurrent-updates', type=int)
+        parser.add_argument('--max-queries', type=int)
+
+    def handle(self, *args, chats, query, concurrent_updates, max_queries, **options):
+        elapsed, latencies = asyncio.run(self.load(chats, query, concurrent_updates, max_queries))
+        latencies.sort()
+        self.stdout.write(
+            f'{len(latencies)} replies in {elapsed:.2f}s ({len(latencies) / elapsed:.0f}/s), latency '
+            f'p50 {statistics.median(latencies) * 1000:.0f} ms, '
+            f'p95 {latencies[int(len(latencies) * 0.95) - 1] * 1000:.0f} ms, max {latencies[-1] * 1000:.0f} ms'
+        )
+
+    async def load(self, chats, query, concurrent_updates, max_queries):
+        async with FakeTelegramServer() as server:
+            application = build_application(
+                token=server.token, base_url=server.base_url,
+                concurrent_updates=concurrent_updates, max_queries=max_queries,
+            )
+            async with server.polling(application):
+                started = time.perf_counter()
+                for chat_id in range(1, chats + 1):
+                    server.message(chat_id, '/books')
+                    server.inline_query(chat_id, query)
+                calls = await server.wait_for_calls(2 * chats, timeout=max(60, chats))
+                elapsed = time.perf_counter() - started
+        return elapsed, [latency for _, _, latency in calls]
@@ -0,0 +1,25 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = ("Store the most similar books of every book for /books/{id}/similar/, from the readers they share and "
+            "their authors; run nightly, and with --incremental every few minutes. Needs NumPy and SciPy")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--incremental', action='store_true',
+                            help='Only recompute what changed with the books whose readers changed since the last run')
+        parser.add_argument('--neighbours', type=int, default=settings.SIMILAR_BOOKS,
+                            help='Similar books stored per book')
+
+    def handle(self, *args, incremental, neighbours, **options):
+        try:
+            from books import similarity
+        except ImportError as error:
+            raise CommandError(f'{error}: the similarities are computed with NumPy and SciPy')
+        if neighbours < 1:
+            raise CommandError('--neighbours must be positive')
+        if incremental:
+            self.stdout.write(f'Refreshed the similar books of {similarity.refresh(neighbours)} books')
+        else:
+            self.stdout.write(f'Stored {similarity.build(neighbours)} similar books')
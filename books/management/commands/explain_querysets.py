@@ -0,0 +1,89 @@
+import re
+from importlib import import_module
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import RequestFactory
+from rest_framework.request import Request
+
+# Tables read in full, per database vendor: PostgreSQL plans say "Seq Scan on t", SQLite query
+# plans "SCAN t" unless the scan walks an index.
+SEQ_SCAN_RES = {
+    'postgresql': re.compile(r'Seq Scan on (\w+)'),
+    'sqlite': re.compile(r'\bSCAN (?:TABLE )?(\w+)\b(?! USING)'),
+}
+
+
+class Command(BaseCommand):
+    help = ("EXPLAIN the list and lookup queries of every viewset on the API router and report sequential scans. "
+            "Plans depend on table sizes and statistics: run it against a copy of production data")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help='Username the user-scoped querysets are built for (default: a superuser, '
+                                           'else the first user)')
+        parser.add_argument('--analyze', action='store_true', help='Run the queries (EXPLAIN ANALYZE, PostgreSQL only)')
+        parser.add_argument('--fail-on-seq-scan', action='store_true',
+                            help='Exit with an error if any query scans a table sequentially')
+
+    def handle(self, *args, user, analyze, fail_on_seq_scan, **options):
+        router = getattr(import_module(settings.ROOT_URLCONF), 'router', None)
+        if router is None:
+            raise CommandError(f'{settings.ROOT_URLCONF} has no API router')
+        if analyze and connection.vendor != 'postgresql':
+            raise CommandError('--analyze needs PostgreSQL')
+        seq_scan_re = SEQ_SCAN_RES.get(connection.vendor)
+        if seq_scan_re is None:
+            self.stderr.write(f'Sequential scans are not recognised on {connection.vendor}, printing the plans only')
+        user = self.user(user)
+
+        scanned = 0
+        for prefix, viewset, basename in router.registry:
+            for name, queryset in self.querysets(viewset, user):
+                label = f'{basename}-{name}'
+                if isinstance(queryset, Exception):
+                    self.stdout.write(f'{label}: skipped ({queryset})')
+                    continue
+                plan = queryset.explain(analyze=True) if analyze else queryset.explain()
+                tables = sorted(set(seq_scan_re.findall(plan))) if seq_scan_re else []
+                if tables:
+                    scanned += 1
+                    self.stdout.write(self.style.WARNING(f'{label}: sequential scan of {", ".join(tables)}'))
+                else:
+                    self.stdout.write(f'{label}: ok')
+                if options['verbosity'] > 1 or seq_scan_re is None:
+                    self.stdout.write(plan)
+        if fail_on_seq_scan and scanned:
+            raise CommandError(f'{scanned} queries scan tables sequentially')
+
+    def user(self, username):
+        if username is None:
+            return User.objects.order_by('-is_superuser', 'pk').first() or AnonymousUser()
+        try:
+            return User.objects.get(username=username)
+        except User.DoesNotExist:
+            raise CommandError(f'No user {username}')
+
+    def querysets(self, viewset, user):
+        """
+        (action, queryset) for the first page of viewset's list and for one lookup of its objects;
+        an exception instead of the queryset when the viewset can't build it.
+        """
+        request = Request(RequestFactory().get('/'))
+        request.user = user
+        view = viewset(request=request, args=(), kwargs={}, format_kwarg=None)
+        for action in ('list', 'retrieve'):
+            view.action = action
+            try:
+                queryset = view.filter_queryset(view.get_queryset())
+                if action == 'list':
+                    page_size = getattr(view.paginator, 'page_size', None)
+                    yield action, queryset[:page_size] if page_size else queryset
+                    continue
+                lookup = view.lookup_field
+                value = queryset.model._default_manager.values_list(lookup, flat=True).first()
+                if value is not None:
+                    yield action, queryset.filter(**{lookup: value})
+            except Exception as error:
+                yield action, error
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from books.exporters import DATASETS, FORMATS, CHUNK_SIZE, export
+
+
+class Command(BaseCommand):
+    help = "Stream the book catalogue or its copies as CSV, JSON Lines or columnar JSON"
+
+    def add_arguments(self, parser):
+        parser.add_argument('dataset', choices=sorted(DATASETS))
+        parser.add_argument('--output', choices=sorted(FORMATS), default='csv')
+        parser.add_argument('--file', help='Write to this file instead of stdout')
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+
+    def handle(self, *args, dataset, output, file, chunk_size, **options):
+        if not file:
+            for chunk in export(dataset, output, chunk_size):
+                self.stdout.write(chunk, ending='')
+            return
+        with open(file, 'w', encoding='utf-8', newline='') as stream:
+            for chunk in export(dataset, output, chunk_size):
+                stream.write(chunk)
@@ -0,0 +1,42 @@
+import json
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from books.importers import READERS, import_catalogue
+
+EXTENSIONS = {
+    '.csv': 'csv',
+    '.jsonl': 'jsonl',
+    '.ndjson': 'jsonl',
+    '.mrc': 'marc',
+    '.marc': 'marc',
+}
+
+
+class Command(BaseCommand):
+    help = "Import books, authors, genres, languages and copies from a CSV, JSON Lines or MARC21 file"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=sorted(READERS), help='Defaults to the one of the file extension')
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, path, format, chunk_size, **options):
+        fmt = format or EXTENSIONS.get(os.path.splitext(path)[1].lower())
+        if fmt is None:
+            raise CommandError('Cannot tell the format from the file name, pass --format')
+
+        started = time.perf_counter()
+        with open(path, 'rb') as fileobj:
+            report = import_catalogue(fileobj, fmt, chunk_size)
+        elapsed = time.perf_counter() - started
+
+        for error in report.errors:
+            self.stderr.write(f'line {error["line"]}: {error["error"]}')
+        if report.error_count > len(report.errors):
+            self.stderr.write(f'... and {report.error_count - len(report.errors)} more errors')
+        summary = {key: value for key, value in report.as_dict().items() if key != 'errors'}
+        self.stdout.write(json.dumps(summary))
+        self.stdout.write(self.style.SUCCESS(f'Imported {report.rows} rows in {elapsed:.1f}s'))
@@ -0,0 +1,116 @@
+import asyncio
+import statistics
+import time
+from collections import Counter
+from urllib.parse import urlsplit
+
+import httpx
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from .bench_connections import login_session
+
+
+class Command(BaseCommand):
+    help = ("Throughput and latency of running servers of this deploy at high concurrency, e.g. the gunicorn "
+            "sync workers against the ASGI service; run it with the settings of the database they use")
+
+    def add_arguments(self, parser):
+        parser.add_argument('targets', nargs='+', metavar='NAME=URL',
+                            help='Servers to compare, e.g. wsgi=http://127.0.0.1:8000 asgi=http://127.0.0.1:8001')
+        parser.add_argument('--path', action='append', dest='paths',
+                            help='Endpoint to request (GET); repeat to cycle through several (default: /api/v1/books/)')
+        parser.add_argument('--concurrency', type=int, default=200, help='Requests in flight at once')
+        parser.add_argument('--requests', type=int, default=5000, help='Requests per server')
+        parser.add_argument('--slow-clients', type=int, default=0,
+                            help='Connections that keep trickling request headers while the requests run, like slow '
+                                 'clients or long-polling consumers')
+        parser.add_argument('--user', help='Username to send the requests as (default: a superuser, else the first '
+                                           'user), so they skip the response cache')
+        parser.add_argument('--anonymous', action='store_true', help='Send the requests without a session')
+        parser.add_argument('--timeout', type=float, default=30, help='Seconds before a request counts as failed')
+
+    def handle(self, *args, targets, paths, concurrency, requests, slow_clients, user, anonymous, timeout,
+               **options):
+        try:
+            targets = [target.split('=', 1) for target in targets]
+            targets = [(name, url.rstrip('/')) for name, url in targets]
+        except ValueError:
+            raise CommandError('Targets are NAME=URL')
+        if concurrency < 1 or requests < 1:
+            raise CommandError('--concurrency and --requests must be positive')
+        paths = paths or ['/api/v1/books/']
+        session = None if anonymous else login_session(user)
+        cookies = {settings.SESSION_COOKIE_NAME: session.session_key} if session else {}
+        try:
+            for name, url in targets:
+                latencies, errors, elapsed = asyncio.run(
+                    self.run(url, paths, cookies, concurrency, requests, slow_clients, timeout))
+                self.report(name, latencies, errors, elapsed)
+        finally:
+            if session is not None:
+                session.delete()
+
+    async def run(self, url, paths, cookies, concurrency, requests, slow_clients, timeout):
+        limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+        latencies, errors = [], Counter()
+        async with httpx.AsyncClient(base_url=url, cookies=cookies, limits=limits, timeout=timeout) as client:
+            async def worker(numbers, record=True):
+                for number in numbers:
+                    started = time.perf_counter()
+                    try:
+                        response = await client.get(paths[number % len(paths)])
+                    except httpx.HTTPError as error:
+                        errors[type(error).__name__] += 1
+                        continue
+                    if response.status_code != 200:
+                        errors[response.status_code] += 1
+                    elif record:
+                        latencies.append(time.perf_counter() - started)
+
+            stop = asyncio.Event()
+            slow = [asyncio.create_task(self.slow_client(url, paths[0], stop)) for _ in range(slow_clients)]
+            # Opens the connections first, one per concurrent request.
+            warm_up = iter(range(concurrency))
+            await asyncio.gather(*(worker(warm_up, record=False) for _ in range(concurrency)))
+            errors.clear()
+            numbers = iter(range(requests))
+            started = time.perf_counter()
+            await asyncio.gather(*(worker(numbers) for _ in range(concurrency)))
+            elapsed = time.perf_counter() - started
+            stop.set()
+            await asyncio.gather(*slow)
+        return latencies, errors, elapsed
+
+    @staticmethod
+    async def slow_client(url, path, stop, interval=1.0):
+        """
+        Hold one connection with a request whose headers never end, until stop is set.
+        """
+        parts = urlsplit(url)
+        try:
+            reader, writer = await asyncio.open_connection(parts.hostname, parts.port or 80)
+        except OSError:
+            return
+        try:
+            writer.write(f'GET {path} HTTP/1.1\r\nHost: {parts.netloc}\r\n'.encode())
+            while not stop.is_set():
+                await writer.drain()
+                try:
+                    await asyncio.wait_for(stop.wait(), interval)
+                except asyncio.TimeoutError:
+                    writer.write(b'X-Slow-Client: 1\r\n')
+        except OSError:
+            pass
+        finally:
+            writer.close()
+
+    def report(self, name, latencies, errors, elapsed):
+        if len(latencies) < 2:
+            raise CommandError(f'{name}: {len(latencies)} requests succeeded, errors: {dict(errors)}')
+        percentiles = statistics.quantiles(latencies, n=100)
+        line = (f'{name:>10}: {len(latencies) / elapsed:8.1f} req/s, p50 {percentiles[49] * 1000:7.1f} ms, '
+                f'p95 {percentiles[94] * 1000:7.1f} ms, p99 {percentiles[98] * 1000:7.1f} ms')
+        if errors:
+            line += f', errors: {", ".join(f"{error} x{n}" for error, n in errors.items())}'
+        self.stdout.write(line)
@@ -0,0 +1,26 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from books.images import IMAGE_MODELS, pending_images, process_in_worker
+
+
+class Command(BaseCommand):
+    help = ("Make the resized derivatives of the cover and author images that have none yet, e.g. after a bulk "
+            "import; each distinct image file is processed once")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=settings.IMAGE_WORKERS,
+                            help='Images processed at once; Pillow resizes and encodes outside the GIL')
+        parser.add_argument('--all', action='store_true', dest='everything',
+                            help='Process every image, e.g. after changing IMAGE_DERIVATIVE_WIDTHS or _FORMATS')
+
+    def handle(self, *args, workers, everything, **options):
+        if workers < 1:
+            raise CommandError('--workers must be positive')
+        for model in IMAGE_MODELS:
+            names = pending_images(model, everything)
+            with ThreadPoolExecutor(workers) as pool:
+                rows = list(pool.map(lambda name: process_in_worker(model, name), names))
+            self.stdout.write(f'{model._meta.verbose_name_plural}: {len(names)} images, {sum(rows)} rows updated')
@@ -0,0 +1,30 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from books.overdue import process_overdue
+
+
+class Command(BaseCommand):
+    help = "Assess fines and queue reminders for overdue loans; run nightly, an interrupted run resumes where it stopped"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', help='Day to assess as YYYY-MM-DD (default: today)')
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help='Loans processed per transaction, which bounds memory and lock time')
+        parser.add_argument('--restart', action='store_true',
+                            help="Process the day from the start even if a run of it finished or was interrupted")
+
+    def handle(self, *args, date, chunk_size, restart, **options):
+        try:
+            today = datetime.date.fromisoformat(date) if date else None
+        except ValueError:
+            raise CommandError(f'Invalid date: {date}')
+        if chunk_size < 1:
+            raise CommandError('--chunk-size must be positive')
+        total = 0
+        for processed in process_overdue(today, chunk_size, restart):
+            total += processed
+            if options['verbosity'] > 1:
+                self.stdout.write(f'{total} loans processed')
+        self.stdout.write(f'Processed {total} overdue loans')
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from books.loans import expire_holds
+
+
+class Command(BaseCommand):
+    help = "Expire holds whose pickup deadline has passed and pass their copies to the next patrons in line"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Holds expired per transaction, so locks are held only briefly')
+
+    def handle(self, *args, batch_size, **options):
+        total = 0
+        while True:
+            expired = expire_holds(batch_size)
+            total += expired
+            if expired < batch_size:
+                break
+        self.stdout.write(f'Expired {total} holds')
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from books.models import Author, Book, FacetCount
+
+
+class Command(BaseCommand):
+    help = ("Rebuild the denormalized counters on Book, Author and FacetCount, or only report rows out of sync "
+            "with --verify")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verify', action='store_true', help='Report drift without fixing it')
+
+    def counters(self):
+        """
+        (name, queryset of drifted rows, rebuild callable) for every counter family.
+        """
+        return [
+            ('availability', Book.objects.availability_drift(), Book.objects.all().refresh_availability),
+            ('ratings', Book.objects.ratings_drift(), Book.objects.all().refresh_ratings),
+            ('reviews', Book.objects.review_count_drift(), Book.objects.all().refresh_review_count),
+            # After availability: the facets count the available books.
+            ('facets', FacetCount.objects.drift(), FacetCount.objects.rebuild),
+            ('author books', Author.objects.book_count_drift(), Author.objects.all().refresh_book_count),
+        ]
+
+    def handle(self, *args, verify, **options):
+        drifted = 0
+        for name, drift, rebuild in self.counters():
+            pks = list(drift.values_list('pk', flat=True)[:20])
+            count = drift.count()
+            drifted += count
+            self.stdout.write(f'{name}: {count} row(s) out of sync' + (f', e.g. {pks}' if count else ''))
+            if not verify:
+                with transaction.atomic():
+                    rebuild()
+                self.stdout.write(self.style.SUCCESS(f'{name}: rebuilt'))
+        if verify and drifted:
+            raise CommandError(f'{drifted} counter set(s) out of sync')
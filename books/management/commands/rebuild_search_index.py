@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from books.search import get_backend
+
+
+class Command(BaseCommand):
+    help = "Rebuild the full-text search indexes of the book catalogue and author names"
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            get_backend().rebuild()
+        self.stdout.write(self.style.SUCCESS('Search indexes rebuilt'))
@@ -0,0 +1,205 @@
+"""
+In-process request metrics, rendered in the Prometheus text format at /metrics.
+
+Every request is counted and timed; a sample of them (REQUEST_METRICS_SAMPLE_RATE)
+also has its SQL and serializer time recorded, see books.middleware. Each worker
+process keeps its own registry, so scrape every worker (or aggregate them by the
+``instance`` label) when running several.
+"""
+import asyncio
+import functools
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+METRICS = {
+    'library_http_requests_total': ('counter', 'Requests handled, by view, method and status.'),
+    'library_http_request_duration_seconds': ('histogram', 'Wall time of requests, by view.'),
+    'library_http_response_size_bytes': ('summary', 'Size of non-streaming response bodies, by view.'),
+    'library_sampled_requests_total': ('counter', 'Requests whose queries and serializers were instrumented.'),
+    'library_db_queries_total': ('counter', 'SQL queries run by sampled requests, by view.'),
+    'library_db_query_duration_seconds_total': ('counter', 'Time spent in SQL by sampled requests, by view.'),
+    'library_serializer_duration_seconds_total': ('counter', 'Time spent building serializer data by sampled '
+                                                             'requests, by view.'),
+    'library_n_plus_one_total': ('counter', 'Sampled requests that repeated one SQL shape at least '
+                                            'REQUEST_METRICS_N_PLUS_ONE_THRESHOLD times, by view.'),
+}
+
+IN_LIST_RE = re.compile(r'\bIN \((?:%s|\?)(?:, (?:%s|\?))*\)', re.IGNORECASE)
+LITERAL_RE = re.compile(r"'(?:[^']|'')*'|\b\d+\b")
+
+
+def escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def format_labels(labels, **extra):
+    pairs = [*labels, *extra.items()]
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{escape(value)}"' for name, value in pairs) + '}'
+
+
+class Registry:
+    """
+    Thread-safe counters, histograms and summaries keyed by metric name and labels.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        self.counters = defaultdict(float)
+        self.histograms = {}
+
+    def inc(self, name, amount=1, **labels):
+        with self.lock:
+            self.counters[name, tuple(sorted(labels.items()))] += amount
+
+    def observe(self, name, value, **labels):
+        key = name, tuple(sorted(labels.items()))
+        with self.lock:
+            buckets, total = self.histograms.get(key) or ([0] * (len(DURATION_BUCKETS) + 1), [0.0, 0])
+            self.histograms[key] = buckets, total
+            for index, bound in enumerate(DURATION_BUCKETS):
+                if value <= bound:
+                    buckets[index] += 1
+            buckets[-1] += 1
+            total[0] += value
+            total[1] += 1
+
+    def render(self):
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = {key: (list(buckets), list(total)) for key, (buckets, total) in self.histograms.items()}
+
+        samples = defaultdict(list)
+        for (name, labels), value in sorted(counters.items()):
+            samples[name].append(f'{name}{format_labels(labels)} {value:g}')
+        for (name, labels), (buckets, (total, count)) in sorted(histograms.items()):
+            if METRICS[name][0] == 'histogram':
+                for bound, bucket in zip((*DURATION_BUCKETS, '+Inf'), buckets):
+                    samples[name].append(f'{name}_bucket{format_labels(labels, le=bound)} {bucket}')
+            samples[name].append(f'{name}_sum{format_labels(labels)} {total:g}')
+            samples[name].append(f'{name}_count{format_labels(labels)} {count}')
+
+        lines = []
+        for name, (kind, help_text) in METRICS.items():
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}', *samples[name]]
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+def sql_shape(sql):
+    """
+    The SQL with IN lists collapsed and literals blanked, so queries that differ only in
+    parameters share a shape.
+    """
+    return LITERAL_RE.sub('?', IN_LIST_RE.sub('IN (...)', sql))
+
+
+class QueryRecorder:
+    """
+    connection.execute_wrapper that counts and times the queries of one request.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.shapes = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - started
+            self.count += 1
+            self.shapes[sql] += 1
+
+    def repeated_shapes(self, threshold):
+        shapes = Counter()
+        for sql, count in self.shapes.items():
+            shapes[sql_shape(sql)] += count
+        return {shape: count for shape, count in shapes.most_common() if count >= threshold}
+
+
+class SerializerTimer:
+    """
+    Time spent in the outermost serializing() blocks of a sampled request: the response data
+    the viewsets build (books.fieldsets) and the async read views' books.fastpath calls.
+    """
+
+    def __init__(self):
+        self.duration = 0.0
+        self.depth = 0
+
+
+serializer_timer = ContextVar('serializer_timer', default=None)
+query_recorder = ContextVar('query_recorder', default=None)
+
+
+def record_queries(execute, sql, params, many, context):
+    """
+    Permanent connection.execute_wrapper handing the queries of a sampled request to its QueryRecorder.
+
+    The recorder travels in a ContextVar rather than being installed per request, so queries
+    an async request runs through sync_to_async() in another thread are recorded as well.
+    """
+    recorder = query_recorder.get()
+    if recorder is None:
+        return execute(sql, params, many, context)
+    return recorder(execute, sql, params, many, context)
+
+
+def install_query_recorder(connection, **kwargs):
+    """
+    connection_created receiver adding record_queries to every new database connection.
+    """
+    if record_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_queries)
+
+
+def timed(function):
+    """
+    Count calls of function (or awaits of a coroutine function) into the current SerializerTimer, if any.
+    """
+    if asyncio.iscoroutinefunction(function):
+        @functools.wraps(function)
+        async def async_wrapper(*args, **kwargs):
+            with serializing():
+                return await function(*args, **kwargs)
+        return async_wrapper
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        with serializing():
+            return function(*args, **kwargs)
+    return wrapper
+
+
+@contextmanager
+def serializing():
+    """
+    Count the time spent in the block into the current SerializerTimer, if any.
+    """
+    timer = serializer_timer.get()
+    if timer is None:
+        yield
+        return
+    timer.depth += 1
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timer.depth -= 1
+        if not timer.depth:
+            timer.duration += time.perf_counter() - started
@@ -0,0 +1,109 @@
+import json
+import logging
+import random
+import time
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+from .metrics import QueryRecorder, SerializerTimer, query_recorder, registry, serializer_timer
+
+logger = logging.getLogger('books.metrics')
+
+
+def view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unresolved'
+    return match.view_name or match._func_path
+
+
+class RequestMetricsMiddleware:
+    """
+    Record view, wall time, status and response size of every request into books.metrics.
+
+    A REQUEST_METRICS_SAMPLE_RATE share of requests is also instrumented in depth - SQL
+    query count and time on every database, serialization time, repeated SQL
+    shapes (likely N+1 patterns) - and written to the ``books.metrics`` logger as
+    one JSON line. Keeping that to a sample bounds the overhead.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        started = time.perf_counter()
+        with self.sampling() as sample:
+            response = self.get_response(request)
+        self.record(request, response, time.perf_counter() - started, sample)
+        return response
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        with self.sampling() as sample:
+            response = await self.get_response(request)
+        self.record(request, response, time.perf_counter() - started, sample)
+        return response
+
+    def record(self, request, response, duration, sample=None):
+        view = view_name(request)
+        registry.inc('library_http_requests_total', view=view, method=request.method, status=response.status_code)
+        registry.observe('library_http_request_duration_seconds', duration, view=view)
+        size = None if response.streaming else len(response.content)
+        if size is not None:
+            registry.observe('library_http_response_size_bytes', size, view=view)
+        if sample is not None:
+            self.report(request, response, view, duration, size, *sample)
+
+    @staticmethod
+    @contextmanager
+    def sampling():
+        """
+        Yield the (QueryRecorder, SerializerTimer) of a sampled request, None otherwise.
+
+        Both travel in ContextVars, which sync_to_async() copies into the threads an async
+        request runs its queries in; books.metrics.record_queries picks the recorder up there.
+        """
+        if random.random() >= settings.REQUEST_METRICS_SAMPLE_RATE:
+            yield None
+            return
+        recorder, timer = QueryRecorder(), SerializerTimer()
+        tokens = query_recorder.set(recorder), serializer_timer.set(timer)
+        try:
+            yield recorder, timer
+        finally:
+            query_recorder.reset(tokens[0])
+            serializer_timer.reset(tokens[1])
+
+    def report(self, request, response, view, duration, size, recorder, timer):
+        repeated = recorder.repeated_shapes(settings.REQUEST_METRICS_N_PLUS_ONE_THRESHOLD)
+        registry.inc('library_sampled_requests_total', view=view)
+        registry.inc('library_db_queries_total', recorder.count, view=view)
+        registry.inc('library_db_query_duration_seconds_total', recorder.duration, view=view)
+        registry.inc('library_serializer_duration_seconds_total', timer.duration, view=view)
+        if repeated:
+            registry.inc('library_n_plus_one_total', view=view)
+
+        record = {
+            'view': view,
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'duration_ms': round(duration * 1000, 2),
+            'db_queries': recorder.count,
+            'db_ms': round(recorder.duration * 1000, 2),
+            'serializer_ms': round(timer.duration * 1000, 2),
+            'response_bytes': size,
+        }
+        if repeated:
+            record['repeated_queries'] = [{'sql': shape, 'count': count} for shape, count in repeated.items()]
+        logger.log(logging.WARNING if repeated else logging.INFO, json.dumps(record))
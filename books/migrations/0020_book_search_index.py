@@ -0,0 +1,24 @@
+from django.db import migrations
+
+from books.search import BACKENDS
+
+
+def install_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor in BACKENDS:
+        BACKENDS[schema_editor.connection.vendor](schema_editor.connection).install()
+
+
+def uninstall_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor in BACKENDS:
+        BACKENDS[schema_editor.connection.vendor](schema_editor.connection).uninstall()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0019_alter_book_isbn'),
+    ]
+
+    operations = [
+        migrations.RunPython(install_search_index, uninstall_search_index),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 4.1.13 on 2026-10-18 17:59
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+STATUS_COUNTERS = {
+    'm': 'maintenance_copies',
+    'o': 'on_loan_copies',
+    'a': 'available_copies',
+    'r': 'reserved_copies',
+}
+
+
+def count_copies(apps, schema_editor):
+    Book = apps.get_model('books', 'Book')
+    BookInstance = apps.get_model('books', 'BookInstance')
+
+    def copies_count(**filters):
+        copies = BookInstance.objects.filter(book=OuterRef('pk'), **filters).order_by() \
+            .values('book').annotate(count=Count('pk')).values('count')
+        return Coalesce(Subquery(copies), 0)
+
+    counters = {field: copies_count(status=status) for status, field in STATUS_COUNTERS.items()}
+    Book.objects.update(total_copies=copies_count(), **counters)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0021_keyset_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='available_copies',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='maintenance_copies',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='on_loan_copies',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='reserved_copies',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='total_copies',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(count_copies, migrations.RunPython.noop),
+    ]
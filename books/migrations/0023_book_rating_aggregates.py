@@ -0,0 +1,74 @@
+# Generated by Django 4.1.13 on 2026-10-18 18:01
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Sum
+from django.db.models.functions import Cast, Coalesce, NullIf
+
+
+def aggregate_relations(apps, schema_editor):
+    Book = apps.get_model('books', 'Book')
+    UserBookRelation = apps.get_model('books', 'UserBookRelation')
+
+    def relation_aggregate(aggregate, **filters):
+        rows = UserBookRelation.objects.filter(book=OuterRef('pk'), **filters).order_by() \
+            .values('book').annotate(value=aggregate).values('value')
+        return Coalesce(Subquery(rows), 0)
+
+    rating_count = relation_aggregate(Count('pk'), rate__isnull=False)
+    rating_sum = relation_aggregate(Sum('rate'))
+    Book.objects.update(
+        rating_count=rating_count,
+        rating_sum=rating_sum,
+        like_count=relation_aggregate(Count('pk'), like=True),
+        bookmark_count=relation_aggregate(Count('pk'), in_bookmarks=True),
+        rating_mean=Coalesce(Cast(rating_sum, models.FloatField()) / NullIf(rating_count, 0), 0.0,
+                             output_field=models.FloatField()),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0022_book_availability_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='bookmark_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='like_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='rating_mean',
+            field=models.FloatField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['-rating_mean', '-rating_count', 'id'], name='book_top_rating_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['-like_count', 'id'], name='book_top_likes_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['-bookmark_count', 'id'], name='book_top_bookmarks_idx'),
+        ),
+        migrations.RunPython(aggregate_relations, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 4.1.13 on 2026-10-18 18:53
+
+import datetime
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+from django.utils import timezone
+
+
+def hold_reserved_copies(apps, schema_editor):
+    # Copies already reserved for someone get the ready hold they would have had; one per patron and book.
+    BookInstance = apps.get_model('books', 'BookInstance')
+    Hold = apps.get_model('books', 'Hold')
+    holds = {}
+    for copy in BookInstance.objects.filter(status='r', borrower__isnull=False, book__isnull=False).order_by('pk'):
+        expires_at = datetime.datetime.combine(copy.due_back, datetime.time.max) if copy.due_back else None
+        holds.setdefault((copy.book_id, copy.borrower_id), Hold(
+            book_id=copy.book_id, patron_id=copy.borrower_id, status='r', copy=copy,
+            expires_at=timezone.make_aware(expires_at) if expires_at else None,
+        ))
+    Hold.objects.bulk_create(holds.values())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('books', '0023_book_rating_aggregates'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Hold',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('w', 'Waiting'), ('r', 'Ready for pickup'), ('f', 'Fulfilled'), ('x', 'Expired'), ('c', 'Cancelled')], default='w', max_length=1)),
+                ('placed_at', models.DateTimeField(auto_now_add=True)),
+                ('expires_at', models.DateTimeField(blank=True, null=True)),
+                ('book', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='books.book')),
+                ('copy', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='books.bookinstance')),
+                ('patron', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['placed_at', 'id'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='hold',
+            index=models.Index(condition=models.Q(('status', 'w')), fields=['book', 'placed_at', 'id'], name='hold_queue_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='hold',
+            index=models.Index(condition=models.Q(('status', 'r')), fields=['expires_at'], name='hold_ready_expiry_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='hold',
+            constraint=models.UniqueConstraint(condition=models.Q(('status__in', ('w', 'r'))), fields=('book', 'patron'), name='hold_one_active_per_patron'),
+        ),
+        migrations.RunPython(hold_reserved_copies, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,69 @@
+# Generated by Django 4.1.13 on 2026-10-18 18:58
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('books', '0024_hold'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BatchCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('job', models.CharField(max_length=100, unique=True)),
+                ('run', models.CharField(max_length=100)),
+                ('position', models.JSONField(blank=True, null=True)),
+                ('finished', models.BooleanField(default=False)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='OverdueNotice',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('due_back', models.DateField()),
+                ('days_overdue', models.PositiveIntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('sent_at', models.DateTimeField(blank=True, null=True)),
+                ('borrower', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+                ('copy', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='books.bookinstance')),
+            ],
+            options={
+                'ordering': ['created_at', 'id'],
+            },
+        ),
+        migrations.CreateModel(
+            name='Fine',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('due_back', models.DateField()),
+                ('days_overdue', models.PositiveIntegerField()),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=8)),
+                ('assessed_on', models.DateField()),
+                ('borrower', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+                ('copy', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='books.bookinstance')),
+            ],
+            options={
+                'ordering': ['due_back', 'id'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='overduenotice',
+            index=models.Index(condition=models.Q(('sent_at__isnull', True)), fields=['created_at'], name='notice_unsent_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='overduenotice',
+            constraint=models.UniqueConstraint(fields=('copy', 'due_back', 'days_overdue'), name='notice_one_per_step'),
+        ),
+        migrations.AddConstraint(
+            model_name='fine',
+            constraint=models.UniqueConstraint(fields=('copy', 'due_back'), name='fine_one_per_loan'),
+        ),
+    ]
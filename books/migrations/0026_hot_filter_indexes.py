@@ -0,0 +1,74 @@
+# Generated by Django 4.1.13 on 2026-10-18 19:00
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Sum
+from django.db.models.functions import Cast, Coalesce, NullIf
+import django.db.models.deletion
+
+
+def merge_duplicate_relations(apps, schema_editor):
+    """
+    Fold every user's duplicate relations to a book into the latest one, keeping a like or
+    bookmark set on any of them, and recompute the rating aggregates of the books concerned.
+    """
+    Book = apps.get_model('books', 'Book')
+    UserBookRelation = apps.get_model('books', 'UserBookRelation')
+
+    duplicates = UserBookRelation.objects.values('user', 'book').annotate(n=Count('pk')).filter(n__gt=1).order_by()
+    book_ids = set()
+    for pair in duplicates.iterator():
+        relations = list(UserBookRelation.objects.filter(user=pair['user'], book=pair['book']).order_by('-pk'))
+        kept = relations[0]
+        kept.like = any(relation.like for relation in relations)
+        kept.in_bookmarks = any(relation.in_bookmarks for relation in relations)
+        kept.save(update_fields=['like', 'in_bookmarks'])
+        UserBookRelation.objects.filter(pk__in=[relation.pk for relation in relations[1:]]).delete()
+        book_ids.add(pair['book'])
+    if not book_ids:
+        return
+
+    def relation_aggregate(aggregate, **filters):
+        rows = UserBookRelation.objects.filter(book=OuterRef('pk'), **filters).order_by() \
+            .values('book').annotate(value=aggregate).values('value')
+        return Coalesce(Subquery(rows), 0)
+
+    rating_count = relation_aggregate(Count('pk'), rate__isnull=False)
+    rating_sum = relation_aggregate(Sum('rate'))
+    Book.objects.filter(pk__in=book_ids).update(
+        rating_count=rating_count,
+        rating_sum=rating_sum,
+        like_count=relation_aggregate(Count('pk'), like=True),
+        bookmark_count=relation_aggregate(Count('pk'), in_bookmarks=True),
+        rating_mean=Coalesce(Cast(rating_sum, models.FloatField()) / NullIf(rating_count, 0), 0.0,
+                             output_field=models.FloatField()),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('books', '0025_overdue_processing'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_relations, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='userbookrelation',
+            constraint=models.UniqueConstraint(fields=('user', 'book'), name='relation_one_per_user_book'),
+        ),
+        migrations.AlterField(
+            model_name='userbookrelation',
+            name='user',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='bookinstance',
+            index=models.Index(condition=models.Q(('status', 'o')), fields=['borrower', 'due_back', 'id'], name='copy_on_loan_borrower_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['book', 'pub_date'], name='review_book_pub_date_idx'),
+        ),
+    ]
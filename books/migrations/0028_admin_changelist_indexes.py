@@ -0,0 +1,21 @@
+# Generated by Django 4.1.13 on 2026-10-18 19:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0027_image_derivatives'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='bookinstance',
+            index=models.Index(fields=['due_back', 'id'], name='copy_due_back_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='fine',
+            index=models.Index(fields=['due_back', 'id'], name='fine_due_back_id_idx'),
+        ),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 4.1.13 on 2026-10-18 20:01
+
+from django.db import migrations, models
+from django.db.models import Count, Q
+
+
+FACETS = {'genre': 'genre', 'language': 'language', 'author': 'authors'}
+
+
+def count_facets(apps, schema_editor):
+    Book = apps.get_model('books', 'Book')
+    FacetCount = apps.get_model('books', 'FacetCount')
+    rows = []
+    for facet, field in FACETS.items():
+        field = Book._meta.get_field(field)
+        through, column = field.remote_field.through, f'{field.m2m_reverse_field_name()}_id'
+        counts = through.objects.order_by().values_list(column) \
+            .annotate(books=Count('pk'), available_books=Count('pk', filter=Q(book__available_copies__gt=0)))
+        rows += [FacetCount(facet=facet, value_id=value_id, books=books, available_books=available_books)
+                 for value_id, books, available_books in counts]
+    FacetCount.objects.bulk_create(rows, batch_size=5000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0029_book_similarity'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FacetCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('facet', models.CharField(choices=[('genre', 'genre'), ('language', 'language'), ('author', 'author')], max_length=8)),
+                ('value_id', models.BigIntegerField()),
+                ('books', models.PositiveIntegerField(default=0)),
+                ('available_books', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='facetcount',
+            index=models.Index(fields=['facet', '-books', 'value_id'], name='facet_count_books_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='facetcount',
+            index=models.Index(fields=['facet', '-available_books', 'value_id'], name='facet_count_available_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='facetcount',
+            constraint=models.UniqueConstraint(fields=('facet', 'value_id'), name='facet_count_one_per_value'),
+        ),
+        migrations.RunPython(count_facets, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.1.13 on 2026-10-18 20:06
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_books(apps, schema_editor):
+    Author = apps.get_model('books', 'Author')
+    Book = apps.get_model('books', 'Book')
+    links = Book.authors.through.objects.filter(author=OuterRef('pk')).order_by() \
+        .values('author').annotate(count=Count('pk')).values('count')
+    Author.objects.update(book_count=Coalesce(Subquery(links), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0030_facet_counts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='author',
+            name='book_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(count_books, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.1.13 on 2026-10-18 20:12
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_reviews(apps, schema_editor):
+    Book = apps.get_model('books', 'Book')
+    Review = apps.get_model('books', 'Review')
+    reviews = Review.objects.filter(book=OuterRef('pk')).order_by() \
+        .values('book').annotate(count=Count('pk')).values('count')
+    Book.objects.update(review_count=Coalesce(Subquery(reviews), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0031_author_book_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='review_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['book', 'pub_date', 'id'], name='review_book_pub_date_id_idx'),
+        ),
+        migrations.RemoveIndex(
+            model_name='review',
+            name='review_book_pub_date_idx',
+        ),
+        migrations.RunPython(count_reviews, migrations.RunPython.noop),
+    ]
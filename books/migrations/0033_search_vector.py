@@ -0,0 +1,63 @@
+# Generated by Django 4.1.13 on 2026-10-18 20:29
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+import books.search
+
+
+def vector_field():
+    field = django.contrib.postgres.search.SearchVectorField(editable=False, null=True)
+    field.set_attributes_from_name('search_vector')
+    return field
+
+
+def add_vector_column(apps, schema_editor):
+    # Migration 0020 created the column on PostgreSQL already; elsewhere it stays empty.
+    if schema_editor.connection.vendor != 'postgresql':
+        schema_editor.add_field(apps.get_model('books', 'Book'), vector_field())
+
+
+def remove_vector_column(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        schema_editor.remove_field(apps.get_model('books', 'Book'), vector_field())
+
+
+def install_author_index(apps, schema_editor):
+    # PostgreSQL indexes author names by expression, see the index below.
+    if schema_editor.connection.vendor == 'sqlite':
+        books.search.SQLiteSearchBackend(schema_editor.connection).install()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0032_review_count'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AddField(
+                    model_name='book',
+                    name='search_vector',
+                    field=vector_field(),
+                ),
+                migrations.AddIndex(
+                    model_name='book',
+                    index=books.search.SearchVectorIndex(fields=['search_vector'], name='books_book_search_gin'),
+                ),
+            ],
+            database_operations=[
+                migrations.RunPython(add_vector_column, remove_vector_column),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='author',
+            index=books.search.SearchVectorIndex(
+                django.contrib.postgres.search.SearchVector('first_name', 'middle_name', 'last_name', config='simple'),
+                name='author_search_gin',
+            ),
+        ),
+        migrations.RunPython(install_author_index, migrations.RunPython.noop),
+    ]
@@ -1,13 +1,39 @@
 import uuid
+from collections import Counter, defaultdict
 from datetime import date
 
 from django.contrib.auth.models import User
-from django.db import models
+from django.contrib.postgres.search import SearchVectorField
+from django.db import models, transaction
+from django.db.models import BooleanField, Case, Count, ExpressionWrapper, F, OuterRef, Q, Subquery, Sum, When, \
+    Window
+from django.db.models.functions import Cast, Coalesce, Greatest, NullIf, RowNumber
+from django.dispatch import Signal
 from rest_framework.authtoken.models import Token
 
+from .search import SearchVectorIndex, author_vector
+
 
 from django.urls import reverse
 
+# Sent with the model class as sender by queryset writes that bypass the per-row model signals.
+bulk_changed = Signal()
+
+
+class BulkChangedQuerySet(models.QuerySet):
+    """
+    Sends bulk_changed after the bulk writes that bypass the model signals.
+    """
+    def update(self, **kwargs):
+        rows = super().update(**kwargs)
+        bulk_changed.send(sender=self.model)
+        return rows
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = super().bulk_create(objs, *args, **kwargs)
+        bulk_changed.send(sender=self.model)
+        return objs
+
 
 class Genre(models.Model):
     """
@@ -15,6 +41,8 @@ class Genre(models.Model):
     """
     name = models.CharField(unique=True, max_length=200, help_text='Enter a book genre (e.g. Science Fiction)')
 
+    objects = BulkChangedQuerySet.as_manager()
+
     def __str__(self):
         """
         String for representing the Model object.
@@ -28,6 +56,8 @@ class Language(models.Model):
     """
     name = models.CharField(unique=True, max_length=200, help_text='Enter a book language (e.g. English, Russian)')
 
+    objects = BulkChangedQuerySet.as_manager()
+
     def __str__(self):
         """
         String for representing the Model object.
@@ -35,19 +65,73 @@ class Language(models.Model):
         return self.name
 
 
+class AuthorQuerySet(BulkChangedQuerySet):
+    def actual_book_count(self):
+        """
+        Number of books of the outer Author, as a correlated subquery over the links.
+        """
+        links = Author.book_set.through.objects.filter(author=OuterRef('pk')).order_by() \
+            .values('author').annotate(n=Count('pk')).values('n')
+        return Coalesce(Subquery(links), 0)
+
+    def move_book_counts(self, deltas):
+        """
+        Move book_count by {author id: delta}, in one UPDATE per distinct delta.
+        """
+        authors = defaultdict(list)
+        for author_id, delta in deltas.items():
+            if delta:
+                authors[delta].append(author_id)
+        for delta, author_ids in authors.items():
+            self.filter(pk__in=author_ids).update(book_count=shifted('book_count', delta))
+
+    def refresh_book_count(self):
+        """
+        Recompute the stored book_count of the authors in this queryset.
+        """
+        return self.update(book_count=self.actual_book_count())
+
+    def book_count_drift(self):
+        """
+        Authors whose stored book_count disagrees with their books.
+        """
+        return self.annotate(actual_book_count=self.actual_book_count()).exclude(book_count=F('actual_book_count'))
+
+
 class Author(models.Model):
     """
     Model representing an author.
     """
+    # Maintained in the database only; a plain save() of a stale instance must not overwrite them.
+    COUNTER_FIELDS = ('book_count',)
+
     first_name = models.CharField(max_length=100)
     last_name = models.CharField(max_length=100)
     middle_name = models.CharField(max_length=100, null=True, blank=True)
     date_of_birth = models.DateField(null=True, blank=True)
     date_of_death = models.DateField('Died', null=True, blank=True)
     image = models.ImageField(upload_to='author_images', default='default-author-image.png')
+    # Resized copies of image, see books.images.
+    image_srcset = models.JSONField(default=dict, blank=True, editable=False)
+    # Denormalized number of books, moved by the links added and removed (see books.signals.count_author_books).
+    book_count = models.PositiveIntegerField(default=0, editable=False)
+
+    objects = AuthorQuerySet.as_manager()
 
     class Meta:
         ordering = ['last_name', 'first_name']
+        indexes = [
+            # ?search= on PostgreSQL, see books.search.
+            SearchVectorIndex(author_vector(), name='author_search_gin'),
+        ]
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and not args and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.COUNTER_FIELDS
+            ]
+        super().save(*args, **kwargs)
 
     def get_absolute_url(self):
         """
@@ -62,13 +146,146 @@ class Author(models.Model):
         return f'{self.last_name}, {self.first_name} {self.middle_name}'
 
 
+def book_aggregate(model, aggregate, **filters):
+    """
+    Aggregate over the model rows of the outer Book matching filters, as a correlated subquery.
+    """
+    rows = model.objects.filter(book=OuterRef('pk'), **filters).order_by() \
+        .values('book').annotate(value=aggregate).values('value')
+    return Coalesce(Subquery(rows), 0)
+
+
+class BookQuerySet(models.QuerySet):
+    def update(self, **kwargs):
+        rows = super().update(**kwargs)
+        bulk_changed.send(sender=self.model)
+        return rows
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = super().bulk_create(objs, *args, **kwargs)
+        bulk_changed.send(sender=self.model)
+        return objs
+
+    def actual_availability(self):
+        """
+        Availability counters recomputed from the copies, keyed like the stored ones.
+        """
+        counters = {'total_copies': book_aggregate(BookInstance, Count('pk'))}
+        for status, field in Book.STATUS_COUNTERS.items():
+            counters[field] = book_aggregate(BookInstance, Count('pk'), status=status)
+        return counters
+
+    def actual_ratings(self):
+        """
+        Rating, like and bookmark aggregates recomputed from UserBookRelation.
+        """
+        rating_count = book_aggregate(UserBookRelation, Count('pk'), rate__isnull=False)
+        rating_sum = book_aggregate(UserBookRelation, Sum('rate'))
+        return {
+            'rating_count': rating_count,
+            'rating_sum': rating_sum,
+            'like_count': book_aggregate(UserBookRelation, Count('pk'), like=True),
+            'bookmark_count': book_aggregate(UserBookRelation, Count('pk'), in_bookmarks=True),
+            'rating_mean': rating_mean(rating_sum, rating_count),
+        }
+
+    def refresh_availability(self):
+        """
+        Recompute the stored availability counters of the books in this queryset.
+        """
+        was_available = set(self.filter(available_copies__gt=0).values_list('pk', flat=True))
+        rows = self.update(**self.actual_availability())
+        available = set(self.filter(available_copies__gt=0).values_list('pk', flat=True))
+        FacetCount.objects.flip_availability(available - was_available, 1)
+        FacetCount.objects.flip_availability(was_available - available, -1)
+        return rows
+
+    def refresh_ratings(self):
+        """
+        Recompute the stored rating aggregates of the books in this queryset.
+        """
+        return self.update(**self.actual_ratings())
+
+    def actual_review_count(self):
+        return {'review_count': book_aggregate(Review, Count('pk'))}
+
+    def refresh_review_count(self):
+        """
+        Recompute the stored review_count of the books in this queryset.
+        """
+        return self.update(**self.actual_review_count())
+
+    def drift(self, actual, fields):
+        actual = {f'actual_{field}': actual[field] for field in fields}
+        return self.annotate(**actual).exclude(**{field: F(f'actual_{field}') for field in fields})
+
+    def availability_drift(self):
+        """
+        Books whose stored availability counters disagree with their copies.
+        """
+        return self.drift(self.actual_availability(), Book.AVAILABILITY_FIELDS)
+
+    def ratings_drift(self):
+        """
+        Books whose stored rating aggregates disagree with UserBookRelation.
+        """
+        return self.drift(self.actual_ratings(), Book.RATING_FIELDS)
+
+    def review_count_drift(self):
+        """
+        Books whose stored review_count disagrees with their reviews.
+        """
+        return self.drift(self.actual_review_count(), ['review_count'])
+
+    def top(self, metric, limit):
+        """
+        The first limit books by one of TOP_METRICS, served from its index.
+        """
+        return self.order_by(*Book.TOP_METRICS[metric])[:limit]
+
+
+def shifted(field, delta):
+    """
+    F(field) + delta, floored at zero: a counter that has drifted to 0 stays there instead
+    of failing its PositiveIntegerField check and the whole write with it.
+    """
+    return F(field) + delta if delta >= 0 else Greatest(F(field) + delta, 0)
+
+
+def rating_mean(rating_sum, rating_count):
+    return Coalesce(Cast(rating_sum, models.FloatField()) / NullIf(rating_count, 0), 0.0,
+                    output_field=models.FloatField())
+
+
 class Book(models.Model):
     """
     Model representing a book (but not a specific copy of a book).
     """
+    # Denormalized copy counters per BookInstance.status, kept up to date by books.signals
+    # and BookInstanceQuerySet; rebuild with ``manage.py rebuild_counters``.
+    STATUS_COUNTERS = {
+        'm': 'maintenance_copies',
+        'o': 'on_loan_copies',
+        'a': 'available_copies',
+        'r': 'reserved_copies',
+    }
+    AVAILABILITY_FIELDS = ('total_copies', *STATUS_COUNTERS.values())
+    # Denormalized UserBookRelation aggregates; rating_mean is derived from the sum and count.
+    RATING_FIELDS = ('rating_count', 'rating_sum', 'like_count', 'bookmark_count')
+    TOP_METRICS = {
+        'rating': ('-rating_mean', '-rating_count', 'id'),
+        'likes': ('-like_count', 'id'),
+        'bookmarks': ('-bookmark_count', 'id'),
+    }
+    # Maintained in the database only; a plain save() of a stale instance must not overwrite them.
+    COUNTER_FIELDS = (*AVAILABILITY_FIELDS, *RATING_FIELDS, 'rating_mean', 'review_count')
+    # Written by books.search only, after the rest of the row is saved.
+    INDEX_FIELDS = ('search_vector',)
+
     title = models.CharField(max_length=255)
     authors = models.ManyToManyField(Author, help_text='Select the author(s) for this book')
     image = models.ImageField(upload_to='book_covers', default='default-book-cover.png')
+    image_srcset = models.JSONField(default=dict, blank=True, editable=False)
     summary = models.TextField(max_length=1500, default='Описание отсутствует', help_text='Enter a brief description of the book')
     description = models.TextField(max_length=1500, help_text='Библиографическое описание')
     isbn = models.CharField('ISBN', max_length=17, unique=True, help_text='13 Character <a '
@@ -77,9 +294,42 @@ class Book(models.Model):
     genre = models.ManyToManyField(Genre, help_text='Select a genre for this book')
     language = models.ManyToManyField(Language, help_text='Select a language for this book')
     readers = models.ManyToManyField(User, through='UserBookRelation')
+    total_copies = models.PositiveIntegerField(default=0, editable=False)
+    available_copies = models.PositiveIntegerField(default=0, editable=False)
+    on_loan_copies = models.PositiveIntegerField(default=0, editable=False)
+    reserved_copies = models.PositiveIntegerField(default=0, editable=False)
+    maintenance_copies = models.PositiveIntegerField(default=0, editable=False)
+    rating_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_sum = models.PositiveIntegerField(default=0, editable=False)
+    rating_mean = models.FloatField(default=0, editable=False)
+    like_count = models.PositiveIntegerField(default=0, editable=False)
+    bookmark_count = models.PositiveIntegerField(default=0, editable=False)
+    # Moved with each review by books.signals and ReviewQuerySet.
+    review_count = models.PositiveIntegerField(default=0, editable=False)
+    # Full-text document on PostgreSQL; unused elsewhere, see books.search.
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    objects = BookQuerySet.as_manager()
 
     class Meta:
         ordering = ['title']
+        indexes = [
+            # Keyset pagination seeks on (title, id).
+            models.Index(fields=['title', 'id'], name='book_title_id_idx'),
+            # Top-N books per metric, see TOP_METRICS.
+            models.Index(fields=['-rating_mean', '-rating_count', 'id'], name='book_top_rating_idx'),
+            models.Index(fields=['-like_count', 'id'], name='book_top_likes_idx'),
+            models.Index(fields=['-bookmark_count', 'id'], name='book_top_bookmarks_idx'),
+            SearchVectorIndex(fields=['search_vector'], name='books_book_search_gin'),
+        ]
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and not args and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in (*self.COUNTER_FIELDS, *self.INDEX_FIELDS)
+            ]
+        super().save(*args, **kwargs)
 
     def get_absolute_url(self):
         """
@@ -121,6 +371,54 @@ class Book(models.Model):
         return self.title
 
 
+class BookInstanceQuerySet(models.QuerySet):
+    """
+    Bulk writes bypass the model signals, so they refresh the availability
+    counters of every book they touch in the same transaction (bulk_update goes
+    through update()).
+    """
+    counted_fields = {'book', 'book_id', 'status'}
+
+    def update(self, **kwargs):
+        if not self.counted_fields & kwargs.keys():
+            rows = super().update(**kwargs)
+            bulk_changed.send(sender=self.model)
+            return rows
+        moves_books = bool({'book', 'book_id'} & kwargs.keys())
+        with transaction.atomic(using=self.db):
+            pks = list(self.order_by().values_list('pk', flat=True)) if moves_books else []
+            book_ids = set(self.order_by().values_list('book_id', flat=True).distinct())
+            rows = super().update(**kwargs)
+            if moves_books:
+                book_ids.update(self.model.objects.filter(pk__in=pks).values_list('book_id', flat=True))
+            Book.objects.filter(pk__in=book_ids).refresh_availability()
+        bulk_changed.send(sender=self.model)
+        return rows
+
+    def bulk_create(self, objs, *args, **kwargs):
+        with transaction.atomic(using=self.db):
+            objs = super().bulk_create(objs, *args, **kwargs)
+            Book.objects.filter(pk__in={obj.book_id for obj in objs}).refresh_availability()
+        bulk_changed.send(sender=self.model)
+        return objs
+
+    @staticmethod
+    def overdue_condition(today=None):
+        return Q(status='o', due_back__lt=today or date.today())
+
+    def overdue(self, today=None):
+        """
+        Copies on loan past their due date, one range scan on copy_status_due_back_id_idx.
+        """
+        return self.filter(self.overdue_condition(today))
+
+    def with_overdue(self, today=None):
+        """
+        Annotate BookInstance.is_overdue, so it can be filtered and ordered on in the database.
+        """
+        return self.annotate(is_overdue=ExpressionWrapper(self.overdue_condition(today), output_field=BooleanField()))
+
+
 class BookInstance(models.Model):
     """
     Model representing a specific copy of a book (i.e. that can be borrowed from the library).
@@ -149,15 +447,42 @@ class BookInstance(models.Model):
 
     borrower = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
 
+    objects = BookInstanceQuerySet.as_manager()
+
     @property
     def is_overdue(self):
         """
-        Determines if the book is overdue based on due date and current date.
+        Determines if the book is on loan past its due date. Instances loaded through
+        BookInstanceQuerySet.with_overdue() carry the value computed by the database.
         """
-        return bool(self.due_back and date.today() > self.due_back)
+        if 'is_overdue' in self.__dict__:
+            return self.__dict__['is_overdue']
+        return bool(self.status == 'o' and self.due_back and date.today() > self.due_back)
+
+    @is_overdue.setter
+    def is_overdue(self, value):
+        self.__dict__['is_overdue'] = value
+
+    def save(self, *args, **kwargs):
+        # Keep the row and the availability counters updated by books.signals in one transaction.
+        with transaction.atomic(using=kwargs.get('using')):
+            super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic(using=kwargs.get('using')):
+            return super().delete(*args, **kwargs)
 
     class Meta:
         ordering = ['due_back']
+        indexes = [
+            # Keyset pagination of loans seeks on (due_back, id) within a status.
+            models.Index(fields=['status', 'due_back', 'id'], name='copy_status_due_back_id_idx'),
+            # A borrower's loans by due date (LoanedBooksByUserListView), over the copies on loan only.
+            models.Index(fields=['borrower', 'due_back', 'id'], condition=models.Q(status='o'),
+                         name='copy_on_loan_borrower_idx'),
+            # The first pages of the admin changelist, in the default order.
+            models.Index(fields=['due_back', 'id'], name='copy_due_back_id_idx'),
+        ]
         permissions = (("can_mark_returned", "Set book as returned"),)
 
     def __str__(self):
@@ -167,6 +492,151 @@ class BookInstance(models.Model):
         return f'{self.id} ({self.book.title})'
 
 
+class Hold(models.Model):
+    """
+    A patron's place in the queue for a copy of a book.
+
+    Waiting holds are served first come, first served. When a copy comes back it
+    goes to the oldest waiting hold, which becomes ready: the copy is reserved for
+    the patron until ``expires_at``.
+    """
+    WAITING, READY, FULFILLED, EXPIRED, CANCELLED = 'w', 'r', 'f', 'x', 'c'
+    STATUS = (
+        (WAITING, 'Waiting'),
+        (READY, 'Ready for pickup'),
+        (FULFILLED, 'Fulfilled'),
+        (EXPIRED, 'Expired'),
+        (CANCELLED, 'Cancelled'),
+    )
+    ACTIVE = (WAITING, READY)
+
+    book = models.ForeignKey(Book, on_delete=models.CASCADE)
+    patron = models.ForeignKey(User, on_delete=models.CASCADE)
+    status = models.CharField(max_length=1, choices=STATUS, default=WAITING)
+    placed_at = models.DateTimeField(auto_now_add=True)
+    copy = models.ForeignKey(BookInstance, on_delete=models.SET_NULL, null=True, blank=True)
+    expires_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['placed_at', 'id']
+        indexes = [
+            # The head of a book's queue is one range scan on this partial index, however long the queue.
+            models.Index(fields=['book', 'placed_at', 'id'], condition=models.Q(status='w'), name='hold_queue_idx'),
+            # Ready holds past their pickup deadline, for reap_holds.
+            models.Index(fields=['expires_at'], condition=models.Q(status='r'), name='hold_ready_expiry_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['book', 'patron'], condition=models.Q(status__in=('w', 'r')),
+                                    name='hold_one_active_per_patron'),
+        ]
+
+    def __str__(self):
+        return f'{self.patron} waiting for {self.book}' if self.status == self.WAITING \
+            else f'{self.patron} on {self.book} ({self.get_status_display()})'
+
+
+class Fine(models.Model):
+    """
+    The fine on one overdue loan (a copy lent until a due date), reassessed by
+    ``manage.py process_overdue`` for as long as the loan stays overdue.
+    """
+    copy = models.ForeignKey(BookInstance, on_delete=models.CASCADE)
+    borrower = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    due_back = models.DateField()
+    days_overdue = models.PositiveIntegerField()
+    amount = models.DecimalField(max_digits=8, decimal_places=2)
+    assessed_on = models.DateField()
+
+    class Meta:
+        ordering = ['due_back', 'id']
+        indexes = [
+            models.Index(fields=['due_back', 'id'], name='fine_due_back_id_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['copy', 'due_back'], name='fine_one_per_loan'),
+        ]
+
+    def __str__(self):
+        return f'{self.amount} for {self.copy_id} due {self.due_back}'
+
+
+class OverdueNotice(models.Model):
+    """
+    A reminder owed to the borrower of a loan that reached one of OVERDUE_NOTICE_DAYS
+    days overdue; ``sent_at`` is set once it has been delivered.
+    """
+    copy = models.ForeignKey(BookInstance, on_delete=models.CASCADE)
+    borrower = models.ForeignKey(User, on_delete=models.CASCADE)
+    due_back = models.DateField()
+    days_overdue = models.PositiveIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['created_at', 'id']
+        indexes = [
+            # The outbox of notices still to deliver.
+            models.Index(fields=['created_at'], condition=models.Q(sent_at__isnull=True), name='notice_unsent_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['copy', 'due_back', 'days_overdue'], name='notice_one_per_step'),
+        ]
+
+    def __str__(self):
+        return f'{self.borrower}: {self.copy_id} is {self.days_overdue} day(s) overdue'
+
+
+class BatchCheckpoint(models.Model):
+    """
+    Progress of a resumable batch job: the ordering key of the last row it committed in
+    the current run.
+    """
+    job = models.CharField(max_length=100, unique=True)
+    run = models.CharField(max_length=100)
+    position = models.JSONField(null=True, blank=True)
+    finished = models.BooleanField(default=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'{self.job} {self.run}' + (' (finished)' if self.finished else f' at {self.position}')
+
+
+class ReviewQuerySet(models.QuerySet):
+    """
+    Bulk writes bypass the model signals, so they refresh the review_count of every
+    book they touch in the same transaction.
+    """
+    def update(self, **kwargs):
+        if not {'book', 'book_id'} & kwargs.keys():
+            rows = super().update(**kwargs)
+            bulk_changed.send(sender=self.model)
+            return rows
+        with transaction.atomic(using=self.db):
+            pks = list(self.order_by().values_list('pk', flat=True))
+            book_ids = set(self.order_by().values_list('book_id', flat=True).distinct())
+            rows = super().update(**kwargs)
+            book_ids.update(self.model.objects.filter(pk__in=pks).values_list('book_id', flat=True))
+            Book.objects.filter(pk__in=book_ids).refresh_review_count()
+        bulk_changed.send(sender=self.model)
+        return rows
+
+    def bulk_create(self, objs, *args, **kwargs):
+        with transaction.atomic(using=self.db):
+            objs = super().bulk_create(objs, *args, **kwargs)
+            Book.objects.filter(pk__in={obj.book_id for obj in objs}).refresh_review_count()
+        bulk_changed.send(sender=self.model)
+        return objs
+
+    def newest_per_book(self, limit):
+        """
+        The reviews among the limit latest of their book, newest first: numbered per book in one
+        pass over review_book_pub_date_id_idx, rather than a top-N subquery per review.
+        """
+        newest = [F('pub_date').desc(), F('id').desc()]
+        return self.annotate(newest=Window(RowNumber(), partition_by=F('book'), order_by=newest)) \
+            .filter(newest__lte=limit).order_by(*newest)
+
+
 class Review(models.Model):
     title = models.CharField(max_length=100)
     review_text = models.TextField()
@@ -174,13 +644,191 @@ class Review(models.Model):
     book = models.ForeignKey(Book, on_delete=models.CASCADE)
     pub_date = models.DateTimeField('date published', auto_now_add=True)
 
+    objects = ReviewQuerySet.as_manager()
+
     class Meta:
         ordering = ['pub_date']
+        indexes = [
+            # A book's reviews in order: its latest reviews and the keyset pages of /books/{id}/reviews/.
+            models.Index(fields=['book', 'pub_date', 'id'], name='review_book_pub_date_id_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        # Keep the row and the book's review_count updated by books.signals in one transaction.
+        with transaction.atomic(using=kwargs.get('using')):
+            super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic(using=kwargs.get('using')):
+            return super().delete(*args, **kwargs)
 
     def __str__(self):
         return self.title
 
 
+def facet_links_table(facet):
+    """
+    The through model of the Book field of a FacetCount facet, and its column of value ids.
+    """
+    field = Book._meta.get_field(FacetCount.FACETS[facet])
+    return field.remote_field.through, f'{field.m2m_reverse_field_name()}_id'
+
+
+class FacetCountQuerySet(models.QuerySet):
+    """
+    The counts move by deltas in the transaction of the change, like the counters on Book:
+    m2m_changed and Book deletions in books.signals, availability changes in
+    adjust_availability() and BookQuerySet.refresh_availability(), links bulk created by the
+    catalogue importer in link().
+    """
+    def links(self, facet, book_ids=None, value_ids=None):
+        """
+        (book id, value id) pairs of one facet, of the given books or values.
+        """
+        through, column = facet_links_table(facet)
+        links = through.objects.all()
+        if book_ids is not None:
+            links = links.filter(book_id__in=book_ids)
+        if value_ids is not None:
+            links = links.filter(**{f'{column}__in': value_ids})
+        return list(links.values_list('book_id', column))
+
+    def move(self, facet, deltas):
+        """
+        Move the counts of values of one facet by {value id: (books, available books)}, in one
+        UPDATE per distinct delta.
+        """
+        values = defaultdict(list)
+        for value_id, delta in deltas.items():
+            if any(delta):
+                values[delta].append(value_id)
+        for (books, available_books), value_ids in values.items():
+            self.filter(facet=facet, value_id__in=value_ids).update(
+                books=shifted('books', books), available_books=shifted('available_books', available_books))
+
+    def link(self, facet, pairs, sign=1):
+        """
+        Count (sign 1) or uncount (sign -1) the (book id, value id) links of one facet.
+        """
+        pairs = list(pairs)
+        if not pairs:
+            return
+        available = set(Book.objects.filter(pk__in={book_id for book_id, _ in pairs}, available_copies__gt=0)
+                        .values_list('pk', flat=True))
+        books, available_books = Counter(), Counter()
+        for book_id, value_id in pairs:
+            books[value_id] += 1
+            available_books[value_id] += book_id in available
+        if sign > 0:
+            self.bulk_create([FacetCount(facet=facet, value_id=value_id) for value_id in books], ignore_conflicts=True)
+        self.move(facet, {value_id: (sign * n, sign * available_books[value_id]) for value_id, n in books.items()})
+
+    def flip_availability(self, book_ids, sign):
+        """
+        Count (sign 1) or uncount (sign -1) books among the available books of their values.
+        """
+        if not book_ids:
+            return
+        for facet in FacetCount.FACETS:
+            counts = Counter(value_id for _, value_id in self.links(facet, book_ids=book_ids))
+            self.move(facet, {value_id: (0, sign * n) for value_id, n in counts.items()})
+
+    def actual(self):
+        """
+        Unsaved FacetCount rows recomputed from the links of every book.
+        """
+        rows = []
+        for facet in FacetCount.FACETS:
+            through, column = facet_links_table(facet)
+            counts = through.objects.order_by().values_list(column) \
+                .annotate(books=Count('pk'), available_books=Count('pk', filter=Q(book__available_copies__gt=0)))
+            rows += [FacetCount(facet=facet, value_id=value_id, books=books, available_books=available_books)
+                     for value_id, books, available_books in counts]
+        return rows
+
+    def rebuild(self):
+        with transaction.atomic(using=self.db):
+            self.all().delete()
+            self.bulk_create(self.actual(), batch_size=5000)
+
+    def drift(self):
+        """
+        Rows whose stored counts disagree with the links of the books.
+        """
+        books, available_books = [], []
+        for facet in FacetCount.FACETS:
+            through, column = facet_links_table(facet)
+            links = through.objects.filter(**{column: OuterRef('value_id')}).order_by().values(column)
+            count = links.annotate(n=Count('pk')).values('n')
+            available = links.filter(book__available_copies__gt=0).annotate(n=Count('pk')).values('n')
+            books.append(When(facet=facet, then=Coalesce(Subquery(count), 0)))
+            available_books.append(When(facet=facet, then=Coalesce(Subquery(available), 0)))
+        return self.annotate(actual_books=Case(*books), actual_available_books=Case(*available_books)) \
+            .exclude(books=F('actual_books'), available_books=F('actual_available_books'))
+
+
+class FacetCount(models.Model):
+    """
+    Number of books, and of books with an available copy, per genre, language and author,
+    for the unfiltered facets of the catalogue (see books.facets); rebuild with
+    ``manage.py rebuild_counters``.
+    """
+    # Facet name: the Book field linking its values.
+    FACETS = {'genre': 'genre', 'language': 'language', 'author': 'authors'}
+
+    facet = models.CharField(max_length=8, choices=[(facet, facet) for facet in FACETS])
+    # Id of the Genre, Language or Author.
+    value_id = models.BigIntegerField()
+    books = models.PositiveIntegerField(default=0)
+    available_books = models.PositiveIntegerField(default=0)
+
+    objects = FacetCountQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['facet', 'value_id'], name='facet_count_one_per_value'),
+        ]
+        indexes = [
+            # The largest values of a facet, read in order.
+            models.Index(fields=['facet', '-books', 'value_id'], name='facet_count_books_idx'),
+            models.Index(fields=['facet', '-available_books', 'value_id'], name='facet_count_available_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.facet} {self.value_id}: {self.books} book(s), {self.available_books} available'
+
+
+class BookSimilarity(models.Model):
+    """
+    One of the SIMILAR_BOOKS best neighbours of a book, stored by ``manage.py build_similarities``
+    (see books.similarity).
+    """
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='similarities')
+    similar = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='neighbour_of')
+    score = models.FloatField()
+
+    class Meta:
+        ordering = ['book', '-score', 'similar']
+        constraints = [
+            # Also the index the neighbours of a book are read from.
+            models.UniqueConstraint(fields=['book', 'similar'], name='similarity_one_per_pair'),
+        ]
+
+    def __str__(self):
+        return f'{self.book_id} ~ {self.similar_id} ({self.score:.3f})'
+
+
+class StaleSimilarity(models.Model):
+    """
+    A book whose readers changed since its neighbours were stored; consumed by
+    ``manage.py build_similarities --incremental``.
+    """
+    book = models.ForeignKey(Book, on_delete=models.CASCADE)
+
+    def __str__(self):
+        return f'{self.book_id} (queued as {self.pk})'
+
+
 class UserBookRelation(models.Model):
     RATE_CHOICES = (
         (1, 'Ok'),
@@ -190,11 +838,26 @@ class UserBookRelation(models.Model):
         (5, 'Incredible'),
     )
 
-    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    # Lookups by user are served by the unique (user, book) index.
+    user = models.ForeignKey(User, on_delete=models.CASCADE, db_index=False)
     book = models.ForeignKey(Book, on_delete=models.CASCADE)
     like = models.BooleanField(default=False)
     in_bookmarks = models.BooleanField(default=False)
     rate = models.PositiveSmallIntegerField(choices=RATE_CHOICES)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'book'], name='relation_one_per_user_book'),
+        ]
+
+    def save(self, *args, **kwargs):
+        # Keep the row and the book's rating aggregates updated by books.signals in one transaction.
+        with transaction.atomic(using=kwargs.get('using')):
+            super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic(using=kwargs.get('using')):
+            return super().delete(*args, **kwargs)
+
     def __str__(self):
         return f'{self.user} on book {self.book}'
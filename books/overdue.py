@@ -0,0 +1,88 @@
+"""
+Nightly overdue processing: fines and reminders for every loan past its due date.
+``manage.py process_overdue`` runs it from the crontab at the root of the repository.
+
+Overdue loans are walked in (due_back, id) order, one chunk at a time, with a seek
+on the last key seen. Each chunk is one range scan of copy_status_due_back_id_idx,
+so memory stays bounded by the chunk size however many loans there are. A chunk's
+fines are upserted and its reminders inserted in a couple of statements, in the
+same transaction that moves the job's BatchCheckpoint past it: an interrupted run
+resumes after the last committed chunk, and running a day again changes nothing.
+Fines and reminders are keyed by loan, so a rerun with ``restart`` recomputes the
+same rows instead of adding new ones.
+"""
+import datetime
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+
+from .models import BatchCheckpoint, BookInstance, Fine, OverdueNotice
+
+JOB = 'process_overdue'
+
+
+def fine_amount(days_overdue):
+    return min(days_overdue * settings.FINE_PER_DAY, settings.FINE_MAX)
+
+
+def notice_step(days_overdue):
+    """
+    The latest OVERDUE_NOTICE_DAYS step a loan days_overdue late has reached, or None.
+    """
+    return max((days for days in settings.OVERDUE_NOTICE_DAYS if days <= days_overdue), default=None)
+
+
+def after(position):
+    due_back, pk = position
+    due_back = datetime.date.fromisoformat(due_back)
+    # The leading column bounds the index range scan, see KeysetPagination.seek().
+    return Q(due_back__gte=due_back) & (Q(due_back__gt=due_back) | Q(pk__gt=pk))
+
+
+def checkpoint_for(today, restart=False):
+    checkpoint, created = BatchCheckpoint.objects.get_or_create(job=JOB, defaults={'run': today.isoformat()})
+    if restart or checkpoint.run != today.isoformat():
+        checkpoint.run, checkpoint.position, checkpoint.finished = today.isoformat(), None, False
+        checkpoint.save()
+    return checkpoint
+
+
+def process_chunk(loans, today):
+    """
+    Upsert the fines and insert the reminders due for (copy id, borrower id, due_back) loans.
+    """
+    fines, notices = [], []
+    for copy_id, borrower_id, due_back in loans:
+        days_overdue = (today - due_back).days
+        fines.append(Fine(copy_id=copy_id, borrower_id=borrower_id, due_back=due_back, days_overdue=days_overdue,
+                          amount=fine_amount(days_overdue), assessed_on=today))
+        step = notice_step(days_overdue)
+        if step is not None and borrower_id is not None:
+            notices.append(OverdueNotice(copy_id=copy_id, borrower_id=borrower_id, due_back=due_back,
+                                         days_overdue=step))
+    Fine.objects.bulk_create(fines, update_conflicts=True, unique_fields=['copy', 'due_back'],
+                             update_fields=['borrower', 'days_overdue', 'amount', 'assessed_on'])
+    OverdueNotice.objects.bulk_create(notices, ignore_conflicts=True)
+
+
+def process_overdue(today=None, chunk_size=1000, restart=False):
+    """
+    Assess the overdue loans of today (default: the current date) in chunks of chunk_size,
+    resuming after the last committed chunk of an interrupted run of the same day. Yields
+    the number of loans in each chunk as it is committed.
+    """
+    today = today or datetime.date.today()
+    checkpoint = checkpoint_for(today, restart)
+    loans = BookInstance.objects.overdue(today).order_by('due_back', 'id')
+    while not checkpoint.finished:
+        with transaction.atomic():
+            chunk = loans.filter(after(checkpoint.position)) if checkpoint.position else loans
+            chunk = list(chunk.values_list('id', 'borrower_id', 'due_back')[:chunk_size])
+            process_chunk(chunk, today)
+            if chunk:
+                copy_id, _, due_back = chunk[-1]
+                checkpoint.position = [due_back.isoformat(), str(copy_id)]
+            checkpoint.finished = len(chunk) < chunk_size
+            checkpoint.save()
+        yield len(chunk)
@@ -0,0 +1,236 @@
+import base64
+import binascii
+import json
+from collections import OrderedDict
+from types import SimpleNamespace
+
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db.models import F, Q
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Keyset ("seek") pagination over a fixed, unique ordering.
+
+    Unlike PageNumberPagination there is no COUNT(*) and no OFFSET: every page is
+    fetched with a WHERE on the ordering key of the last row seen, so page 10 000
+    costs the same as page 1 as long as an index covers ``ordering``. The last
+    ordering field must be unique (the primary key) to act as a tiebreaker. A
+    ``-`` prefix sorts a field descending; NULLs sort last (first when descending).
+    """
+    page_size = api_settings.PAGE_SIZE
+    cursor_query_param = 'cursor'
+    ordering = ('pk',)
+    invalid_cursor_message = 'Invalid cursor'
+
+    @property
+    def key_columns(self):
+        """
+        Columns key_of() reads besides the primary key, for views paginating ``.values()`` rows.
+        """
+        return [name for name, _ in map(self.split, self.ordering) if name != 'pk']
+
+    @staticmethod
+    def split(field):
+        """
+        (field name, descending) of an ordering field.
+        """
+        return (field[1:], True) if field.startswith('-') else (field, False)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.pk_column = queryset.model._meta.pk.attname
+        self.base_url = request.build_absolute_uri()
+        key, self.reverse = self.decode_cursor(request)
+
+        if key is not None:
+            queryset = queryset.filter(self.seek(queryset, self.clean_key(queryset, key), self.reverse))
+        queryset = queryset.order_by(*self.order_by(self.reverse))
+
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if self.reverse:
+            results.reverse()
+
+        self.first_key = self.key_of(results[0]) if results else key
+        self.last_key = self.key_of(results[-1]) if results else key
+        if self.reverse:
+            self.has_next, self.has_previous = key is not None, has_more
+        else:
+            self.has_next, self.has_previous = has_more, key is not None
+        return results
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True},
+                'previous': {'type': 'string', 'nullable': True},
+                'results': schema,
+            },
+        }
+
+    def get_next_link(self):
+        if not self.has_next or self.last_key is None:
+            return None
+        return replace_query_param(self.base_url, self.cursor_query_param, self.encode_cursor(self.last_key, False))
+
+    def get_previous_link(self):
+        if not self.has_previous or self.first_key is None:
+            return None
+        return replace_query_param(self.base_url, self.cursor_query_param, self.encode_cursor(self.first_key, True))
+
+    def order_by(self, reverse=False):
+        order = []
+        for name, descending in map(self.split, self.ordering):
+            if reverse != descending:
+                order.append(F(name).desc(nulls_first=True))
+            else:
+                order.append(F(name).asc(nulls_last=True))
+        return order
+
+    def seek(self, queryset, key, reverse=False):
+        """
+        Rows strictly after key in the (possibly reversed) ordering, written as
+        ``f1 >= k1 AND (f1 > k1 OR (f1 = k1 AND <seek on the remaining fields>))``
+        so the leading column bounds an index range scan.
+        """
+        opts = queryset.model._meta
+        condition = None
+        for (field, descending), value in reversed(list(zip(map(self.split, self.ordering), key))):
+            nullable = field != 'pk' and opts.get_field(field).null
+            after, at_or_after, equal = self.comparisons(field, value, nullable, reverse != descending)
+            if condition is None:
+                condition = after
+            else:
+                condition = at_or_after & (after | (equal & condition))
+        return condition
+
+    @staticmethod
+    def comparisons(field, value, nullable, reverse):
+        """
+        (strictly after, at or after, equal) lookups for one field; NULLs sort last.
+        """
+        if value is None:
+            equal = Q(**{f'{field}__isnull': True})
+            if reverse:
+                return Q(**{f'{field}__isnull': False}), Q(), equal
+            return Q(pk__in=[]), equal, equal
+        equal = Q(**{field: value})
+        if reverse:
+            return Q(**{f'{field}__lt': value}), Q(**{f'{field}__lte': value}), equal
+        after, at_or_after = Q(**{f'{field}__gt': value}), Q(**{f'{field}__gte': value})
+        if nullable:
+            after |= Q(**{f'{field}__isnull': True})
+            at_or_after |= Q(**{f'{field}__isnull': True})
+        return after, at_or_after, equal
+
+    def key_of(self, instance):
+        if isinstance(instance, dict):
+            instance = SimpleNamespace(pk=instance[self.pk_column], **instance)
+        values = []
+        for field, _ in map(self.split, self.ordering):
+            value = instance.pk if field == 'pk' else getattr(instance, field)
+            values.append(value if value is None or isinstance(value, (int, float)) else str(value))
+        return values
+
+    def encode_cursor(self, key, reverse):
+        payload = json.dumps({'k': key, 'r': int(reverse)}, separators=(',', ':'))
+        return base64.urlsafe_b64encode(payload.encode()).decode()
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+            key, reverse = payload['k'], bool(payload['r'])
+        except (TypeError, ValueError, KeyError, binascii.Error):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(key, list) or len(key) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return key, reverse
+
+    def clean_key(self, queryset, key):
+        """
+        The cursor key converted to the types of the ordering fields; anything the fields
+        would not accept is an invalid cursor rather than a database error.
+        """
+        opts = queryset.model._meta
+        cleaned = []
+        for (name, _), value in zip(map(self.split, self.ordering), key):
+            field = opts.pk if name == 'pk' else opts.get_field(name)
+            if value is None:
+                if not field.null:
+                    raise NotFound(self.invalid_cursor_message)
+                cleaned.append(None)
+                continue
+            if not isinstance(value, (str, int, float)):
+                raise NotFound(self.invalid_cursor_message)
+            try:
+                value = field.to_python(value)
+                field.run_validators(value)
+            except DjangoValidationError:
+                raise NotFound(self.invalid_cursor_message)
+            cleaned.append(value)
+        return cleaned
+
+    def get_schema_operation_parameters(self, view):
+        return [{
+            'name': self.cursor_query_param,
+            'required': False,
+            'in': 'query',
+            'description': 'The pagination cursor value.',
+            'schema': {'type': 'string'},
+        }]
+
+
+class BookKeysetPagination(KeysetPagination):
+    ordering = ('title', 'id')
+
+
+class LoanKeysetPagination(KeysetPagination):
+    ordering = ('due_back', 'id')
+
+
+class ReviewKeysetPagination(KeysetPagination):
+    ordering = ('-pub_date', '-id')
+
+
+class KeysetPaginationMixin:
+    """
+    Let clients opt in to keyset pagination with ``?pagination=keyset`` (or by
+    following a ``cursor`` link); otherwise the default page-number pagination applies.
+    """
+    keyset_pagination_class = None
+    pagination_mode_param = 'pagination'
+    # Query parameters that order the results themselves, which keyset pagination would override.
+    keyset_conflicting_params = ()
+
+    def wants_keyset_pagination(self):
+        params = self.request.query_params
+        return params.get(self.pagination_mode_param) == 'keyset' or \
+            self.keyset_pagination_class.cursor_query_param in params
+
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator') and self.keyset_pagination_class is not None \
+                and self.wants_keyset_pagination():
+            conflicting = [param for param in self.keyset_conflicting_params if self.request.query_params.get(param)]
+            if conflicting:
+                raise ValidationError({param: 'Not supported with keyset pagination.' for param in conflicting})
+            self._paginator = self.keyset_pagination_class()
+        return super().paginator
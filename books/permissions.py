@@ -10,3 +10,9 @@ class IsAuthorOrReadOnly(BasePermission):
             request.user.is_authenticated and
             obj.author == request.user
         )
+
+
+class IsLibrarian(BasePermission):
+
+    def has_permission(self, request, view):
+        return bool(request.user and request.user.has_perm('books.can_mark_returned'))
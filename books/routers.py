@@ -0,0 +1,114 @@
+"""
+Read replicas for the API.
+
+Safe-method requests to the books viewsets read from one of REPLICA_DATABASES;
+everything else (writes, other views, management commands) uses ``default``.
+A replica lags behind the primary, so a client that just wrote would not see its
+own review or rating: every unsafe request therefore sets a short-lived cookie
+that keeps that client's reads on the primary for REPLICA_PIN_SECONDS.
+
+A request picks its replica once, so all of its reads (e.g. a page and its count)
+see the same point of the replication stream.
+
+Sessions and tokens are always read from the primary, so a login or logout takes
+effect at once whatever the replication lag.
+"""
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.urls import Resolver404, resolve
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.viewsets import ViewSetMixin
+
+PIN_COOKIE = 'primary_pin'
+REPLICA_APP_LABELS = {'books', 'auth'}
+
+# The replica the reads of the current request go to, None for the primary.
+replica = ContextVar('replica', default=None)
+
+
+@contextmanager
+def primary():
+    """
+    Read from the primary inside the block, e.g. for data that outlives the request.
+    """
+    token = replica.set(None)
+    try:
+        yield
+    finally:
+        replica.reset(token)
+
+
+class ReplicaRouter:
+    """
+    Send reads to the replica of the current request, if it has one (see ReplicaRoutingMiddleware).
+    """
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label not in REPLICA_APP_LABELS:
+            return None
+        return replica.get()
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replicas hold the same rows as the primary.
+        return True
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Route the reads of safe-method requests to the books viewsets to a random replica,
+    unless the client is pinned to the primary; pin clients that send an unsafe request.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        # Set here rather than in process_view(), which an ASGI server runs in a context of its own.
+        token = replica.set(random.choice(settings.REPLICA_DATABASES)) if self.reads_from_replica(request) else None
+        try:
+            response = self.get_response(request)
+        finally:
+            if token is not None:
+                replica.reset(token)
+        return self.pin(request, response)
+
+    async def __acall__(self, request):
+        token = replica.set(random.choice(settings.REPLICA_DATABASES)) if self.reads_from_replica(request) else None
+        try:
+            response = await self.get_response(request)
+        finally:
+            if token is not None:
+                replica.reset(token)
+        return self.pin(request, response)
+
+    @staticmethod
+    def pin(request, response):
+        if request.method not in SAFE_METHODS and settings.REPLICA_DATABASES:
+            response.set_cookie(PIN_COOKIE, '1', max_age=settings.REPLICA_PIN_SECONDS, httponly=True, samesite='Lax')
+        return response
+
+    @staticmethod
+    def reads_from_replica(request):
+        if not settings.REPLICA_DATABASES or request.method not in SAFE_METHODS or PIN_COOKIE in request.COOKIES:
+            return False
+        try:
+            view_class = getattr(resolve(request.path_info).func, 'cls', None)
+        except Resolver404:
+            return False
+        return view_class is not None and issubclass(view_class, ViewSetMixin) \
+            and view_class.__module__.startswith('books.')
@@ -0,0 +1,316 @@
+"""
+Full-text search over the book catalogue.
+
+Each database keeps its own index of title, author names, summary, description
+and ISBN:
+    * PostgreSQL - the weighted ``Book.search_vector`` column behind a GIN index;
+    * SQLite - an FTS5 virtual table keyed by the book id.
+Authors are searched by name the same way: through a GIN index on their name
+vector on PostgreSQL and through a second FTS5 table on SQLite.
+The indexes are created by migration, kept in sync by the handlers in books.signals
+and can be rebuilt with ``manage.py rebuild_search_index``.
+"""
+import re
+
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+from django.db import connection as default_connection
+from django.db.models import F
+from django.db.models.expressions import RawSQL
+
+SEARCH_CONFIG = 'simple'
+VECTOR_COLUMN = 'search_vector'
+FTS_TABLE = 'books_book_fts'
+AUTHOR_FTS_TABLE = 'books_author_fts'
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+class SearchVectorIndex(GinIndex):
+    """
+    GIN index on PostgreSQL. The other backends search an index of their own (see
+    BACKENDS) and get no index from it.
+    """
+
+    def create_sql(self, model, schema_editor, using='', **kwargs):
+        if schema_editor.connection.vendor != 'postgresql':
+            return ''
+        return super().create_sql(model, schema_editor, using=using, **kwargs)
+
+    def remove_sql(self, model, schema_editor, **kwargs):
+        if schema_editor.connection.vendor != 'postgresql':
+            return ''
+        return super().remove_sql(model, schema_editor, **kwargs)
+
+
+def author_vector():
+    """
+    Name vector of an Author, as indexed by Author.Meta.indexes.
+    """
+    return SearchVector('first_name', 'middle_name', 'last_name', config=SEARCH_CONFIG)
+
+
+def author_names(book):
+    return ' '.join(
+        ' '.join(filter(None, (author.first_name, author.middle_name, author.last_name)))
+        for author in book.authors.all()
+    )
+
+
+def documents(book_ids):
+    """
+    Yield (id, title, authors, summary, description, isbn) rows for the given books.
+    """
+    from .models import Book
+
+    books = Book.objects.filter(pk__in=book_ids).only('title', 'summary', 'description', 'isbn') \
+        .prefetch_related('authors')
+    for book in books:
+        yield book.pk, book.title, author_names(book), book.summary or '', book.description or '', book.isbn
+
+
+class PostgresSearchBackend:
+    """
+    Book.search_vector with a GIN index; title, authors and ISBN weigh the most.
+    """
+    # Punctuation becomes whitespace before parsing, as in FTS5's unicode61 tokenizer; the default
+    # parser would otherwise read an ISBN like 978-0-00-000002 as the signed integers -0, -00, ...
+    document_sql = ' || '.join(
+        f"setweight(to_tsvector('{{config}}', regexp_replace(coalesce({{{column}}}, ''), '\\W+', ' ', 'g')), "
+        f"'{weight}')"
+        for column, weight in (('title', 'A'), ('authors', 'A'), ('isbn', 'A'), ('summary', 'B'), ('description', 'C'))
+    )
+    authors_sql = (
+        "(SELECT string_agg(concat_ws(' ', a.first_name, a.middle_name, a.last_name), ' ') "
+        "FROM books_book_authors ba JOIN books_author a ON a.id = ba.author_id WHERE ba.book_id = books_book.id)"
+    )
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def install(self):
+        # The column and its index predate Book.search_vector, which migration 0033 adopted.
+        with self.connection.cursor() as cursor:
+            cursor.execute(f'ALTER TABLE books_book ADD COLUMN IF NOT EXISTS {VECTOR_COLUMN} tsvector')
+            cursor.execute(f'CREATE INDEX IF NOT EXISTS books_book_search_gin ON books_book USING GIN ({VECTOR_COLUMN})')
+        self.rebuild()
+
+    def uninstall(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f'ALTER TABLE books_book DROP COLUMN IF EXISTS {VECTOR_COLUMN}')
+
+    def rebuild(self):
+        document = self.document_sql.format(
+            config=SEARCH_CONFIG, title='title', authors=self.authors_sql, isbn='isbn',
+            summary='summary', description='description',
+        )
+        with self.connection.cursor() as cursor:
+            cursor.execute(f'UPDATE books_book SET {VECTOR_COLUMN} = {document}')
+
+    def index(self, book_ids):
+        self.write(documents(book_ids))
+
+    def write(self, rows):
+        document = self.document_sql.format(
+            config=SEARCH_CONFIG, title='%s', authors='%s', summary='%s', description='%s', isbn='%s',
+        )
+        rows = [(title, authors, isbn, summary, description, pk)
+                for pk, title, authors, summary, description, isbn in rows]
+        with self.connection.cursor() as cursor:
+            cursor.executemany(f'UPDATE books_book SET {VECTOR_COLUMN} = {document} WHERE id = %s', rows)
+
+    def remove(self, book_ids):
+        # The vector lives on the book row and goes away with it.
+        pass
+
+    @staticmethod
+    def match_expression(query):
+        # Same semantics as the SQLite backend: every token quoted, all of them prefix-matched.
+        return ' & '.join(f"'{token}':*" for token in TOKEN_RE.findall(query))
+
+    def search_query(self, query):
+        expression = self.match_expression(query)
+        return SearchQuery(expression, search_type='raw', config=SEARCH_CONFIG) if expression else None
+
+    def search(self, queryset, query):
+        tsquery = self.search_query(query)
+        if tsquery is None:
+            return queryset.none()
+        return queryset.filter(search_vector=tsquery).annotate(
+            search_rank=SearchRank(F(VECTOR_COLUMN), tsquery, cover_density=True),
+        )
+
+    def search_authors(self, queryset, query):
+        tsquery = self.search_query(query)
+        if tsquery is None:
+            return queryset.none()
+        return queryset.alias(name_vector=author_vector()).filter(name_vector=tsquery)
+
+    def index_authors(self, author_ids):
+        # Author names are indexed by expression and need no upkeep.
+        pass
+
+    def remove_authors(self, author_ids):
+        pass
+
+
+class SQLiteSearchBackend:
+    """
+    FTS5 table whose rowid is the book id, ranked with bm25.
+    """
+    # bm25 column weights: title, authors, summary, description, isbn
+    weights = '10.0, 10.0, 3.0, 1.0, 10.0'
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def install(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                f'CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} '
+                f'USING fts5(title, authors, summary, description, isbn, tokenize="unicode61")'
+            )
+            cursor.execute(
+                f'CREATE VIRTUAL TABLE IF NOT EXISTS {AUTHOR_FTS_TABLE} '
+                f'USING fts5(first_name, middle_name, last_name, tokenize="unicode61")'
+            )
+        self.rebuild()
+
+    def uninstall(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+            cursor.execute(f'DROP TABLE IF EXISTS {AUTHOR_FTS_TABLE}')
+
+    def rebuild(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {AUTHOR_FTS_TABLE}')
+            cursor.execute(
+                f'INSERT INTO {AUTHOR_FTS_TABLE} (rowid, first_name, middle_name, last_name) '
+                f'SELECT id, first_name, middle_name, last_name FROM books_author'
+            )
+            cursor.execute(f'DELETE FROM {FTS_TABLE}')
+            cursor.execute(
+                f'INSERT INTO {FTS_TABLE} (rowid, title, authors, summary, description, isbn) '
+                f"SELECT b.id, b.title, coalesce((SELECT group_concat(trim(a.first_name || ' ' || "
+                f"coalesce(a.middle_name, '') || ' ' || a.last_name), ' ') FROM books_book_authors ba "
+                f"JOIN books_author a ON a.id = ba.author_id WHERE ba.book_id = b.id), ''), "
+                f"b.summary, b.description, b.isbn FROM books_book b"
+            )
+
+    def index(self, book_ids):
+        self.write(documents(book_ids))
+
+    def write(self, rows):
+        rows = list(rows)
+        with self.connection.cursor() as cursor:
+            cursor.executemany(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [(row[0],) for row in rows])
+            cursor.executemany(
+                f'INSERT INTO {FTS_TABLE} (rowid, title, authors, summary, description, isbn) '
+                f'VALUES (%s, %s, %s, %s, %s, %s)', rows,
+            )
+
+    def remove(self, book_ids):
+        with self.connection.cursor() as cursor:
+            cursor.executemany(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [(pk,) for pk in book_ids])
+
+    @staticmethod
+    def match_expression(query):
+        # Quote every token so user input can't inject FTS5 syntax; prefix-match them all.
+        return ' '.join(f'"{token}"*' for token in TOKEN_RE.findall(query))
+
+    def search(self, queryset, query):
+        expression = self.match_expression(query)
+        if not expression:
+            return queryset.none()
+        # Joined rather than filtered through a subquery so that MATCH and bm25 run once
+        # per query instead of once per matching book.
+        return queryset.extra(
+            tables=[FTS_TABLE],
+            where=[f'{FTS_TABLE} MATCH %s', f'{FTS_TABLE}.rowid = books_book.id'],
+            params=[expression],
+            select={'search_rank': f'-bm25({FTS_TABLE}, {self.weights})'},
+        )
+
+    def search_authors(self, queryset, query):
+        expression = self.match_expression(query)
+        if not expression:
+            return queryset.none()
+        return queryset.filter(
+            pk__in=RawSQL(f'SELECT rowid FROM {AUTHOR_FTS_TABLE} WHERE {AUTHOR_FTS_TABLE} MATCH %s', (expression,)),
+        )
+
+    def index_authors(self, author_ids):
+        from .models import Author
+
+        rows = Author.objects.filter(pk__in=author_ids).values_list('pk', 'first_name', 'middle_name', 'last_name')
+        self.remove_authors(author_ids)
+        with self.connection.cursor() as cursor:
+            cursor.executemany(
+                f'INSERT INTO {AUTHOR_FTS_TABLE} (rowid, first_name, middle_name, last_name) VALUES (%s, %s, %s, %s)',
+                rows,
+            )
+
+    def remove_authors(self, author_ids):
+        with self.connection.cursor() as cursor:
+            cursor.executemany(f'DELETE FROM {AUTHOR_FTS_TABLE} WHERE rowid = %s', [(pk,) for pk in author_ids])
+
+
+BACKENDS = {
+    'postgresql': PostgresSearchBackend,
+    'sqlite': SQLiteSearchBackend,
+}
+
+
+def get_backend(connection=None):
+    connection = connection or default_connection
+    try:
+        return BACKENDS[connection.vendor](connection)
+    except KeyError:
+        raise NotImplementedError(f'Full-text search is not supported on {connection.vendor}')
+
+
+def index_books(book_ids):
+    book_ids = list(book_ids)
+    if book_ids and default_connection.vendor in BACKENDS:
+        get_backend().index(book_ids)
+
+
+def index_documents(rows):
+    """
+    Index (id, title, authors, summary, description, isbn) rows the caller already has at hand.
+    """
+    rows = list(rows)
+    if rows and default_connection.vendor in BACKENDS:
+        get_backend().write(rows)
+
+
+def remove_books(book_ids):
+    book_ids = list(book_ids)
+    if book_ids and default_connection.vendor in BACKENDS:
+        get_backend().remove(book_ids)
+
+
+def index_authors(author_ids):
+    author_ids = list(author_ids)
+    if author_ids and default_connection.vendor in BACKENDS:
+        get_backend().index_authors(author_ids)
+
+
+def remove_authors(author_ids):
+    author_ids = list(author_ids)
+    if author_ids and default_connection.vendor in BACKENDS:
+        get_backend().remove_authors(author_ids)
+
+
+def search_books(queryset, query):
+    """
+    Filter queryset down to books matching query, annotated with search_rank (higher is better).
+    """
+    return get_backend(default_connection).search(queryset, query)
+
+
+def search_authors(queryset, query):
+    """
+    Filter queryset down to authors whose names match query.
+    """
+    return get_backend(default_connection).search_authors(queryset, query)
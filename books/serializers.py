@@ -1,9 +1,13 @@
+from django.conf import settings
 from django.contrib.auth import authenticate, get_user_model
 from django.contrib.auth.models import User
+from django.db.models import Prefetch
 
 from rest_framework import serializers
 
-from .models import Book, Author, Genre, BookInstance, Review, UserBookRelation
+from .fieldsets import SparseFieldsetSerializerMixin
+from .images import ImageSrcsetField
+from .models import Book, Author, Genre, BookInstance, Hold, Review, UserBookRelation
 
 
 class EmptySerializer(serializers.Serializer):
@@ -54,7 +58,7 @@ class LoginSerializer(serializers.Serializer):
 UserModel = get_user_model()
 
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(SparseFieldsetSerializerMixin, serializers.ModelSerializer):
     password = serializers.CharField(write_only=True)
 
     def create(self, validated_data):
@@ -70,52 +74,182 @@ class UserSerializer(serializers.ModelSerializer):
         fields = ('id', 'username', 'email', 'first_name', 'last_name', 'password')
 
 
-class RelatedBooksSerializer(serializers.ModelSerializer):
+class AuthorSerializer(SparseFieldsetSerializerMixin, serializers.ModelSerializer):
+    """
+    An author with the number of their books; the books themselves are paged at /authors/{id}/books/.
+    """
+    image_srcset = ImageSrcsetField()
+
     class Meta:
-        model = Book
-        fields = ['id', 'title', 'image', 'summary', 'bookinstance_set']
+        model = Author
+        fields = ['id', 'first_name', 'last_name', 'date_of_birth', 'date_of_death', 'image', 'image_srcset',
+                  'book_count']
 
 
-class AuthorSerializer(serializers.ModelSerializer):
-    book_set = RelatedBooksSerializer(read_only=True, many=True)
+class AuthorListSerializer(AuthorSerializer):
+    """
+    Authors without their dates unless asked for with ``?fields=``.
+    """
+
+    class Meta(AuthorSerializer.Meta):
+        default_fields = ['id', 'first_name', 'last_name', 'image', 'image_srcset', 'book_count']
 
+
+class AuthorNameSerializer(serializers.ModelSerializer):
     class Meta:
         model = Author
-        fields = ['id', 'first_name', 'last_name', 'date_of_birth', 'date_of_death', 'image', 'book_set']
+        fields = ['id', 'first_name', 'last_name']
 
 
-class GenreSerializer(serializers.ModelSerializer):
+class GenreSerializer(SparseFieldsetSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Genre
         fields = ['name']
 
 
-class BookInstanceSerializer(serializers.ModelSerializer):
-    borrower = UserSerializer()
+class BookInstanceSerializer(SparseFieldsetSerializerMixin, serializers.ModelSerializer):
+    # Loan state only changes through the books.loans endpoints.
+    borrower = UserSerializer(read_only=True)
+
+    @classmethod
+    def setup_eager_loading(cls, queryset, fields=None, expand=()):
+        if 'borrower' in cls.selected_fields(fields, expand):
+            queryset = queryset.select_related('borrower')
+        return super().setup_eager_loading(queryset, fields, expand)
 
     class Meta:
         model = BookInstance
         fields = ['id', 'due_back', 'status', 'borrower', 'imprint']
+        read_only_fields = ['due_back', 'status']
 
 
-class ReviewSerializer(serializers.ModelSerializer):
+class CheckoutSerializer(serializers.Serializer):
+    borrower = serializers.PrimaryKeyRelatedField(queryset=User.objects.all())
+
+
+class HoldSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Hold
+        fields = ['id', 'book', 'status', 'placed_at', 'copy', 'expires_at']
+        read_only_fields = fields
+
+
+class CopyStatusSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = BookInstance
+        fields = ['id', 'status', 'due_back']
+
+
+class ReviewSerializer(SparseFieldsetSerializerMixin, serializers.ModelSerializer):
     author = UserSerializer(read_only=True)
     pub_date = serializers.DateTimeField(format="%d %B %Y, %H:%M", read_only=True)
 
+    @classmethod
+    def setup_eager_loading(cls, queryset, fields=None, expand=()):
+        if 'author' in cls.selected_fields(fields, expand):
+            queryset = queryset.select_related('author')
+        return super().setup_eager_loading(queryset, fields, expand)
+
     class Meta:
         model = Review
         fields = ['id', 'title', 'review_text', 'author', 'pub_date', 'book']
 
 
-class BookSerializer(serializers.ModelSerializer):
+class ReviewerSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = UserModel
+        fields = ['id', 'username']
+
+
+class BookReviewSerializer(ReviewSerializer):
+    """
+    A review as listed under its book: without the book, and the author by username.
+    """
+    author = ReviewerSerializer(read_only=True)
+
+    class Meta(ReviewSerializer.Meta):
+        fields = ['id', 'title', 'review_text', 'author', 'pub_date']
+
+
+class LatestReviewsSerializer(serializers.ListSerializer):
+    """
+    A book's LATEST_REVIEWS newest reviews, newest first. restrict() is the review query
+    of the eager-loading plan, and books.fastpath applies it to its own.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(child=BookReviewSerializer(), source='review_set', read_only=True, **kwargs)
+
+    @staticmethod
+    def restrict(reviews):
+        return reviews.newest_per_book(settings.LATEST_REVIEWS)
+
+    def to_representation(self, data):
+        reviews = data.all()
+        if reviews._result_cache is None:
+            # Not prefetched, e.g. the response to a write: fetch the newest only.
+            reviews = self.restrict(reviews)
+        return super().to_representation(reviews)
+
+
+class BookSerializer(SparseFieldsetSerializerMixin, serializers.ModelSerializer):
     authors = AuthorSerializer(read_only=True, many=True)
+    image_srcset = ImageSrcsetField()
     genre = GenreSerializer(read_only=True, many=True)
     bookinstance_set = BookInstanceSerializer(read_only=True, many=True)
-    review_set = ReviewSerializer(read_only=True, many=True)
+    latest_reviews = LatestReviewsSerializer()
+
+    @classmethod
+    def setup_eager_loading(cls, queryset, fields=None, expand=()):
+        """
+        Prefetch plan matching the serializer tree: one query per rendered nested
+        relation regardless of page size.
+        """
+        selected = cls.selected_fields(fields, expand)
+        queryset = super().setup_eager_loading(queryset, fields, expand)
+        return queryset.prefetch_related(*(
+            cls.prefetch(name, name in expand or name not in cls.expandable_fields())
+            for name in ('authors', 'genre', 'bookinstance_set', 'latest_reviews') if name in selected
+        ))
+
+    @staticmethod
+    def prefetch(name, expanded):
+        """
+        Prefetch for one nested relation, in its full (expanded) or compact form.
+        """
+        if name == 'authors':
+            authors = AuthorSerializer.setup_eager_loading(Author.objects.all()) if expanded \
+                else Author.objects.only('id', 'first_name', 'last_name')
+            return Prefetch('authors', queryset=authors)
+        if name == 'genre':
+            return Prefetch('genre', queryset=Genre.objects.only('id', 'name'))
+        if name == 'bookinstance_set':
+            copies = BookInstance.objects.select_related('borrower') if expanded \
+                else BookInstance.objects.only('id', 'book', 'status', 'due_back')
+            return Prefetch('bookinstance_set', queryset=copies)
+        return Prefetch('review_set', queryset=LatestReviewsSerializer.restrict(Review.objects.select_related('author')))
 
     class Meta:
         model = Book
-        fields = ['id', 'title', 'authors', 'image', 'summary', 'isbn', 'genre', 'bookinstance_set', 'review_set']
+        fields = ['id', 'title', 'authors', 'image', 'image_srcset', 'summary', 'isbn', 'genre', 'bookinstance_set',
+                  'review_count', 'latest_reviews', *Book.AVAILABILITY_FIELDS, *Book.RATING_FIELDS, 'rating_mean']
+
+
+class BookListSerializer(BookSerializer):
+    """
+    Catalogue listing: a handful of columns and author names by default; any field of
+    BookSerializer through ``?fields=``, nested relations in full through ``?expand=``.
+    """
+    authors = AuthorNameSerializer(read_only=True, many=True)
+    bookinstance_set = CopyStatusSerializer(read_only=True, many=True)
+
+    class Meta(BookSerializer.Meta):
+        default_fields = ['id', 'title', 'authors', 'image', 'image_srcset', 'isbn', 'genre', 'available_copies',
+                          'rating_mean']
+        expandable_fields = {
+            'authors': lambda: AuthorSerializer(read_only=True, many=True),
+            'bookinstance_set': lambda: BookInstanceSerializer(read_only=True, many=True),
+        }
 
 
 class UserBookRelationSerializer(serializers.ModelSerializer):
@@ -0,0 +1,309 @@
+"""
+Signal handlers keeping denormalized catalogue data in sync with the models.
+"""
+from collections import Counter
+
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from . import cache, images, search
+from .models import Author, Book, BookInstance, FacetCount, Genre, Language, Review, StaleSimilarity, User, \
+    UserBookRelation, bulk_changed, rating_mean, shifted
+
+
+@receiver(post_save, sender=Book)
+def index_saved_book(sender, instance, raw=False, **kwargs):
+    if not raw:
+        search.index_books([instance.pk])
+
+
+@receiver(post_delete, sender=Book)
+def unindex_deleted_book(sender, instance, **kwargs):
+    search.remove_books([instance.pk])
+
+
+@receiver(m2m_changed, sender=Book.authors.through)
+def index_book_authors(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear' and reverse:
+        # The author loses all of its books; remember which ones before they are gone.
+        instance._cleared_book_ids = list(instance.book_set.values_list('pk', flat=True))
+    elif action in ('post_add', 'post_remove'):
+        search.index_books(pk_set if reverse else [instance.pk])
+    elif action == 'post_clear':
+        search.index_books(instance.__dict__.pop('_cleared_book_ids', []) if reverse else [instance.pk])
+
+
+@receiver(post_save, sender=Author)
+def index_saved_author(sender, instance, raw=False, **kwargs):
+    if not raw:
+        search.index_authors([instance.pk])
+
+
+@receiver(post_delete, sender=Author)
+def unindex_deleted_author(sender, instance, **kwargs):
+    search.remove_authors([instance.pk])
+
+
+@receiver(post_save, sender=Author)
+def index_author_books(sender, instance, created, raw=False, **kwargs):
+    if not created and not raw:
+        search.index_books(instance.book_set.values_list('pk', flat=True))
+
+
+@receiver(pre_delete, sender=Author)
+def remember_author_books(sender, instance, **kwargs):
+    instance._deleted_book_ids = list(instance.book_set.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Author)
+def index_orphaned_books(sender, instance, **kwargs):
+    search.index_books(instance.__dict__.pop('_deleted_book_ids', []))
+
+
+@receiver(pre_save, sender=Book)
+@receiver(pre_save, sender=Author)
+def forget_stale_derivatives(sender, instance, raw=False, **kwargs):
+    if instance.image_srcset.get('source') != instance.image.name:
+        instance.image_srcset = {}
+
+
+@receiver(post_save, sender=Book)
+@receiver(post_save, sender=Author)
+def derive_saved_image(sender, instance, raw=False, **kwargs):
+    if not raw and instance.image and not instance.image_srcset:
+        images.schedule(sender, instance.image.name)
+
+
+FACET_LINKS = {Book._meta.get_field(field).remote_field.through: facet for facet, field in FacetCount.FACETS.items()}
+
+
+def count_facet_links(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Move the FacetCount rows of the links added or removed, remembering those about to go
+    in the pre_ signals (remove() is given ids that may not be linked, clear() none).
+    """
+    facet = FACET_LINKS[sender]
+    key = f'_{facet}_links'
+    if action == 'post_add':
+        FacetCount.objects.link(facet, [(pk, instance.pk) if reverse else (instance.pk, pk) for pk in pk_set])
+    elif action in ('pre_remove', 'pre_clear'):
+        values = {'book_ids': pk_set, 'value_ids': [instance.pk]} if reverse else \
+            {'book_ids': [instance.pk], 'value_ids': pk_set}
+        instance.__dict__[key] = FacetCount.objects.links(facet, **values)
+    elif action in ('post_remove', 'post_clear'):
+        FacetCount.objects.link(facet, instance.__dict__.pop(key, []), -1)
+
+
+for through in FACET_LINKS:
+    m2m_changed.connect(count_facet_links, sender=through)
+
+
+@receiver(pre_delete, sender=Book)
+def uncount_deleted_book(sender, instance, **kwargs):
+    # The links go with the book, without m2m_changed.
+    for facet in FacetCount.FACETS:
+        FacetCount.objects.link(facet, FacetCount.objects.links(facet, book_ids=[instance.pk]), -1)
+
+
+@receiver(m2m_changed, sender=Book.authors.through)
+def count_author_books(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Move Author.book_count by the links added or removed, remembering the authors about to
+    lose a book in the pre_ signals, as count_facet_links() does.
+    """
+    if action == 'post_add':
+        Author.objects.move_book_counts({instance.pk: len(pk_set)} if reverse else dict.fromkeys(pk_set, 1))
+    elif action in ('pre_remove', 'pre_clear'):
+        links = sender.objects.filter(author=instance.pk) if reverse else sender.objects.filter(book=instance.pk)
+        if pk_set is not None:
+            links = links.filter(book__in=pk_set) if reverse else links.filter(author__in=pk_set)
+        instance.__dict__['_unlinked_authors'] = list(links.values_list('author_id', flat=True))
+    elif action in ('post_remove', 'post_clear'):
+        unlinked = Counter(instance.__dict__.pop('_unlinked_authors', []))
+        Author.objects.move_book_counts({author_id: -books for author_id, books in unlinked.items()})
+
+
+@receiver(pre_delete, sender=Book)
+def uncount_deleted_book_authors(sender, instance, **kwargs):
+    # The links go with the book, without m2m_changed.
+    Author.objects.move_book_counts(dict.fromkeys(instance.authors.values_list('pk', flat=True), -1))
+
+
+@receiver(post_delete, sender=Genre)
+@receiver(post_delete, sender=Language)
+@receiver(post_delete, sender=Author)
+def forget_facet_value(sender, instance, **kwargs):
+    facet = {Genre: 'genre', Language: 'language', Author: 'author'}[sender]
+    FacetCount.objects.filter(facet=facet, value_id=instance.pk).delete()
+
+
+def adjust_availability(book_id, status, delta):
+    """
+    Move the total and per-status copy counters of a book by delta in one UPDATE.
+    """
+    if book_id is None:
+        return
+    changes = {'total_copies': shifted('total_copies', delta)}
+    if status in Book.STATUS_COUNTERS:
+        field = Book.STATUS_COUNTERS[status]
+        changes[field] = shifted(field, delta)
+    Book.objects.filter(pk=book_id).update(**changes)
+    # The UPDATE holds the row lock, so exactly one change sees the book become (un)available.
+    if status == 'a' and Book.objects.filter(pk=book_id, available_copies=1 if delta > 0 else 0).exists():
+        FacetCount.objects.flip_availability([book_id], 1 if delta > 0 else -1)
+
+
+@receiver(pre_save, sender=BookInstance)
+def remember_copy_state(sender, instance, raw=False, update_fields=None, **kwargs):
+    instance._counted_state = None
+    if raw or instance._state.adding:
+        return
+    if update_fields is not None and not {'book', 'status'} & set(update_fields):
+        return
+    # Lock the row so concurrent saves can't both move the counters away from the same old state.
+    instance._counted_state = BookInstance.objects.select_for_update().filter(pk=instance.pk) \
+        .values_list('book_id', 'status').first()
+
+
+@receiver(post_save, sender=BookInstance)
+def count_saved_copy(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        adjust_availability(instance.book_id, instance.status, 1)
+        return
+    old = instance.__dict__.pop('_counted_state', None)
+    if old and old != (instance.book_id, instance.status):
+        adjust_availability(old[0], old[1], -1)
+        adjust_availability(instance.book_id, instance.status, 1)
+
+
+@receiver(post_delete, sender=BookInstance)
+def count_deleted_copy(sender, instance, **kwargs):
+    adjust_availability(instance.book_id, instance.status, -1)
+
+
+RELATION_STATE = ('book_id', 'rate', 'like', 'in_bookmarks')
+
+
+def rating_contribution(book_id, rate, like, in_bookmarks):
+    return {
+        'rating_count': int(rate is not None),
+        'rating_sum': rate or 0,
+        'like_count': int(bool(like)),
+        'bookmark_count': int(bool(in_bookmarks)),
+    }
+
+
+def adjust_ratings(book_id, delta):
+    """
+    Move the rating aggregates of a book by delta and rederive the mean, in one UPDATE.
+    """
+    if book_id is None or not any(delta.values()):
+        return
+    changes = {field: shifted(field, value) for field, value in delta.items()}
+    changes['rating_mean'] = rating_mean(changes['rating_sum'], changes['rating_count'])
+    Book.objects.filter(pk=book_id).update(**changes)
+
+
+@receiver(pre_save, sender=UserBookRelation)
+def remember_relation_state(sender, instance, raw=False, **kwargs):
+    instance._rated_state = None
+    if not raw and not instance._state.adding:
+        instance._rated_state = UserBookRelation.objects.select_for_update().filter(pk=instance.pk) \
+            .values_list(*RELATION_STATE).first()
+
+
+@receiver(post_save, sender=UserBookRelation)
+def count_saved_relation(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    old = instance.__dict__.pop('_rated_state', None)
+    new = tuple(getattr(instance, field) for field in RELATION_STATE)
+    added = rating_contribution(*new)
+    if old is None:
+        adjust_ratings(instance.book_id, added)
+        return
+    removed = rating_contribution(*old)
+    if old[0] != instance.book_id:
+        adjust_ratings(old[0], {field: -value for field, value in removed.items()})
+        adjust_ratings(instance.book_id, added)
+    else:
+        adjust_ratings(instance.book_id, {field: added[field] - removed[field] for field in added})
+
+
+@receiver(post_delete, sender=UserBookRelation)
+def count_deleted_relation(sender, instance, **kwargs):
+    removed = rating_contribution(*(getattr(instance, field) for field in RELATION_STATE))
+    adjust_ratings(instance.book_id, {field: -value for field, value in removed.items()})
+
+
+def adjust_review_count(book_id, delta):
+    if book_id is not None:
+        Book.objects.filter(pk=book_id).update(review_count=shifted('review_count', delta))
+
+
+@receiver(pre_save, sender=Review)
+def remember_review_book(sender, instance, raw=False, update_fields=None, **kwargs):
+    instance._counted_book = None
+    if raw or instance._state.adding or update_fields is not None and 'book' not in update_fields:
+        return
+    instance._counted_book = Review.objects.select_for_update().filter(pk=instance.pk) \
+        .values_list('book_id', flat=True).first()
+
+
+@receiver(post_save, sender=Review)
+def count_saved_review(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        adjust_review_count(instance.book_id, 1)
+        return
+    old = instance.__dict__.pop('_counted_book', None)
+    if old is not None and old != instance.book_id:
+        adjust_review_count(old, -1)
+        adjust_review_count(instance.book_id, 1)
+
+
+@receiver(post_delete, sender=Review)
+def count_deleted_review(sender, instance, **kwargs):
+    adjust_review_count(instance.book_id, -1)
+
+
+@receiver(post_save, sender=UserBookRelation)
+@receiver(post_delete, sender=UserBookRelation)
+def queue_similarity_of_relation(sender, instance, raw=False, **kwargs):
+    if not raw:
+        StaleSimilarity.objects.create(book_id=instance.book_id)
+
+
+@receiver(post_save, sender=BookInstance)
+def queue_similarity_of_loan(sender, instance, raw=False, update_fields=None, **kwargs):
+    if raw or instance.borrower_id is None or instance.book_id is None:
+        return
+    if update_fields is None or {'borrower', 'status'} & set(update_fields):
+        StaleSimilarity.objects.create(book_id=instance.book_id)
+
+
+# Every model rendered by a cached read endpoint, see books.cache.
+CACHED_MODELS = (Author, Book, BookInstance, Genre, Language, Review, User, UserBookRelation)
+# Fields no cached endpoint renders: saving only these (a login's last_login) keeps the cache.
+UNRENDERED_FIELDS = {User: {'last_login', 'password'}}
+
+
+def invalidate_responses(sender, update_fields=None, using=None, **kwargs):
+    if update_fields is not None and set(update_fields) <= UNRENDERED_FIELDS.get(sender, set()):
+        return
+    cache.bump_version_on_commit(sender, using)
+
+
+def invalidate_book_responses(sender, action, using=None, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        cache.bump_version_on_commit(Book, using)
+
+
+for model in CACHED_MODELS:
+    for signal in (post_save, post_delete, bulk_changed):
+        signal.connect(invalidate_responses, sender=model, dispatch_uid=f'invalidate_{model._meta.label_lower}')
+for through in (Book.authors.through, Book.genre.through, Book.language.through):
+    m2m_changed.connect(invalidate_book_responses, sender=through)
@@ -0,0 +1,192 @@
+"""
+"Readers also liked": the books most similar to each book, for /books/{id}/similar/.
+
+A book is described by its readers - the users who liked, bookmarked or rated it
+(UserBookRelation) and those it is lent or reserved to (BookInstance.borrower) -
+and by its authors. Both parts are L2-normalized rows of a sparse matrix, scaled so
+that the dot product of two books is the cosine similarity of their readers
+weighted 1 - AUTHOR_WEIGHT plus that of their authors weighted AUTHOR_WEIGHT; a book
+nobody has read yet still gets its authors' other books. GENRE_WEIGHT times the
+cosine similarity of their genres is added to the pairs that already share a
+reader or an author (a genre alone would pair thousands of books with each other).
+The SIMILAR_BOOKS best neighbours of every book are stored as BookSimilarity rows,
+which the endpoint reads off the (book, similar) index.
+
+Each book's row depends on its own readers only, so a new relation or loan changes
+the scores between that book and the others, nothing else: books.signals queues the
+book in StaleSimilarity, and refresh() recomputes the neighbours of the queued books
+and of every book whose list they enter or leave, which stores the same rows as a
+full build() would. Catalogue edits (authors, genres) wait for the next build().
+
+NumPy and SciPy (the ``similarity`` dependency group) are only needed by the process
+running ``manage.py build_similarities``.
+"""
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Max, Min
+from django.db.models.functions import Coalesce
+from scipy import sparse
+
+from .models import Book, BookInstance, BookSimilarity, StaleSimilarity, UserBookRelation
+
+# A reader's interest in a book is the sum of the weights of their signals on it.
+LIKE_WEIGHT = 1.0
+BOOKMARK_WEIGHT = 0.5
+RATING_WEIGHT = 0.2  # per star
+LOAN_WEIGHT = 1.0
+AUTHOR_WEIGHT = 0.2
+GENRE_WEIGHT = 0.05
+# Books whose scores are computed at once: bounds the memory of the sparse products.
+BLOCK_SIZE = 2000
+BATCH_SIZE = 5000
+
+
+def normalized(matrix):
+    """
+    CSR matrix with every non-empty row scaled to unit length.
+    """
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    norms[norms == 0] = 1
+    return sparse.csr_matrix(sparse.diags(1 / norms) @ matrix)
+
+
+class BookVectors:
+    """
+    The vectors of every book, loaded from the database; row i is the book with id book_ids[i].
+    """
+
+    def __init__(self):
+        self.book_ids = np.fromiter(Book.objects.order_by('pk').values_list('pk', flat=True), dtype=np.int64)
+        readers = normalized(self.reader_matrix())
+        authors = normalized(self.incidence(Book.authors.through.objects.values_list('book_id', 'author_id')))
+        self.vectors = sparse.hstack([np.sqrt(1 - AUTHOR_WEIGHT) * readers, np.sqrt(AUTHOR_WEIGHT) * authors],
+                                     format='csr')
+        self.transposed = self.vectors.T.tocsr()
+        self.genres = normalized(self.incidence(Book.genre.through.objects.values_list('book_id', 'genre_id')))
+
+    def matrix(self, book_ids, column_ids, weights):
+        """
+        Books x columns CSR matrix of weights, summing the duplicates.
+        """
+        columns, column_index = np.unique(column_ids, return_inverse=True)
+        rows = np.searchsorted(self.book_ids, book_ids)
+        return sparse.csr_matrix((weights, (rows, column_index)), shape=(len(self.book_ids), len(columns)))
+
+    def incidence(self, pairs):
+        pairs = np.array(list(pairs), dtype=np.int64).reshape(-1, 2)
+        return self.matrix(pairs[:, 0], pairs[:, 1], np.ones(len(pairs)))
+
+    def reader_matrix(self):
+        relations = np.array(list(
+            UserBookRelation.objects.values_list('book_id', 'user_id', 'like', 'in_bookmarks', Coalesce('rate', 0))
+        ), dtype=np.float64).reshape(-1, 5)
+        loans = np.array(list(
+            BookInstance.objects.filter(book__isnull=False, borrower__isnull=False).values_list('book_id', 'borrower_id')
+        ), dtype=np.int64).reshape(-1, 2)
+        weights = relations[:, 2:] @ [LIKE_WEIGHT, BOOKMARK_WEIGHT, RATING_WEIGHT]
+        return self.matrix(
+            np.concatenate([relations[:, 0].astype(np.int64), loans[:, 0]]),
+            np.concatenate([relations[:, 1].astype(np.int64), loans[:, 1]]),
+            np.concatenate([weights, np.full(len(loans), LOAN_WEIGHT)]),
+        )
+
+    def rows(self, book_ids):
+        """
+        Sorted rows of those of book_ids that exist.
+        """
+        book_ids = np.unique(np.fromiter(book_ids, dtype=np.int64))
+        rows = np.searchsorted(self.book_ids, book_ids)
+        found = rows < len(self.book_ids)
+        found[found] = self.book_ids[rows[found]] == book_ids[found]
+        return rows[found]
+
+    def scores(self, rows):
+        """
+        (row, other row, score) arrays of the positive scores of the given rows, block by block.
+        """
+        for start in range(0, len(rows), BLOCK_SIZE):
+            block = rows[start:start + BLOCK_SIZE]
+            products = (self.vectors[block] @ self.transposed).tocoo()
+            source, target, score = block[products.row], products.col, products.data
+            keep = (source != target) & (score > 0)
+            source, target, score = source[keep], target[keep], score[keep]
+            if GENRE_WEIGHT:
+                shared = self.genres[source].multiply(self.genres[target]).sum(axis=1)
+                score = score + GENRE_WEIGHT * np.asarray(shared).ravel()
+            yield source, target, score
+
+    def neighbours(self, rows, k):
+        """
+        (row, neighbour row, score) arrays of the k best neighbours of the given rows, best first.
+        """
+        parts = []
+        for source, target, score in self.scores(rows):
+            order = np.lexsort((target, -score, source))
+            source, target, score = source[order], target[order], score[order]
+            rank = np.arange(len(source)) - np.searchsorted(source, source)
+            keep = rank < k
+            parts.append((source[keep], target[keep], score[keep]))
+        if not parts:
+            return np.empty(0, np.int64), np.empty(0, np.int64), np.empty(0)
+        return tuple(np.concatenate(columns) for columns in zip(*parts))
+
+    def similarities(self, rows, k):
+        source, target, score = self.neighbours(rows, k)
+        book_ids = self.book_ids
+        return (BookSimilarity(book_id=book_id, similar_id=similar_id, score=value)
+                for book_id, similar_id, value in zip(book_ids[source].tolist(), book_ids[target].tolist(),
+                                                      score.tolist()))
+
+
+def stale_until():
+    return StaleSimilarity.objects.aggregate(last=Max('pk'))['last']
+
+
+def build(k=None):
+    """
+    Store the k (default SIMILAR_BOOKS) best neighbours of every book. Returns the number of rows stored.
+    """
+    k = k or settings.SIMILAR_BOOKS
+    last = stale_until()
+    vectors = BookVectors()
+    with transaction.atomic():
+        BookSimilarity.objects.all().delete()
+        rows = len(BookSimilarity.objects.bulk_create(
+            vectors.similarities(np.arange(len(vectors.book_ids)), k), batch_size=BATCH_SIZE))
+        if last is not None:
+            StaleSimilarity.objects.filter(pk__lte=last).delete()
+    return rows
+
+
+def refresh(k=None):
+    """
+    Recompute the neighbours that changed with the readers of the books queued in
+    StaleSimilarity. Returns the number of books whose neighbours were stored again.
+    """
+    k = k or settings.SIMILAR_BOOKS
+    last = stale_until()
+    if last is None:
+        return 0
+    vectors = BookVectors()
+    book_ids = vectors.book_ids
+    stale = vectors.rows(StaleSimilarity.objects.filter(pk__lte=last).values_list('book_id', flat=True))
+    # Scores are symmetric: the new scores of the stale books are those of every other book with them.
+    best = np.zeros(len(book_ids))
+    for source, target, score in vectors.scores(stale):
+        np.maximum.at(best, target, score)
+    candidates = np.flatnonzero(best)
+    lists = BookSimilarity.objects.filter(book_id__in=book_ids[candidates].tolist()).order_by() \
+        .values_list('book_id').annotate(n=Count('pk'), lowest=Min('score'))
+    lists = {book_id: (n, lowest) for book_id, n, lowest in lists}
+    # Books whose list a stale book enters...
+    entered = [row for row, book_id in zip(candidates.tolist(), book_ids[candidates].tolist())
+               if lists.get(book_id, (0, 0))[0] < k or best[row] >= lists[book_id][1]]
+    # ...or may leave or move in.
+    listing = BookSimilarity.objects.filter(similar_id__in=book_ids[stale].tolist()).values_list('book_id', flat=True)
+    rows = np.union1d(stale, np.union1d(np.array(entered, dtype=np.int64), vectors.rows(listing)))
+    with transaction.atomic():
+        BookSimilarity.objects.filter(book_id__in=book_ids[rows].tolist()).delete()
+        BookSimilarity.objects.bulk_create(vectors.similarities(rows, k), batch_size=BATCH_SIZE)
+        StaleSimilarity.objects.filter(pk__lte=last).delete()
+    return len(rows)
@@ -1,3 +1,1514 @@
-from django.test import TestCase
+import datetime
+import json
+import tempfile
+import threading
+import uuid
+from io import BytesIO, StringIO
+from unittest import skipUnless
+from unittest.mock import patch
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.auth.models import Permission, User
+from django.core.management import call_command
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test import TestCase as DjangoTestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import include, path
+from django.utils import timezone
+
+from PIL import Image
+from rest_framework import serializers
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from rest_framework.views import APIView
+
+from library import urls as library_urls
+from . import async_views, cache, images, loans
+from .bot import build_application
+from .exporters import BOOK_COLUMNS
+from .fake_telegram import FakeTelegramServer
+from .fastpath import get_plan
+from .fieldsets import SparseFieldsetMixin
+from .metrics import QueryRecorder, registry
+from .overdue import process_overdue
+from .importers import import_catalogue
+from .admin import EstimatedCountPaginator
+from .models import Author, Book, BookInstance, BookSimilarity, FacetCount, Fine, Genre, Hold, Language, OverdueNotice, \
+    Review, StaleSimilarity, UserBookRelation
+from .pagination import LoanKeysetPagination
+from .renderers import FastJSONRenderer
+from .routers import PIN_COOKIE
+from .search import search_books
+from .serializers import AuthorSerializer, BookInstanceSerializer, BookListSerializer, BookSerializer, \
+    ReviewSerializer
+
+
+class TestCase(DjangoTestCase):
+    """
+    Starts every test with an empty response cache: the writes of a TestCase never commit,
+    so they never retire the responses an earlier test cached (see books.cache).
+    """
+
+    def _pre_setup(self):
+        super()._pre_setup()
+        cache.get_cache().clear()
+
+
+def create_book(n, author=None, genre=None, borrower=None):
+    book = Book.objects.create(title=f'Book {n}', description='-', isbn=f'978-0-00-{n:06d}')
+    book.authors.add(author or Author.objects.create(first_name=f'First {n}', last_name=f'Last {n}'))
+    book.genre.add(genre or Genre.objects.create(name=f'Genre {n}'))
+    for copy in range(2):
+        BookInstance.objects.create(book=book, imprint='-', inventory=f'{n}-{copy}', status='o', borrower=borrower)
+    Review.objects.create(title='Review', review_text='-', author=borrower, book=book)
+    return book
+
+
+class BookQueryCountTests(TestCase):
+    """
+    The book endpoints must run a fixed number of queries whatever the page size.
+    """
+    list_queries = 4
+    expanded_list_queries = 5
+    detail_queries = 5
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='reader', password='secret')
+
+    def test_list_query_count_is_constant(self):
+        create_book(1, borrower=self.user)
+        with self.assertNumQueries(self.list_queries):
+            self.client.get('/api/v1/books/')
+
+        shared_author = Author.objects.create(first_name='Prolific', last_name='Writer')
+        with self.captureOnCommitCallbacks(execute=True):
+            for n in range(2, 10):
+                create_book(n, author=shared_author, borrower=self.user)
+        with self.assertNumQueries(self.list_queries):
+            response = self.client.get('/api/v1/books/')
+        self.assertEqual(len(response.data['results']), 9)
+        with self.assertNumQueries(self.expanded_list_queries):
+            self.client.get('/api/v1/books/', {'fields': 'id,latest_reviews', 'expand': 'authors,bookinstance_set'})
+
+    def test_detail_query_count_is_constant(self):
+        author = Author.objects.create(first_name='Prolific', last_name='Writer')
+        book = create_book(1, author=author, borrower=self.user)
+        for n in range(2, 6):
+            create_book(n, author=author, borrower=self.user)
+        with self.assertNumQueries(self.detail_queries):
+            response = self.client.get(f'/api/v1/books/{book.pk}/')
+        self.assertEqual(response.data['authors'][0]['book_count'], 5)
+
+
+class SparseFieldsetTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='reader', password='secret')
+        self.book = create_book(1, borrower=self.user)
+
+    def test_compact_list_and_full_detail(self):
+        book = self.client.get('/api/v1/books/').data['results'][0]
+        self.assertEqual(list(book), ['id', 'title', 'authors', 'image', 'image_srcset', 'isbn', 'genre',
+                                      'available_copies', 'rating_mean'])
+        self.assertEqual(list(book['authors'][0]), ['id', 'first_name', 'last_name'])
+        detail = self.client.get(f'/api/v1/books/{self.book.pk}/').data
+        self.assertEqual(detail['authors'][0]['book_count'], 1)
+        self.assertEqual(detail['bookinstance_set'][0]['borrower']['username'], 'reader')
+
+    def test_fields_and_expand(self):
+        # The review count is a column of the book.
+        with self.assertNumQueries(2):
+            book = self.client.get('/api/v1/books/', {'fields': 'id,title,review_count'}).data['results'][0]
+        self.assertEqual(book, {'id': self.book.pk, 'title': 'Book 1', 'review_count': 1})
+
+        book = self.client.get('/api/v1/books/', {'fields': 'id', 'expand': 'bookinstance_set'}).data['results'][0]
+        self.assertEqual(book['bookinstance_set'][0]['borrower']['username'], 'reader')
+
+        detail = self.client.get(f'/api/v1/books/{self.book.pk}/', {'fields': 'title,isbn'}).data
+        self.assertEqual(detail, {'title': 'Book 1', 'isbn': '978-0-00-000001'})
+
+        self.client.force_login(self.user)
+        author = self.client.get('/api/v1/authors/', {'fields': 'id,book_count'}).data['results'][0]
+        self.assertEqual(author, {'id': self.book.authors.get().pk, 'book_count': 1})
+
+
+class FastReadPathTests(TestCase):
+    """
+    Reads through books.fastpath must render the same bytes as the serializers.
+    """
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_login(User.objects.create_superuser(username='librarian', password='secret'))
+        self.user = User.objects.create_user(username='reader', password='secret', first_name='Zoë')
+        self.book = create_book(1, borrower=self.user)
+        self.book.image = 'covers/first.png'
+        self.book.save()
+        create_book(2)
+        self.book.bookinstance_set.update(due_back=datetime.date(2030, 1, 31))
+        Review.objects.create(title='Line\u2028separator', review_text='Ünïcode', author=self.user, book=self.book)
+
+    def assertSameResponses(self, *urls):
+        for url in urls:
+            fast = self.client.get(url)
+            with patch.object(SparseFieldsetMixin, 'fast_plan', return_value=None):
+                slow = self.client.get(url)
+            self.assertEqual(fast.status_code, 200, url)
+            self.assertEqual(fast.content, slow.content, url)
+
+    def test_matches_serializers(self):
+        copy = self.book.bookinstance_set.first()
+        self.assertSameResponses(
+            '/api/v1/books/', '/api/v1/books/?fields=id,title,latest_reviews', '/api/v1/books/?pagination=keyset',
+            '/api/v1/books/?expand=authors,bookinstance_set', f'/api/v1/books/{self.book.pk}/',
+            f'/api/v1/books/{self.book.pk}/reviews/',
+            '/api/v1/authors/', f'/api/v1/authors/{self.book.authors.get().pk}/',
+            f'/api/v1/authors/{self.book.authors.get().pk}/books/?expand=bookinstance_set',
+            '/api/v1/reviews/', '/api/v1/bookcopy/', f'/api/v1/bookcopy/{copy.pk}/',
+            '/api/v1/allborrowed/', '/api/v1/allborrowed/?pagination=keyset',
+        )
+
+    def test_falls_back_to_serializer(self):
+        class TitleSerializer(serializers.ModelSerializer):
+            shout = serializers.SerializerMethodField()
+
+            class Meta:
+                model = Book
+                fields = ['id', 'shout']
+
+            def get_shout(self, book):
+                return book.title.upper()
+
+        self.assertIsNone(get_plan(TitleSerializer))
+        for serializer_class in (BookSerializer, BookListSerializer, AuthorSerializer, ReviewSerializer,
+                                 BookInstanceSerializer):
+            self.assertIsNotNone(get_plan(serializer_class))
+
+    def test_plans_are_cached_by_selection(self):
+        plan = get_plan(BookListSerializer, ['title', 'id'], ['authors'])
+        self.assertIs(get_plan(BookListSerializer, ['id', 'title', 'title', 'nope'], ['x', 'authors']), plan)
+        self.assertIsNot(get_plan(BookListSerializer, ['id', 'title', 'authors']), plan)
+        default_fields = BookListSerializer.Meta.default_fields
+        self.assertIs(get_plan(BookListSerializer), get_plan(BookListSerializer, default_fields))
+
+    def test_renderer(self):
+        data = {'text': 'Ünïcode \u2028', 'id': uuid.uuid4(), 'date': datetime.date(2030, 1, 31), 'n': [1.5, None]}
+        for media_type in (None, 'application/json; indent=4'):
+            self.assertEqual(FastJSONRenderer().render(data, media_type), JSONRenderer().render(data, media_type))
+
+
+class BookSearchTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        tolkien = Author.objects.create(first_name='John', last_name='Tolkien')
+        self.hobbit = create_book(1, author=tolkien)
+        self.hobbit.title = 'The Hobbit'
+        self.hobbit.save()
+        self.other = create_book(2)
+
+    def search(self, query):
+        response = self.client.get('/api/v1/books/', {'search': query})
+        return [book['id'] for book in response.data['results']]
+
+    def test_matches_title_author_and_isbn(self):
+        self.assertEqual(self.search('hobbit'), [self.hobbit.pk])
+        self.assertEqual(self.search('tolk'), [self.hobbit.pk])
+        self.assertEqual(self.search(self.other.isbn), [self.other.pk])
+
+    def test_index_follows_author_changes(self):
+        author = self.other.authors.get()
+        author.last_name = 'Pratchett'
+        author.save()
+        self.assertEqual(self.search('pratchett'), [self.other.pk])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.other.authors.clear()
+        self.assertEqual(self.search('pratchett'), [])
+
+    def test_deleted_books_leave_the_index(self):
+        self.hobbit.bookinstance_set.all().delete()
+        self.hobbit.delete()
+        self.assertEqual(self.search('hobbit'), [])
+
+    def test_authors_match_name_prefixes(self):
+        self.client.force_authenticate(User.objects.create_user(username='reader', password='secret'))
+        tolkien = self.hobbit.authors.get()
+
+        def search(query):
+            response = self.client.get('/api/v1/authors/', {'search': query})
+            return [author['id'] for author in response.data['results']]
+
+        self.assertEqual(search('john tolk'), [tolkien.pk])
+        self.assertEqual(search('hobbit'), [])
+        tolkien.middle_name = 'Ronald'
+        tolkien.save()
+        self.assertEqual(search('ronald'), [tolkien.pk])
+        tolkien.delete()
+        self.assertEqual(search('ronald'), [])
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='reader', password='secret')
+        self.client.force_authenticate(self.user)
+
+    def walk(self, url, params):
+        pages, response = [], self.client.get(url, params)
+        while True:
+            pages.append(response.data['results'])
+            if not response.data['next']:
+                return pages, response
+            response = self.client.get(response.data['next'])
+
+    def test_books_walk_forward_and_back_without_gaps(self):
+        for n in range(25):
+            Book.objects.create(title=f'Same title {n % 3}', description='-', isbn=str(n))
+        pages, last = self.walk('/api/v1/books/', {'pagination': 'keyset'})
+        self.assertNotIn('count', last.data)
+        self.assertEqual([len(page) for page in pages], [10, 10, 5])
+        expected = list(Book.objects.order_by('title', 'id').values_list('id', flat=True))
+        self.assertEqual([book['id'] for page in pages for book in page], expected)
+
+        previous = self.client.get(last.data['previous'])
+        self.assertEqual(previous.data['results'], pages[1])
+
+    def test_rejects_malformed_cursors_search_and_ordering(self):
+        pagination = LoanKeysetPagination()
+        for key in ([{'a': 1}, 'x'], ['2026-01-01', ['x']], ['not a date', str(uuid.uuid4())], ['2026-01-01', 'x']):
+            response = self.client.get('/api/v1/mybooks/', {'cursor': pagination.encode_cursor(key, False)})
+            self.assertEqual(response.status_code, 404, key)
+        response = self.client.get('/api/v1/books/', {'pagination': 'keyset', 'search': 'title'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('search', response.data)
+        response = self.client.get('/api/v1/books/', {'pagination': 'keyset', 'ordering': '-rating_mean'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('ordering', response.data)
+
+    def test_loans_with_missing_due_dates(self):
+        book = Book.objects.create(title='Loaned', description='-', isbn='1')
+        today = datetime.date.today()
+        for n in range(7):
+            BookInstance.objects.create(book=book, imprint='-', status='o', borrower=self.user,
+                                        due_back=None if n % 3 == 0 else today + datetime.timedelta(days=n % 2))
+        with patch.object(LoanKeysetPagination, 'page_size', 2):
+            pages, _ = self.walk('/api/v1/mybooks/', {'pagination': 'keyset'})
+        dates = [copy['due_back'] for page in pages for copy in page]
+        self.assertEqual(len(dates), 7)
+        self.assertEqual(dates[-3:], [None] * 3)
+        self.assertEqual(len({copy['id'] for page in pages for copy in page}), 7)
+
+
+class AvailabilityCounterTests(TestCase):
+    def setUp(self):
+        self.book = Book.objects.create(title='Counted', description='-', isbn='1')
+        self.other = Book.objects.create(title='Other', description='-', isbn='2')
+
+    def counters(self, book):
+        return Book.objects.filter(pk=book.pk).values(*Book.AVAILABILITY_FIELDS).get()
+
+    def assertCounters(self, book, total=0, available=0, on_loan=0, reserved=0, maintenance=0):
+        self.assertEqual(self.counters(book), {
+            'total_copies': total, 'available_copies': available, 'on_loan_copies': on_loan,
+            'reserved_copies': reserved, 'maintenance_copies': maintenance,
+        })
+        self.assertFalse(Book.objects.availability_drift().exists())
+
+    def test_single_copy_changes(self):
+        copy = BookInstance.objects.create(book=self.book, imprint='-', status='a')
+        self.assertCounters(self.book, total=1, available=1)
+        copy.status = 'o'
+        copy.save()
+        self.assertCounters(self.book, total=1, on_loan=1)
+        copy.book = self.other
+        copy.save()
+        self.assertCounters(self.book)
+        self.assertCounters(self.other, total=1, on_loan=1)
+        copy.delete()
+        self.assertCounters(self.other)
+
+    def test_bulk_changes(self):
+        BookInstance.objects.bulk_create([BookInstance(book=self.book, imprint='-', status='a') for _ in range(3)])
+        self.assertCounters(self.book, total=3, available=3)
+        BookInstance.objects.filter(status='a')[:1].get().delete()
+        BookInstance.objects.filter(book=self.book).update(status='r')
+        self.assertCounters(self.book, total=2, reserved=2)
+        copies = list(BookInstance.objects.all())
+        for copy in copies:
+            copy.status, copy.book = 'm', self.other
+        BookInstance.objects.bulk_update(copies, ['status', 'book'])
+        self.assertCounters(self.book)
+        self.assertCounters(self.other, total=2, maintenance=2)
+
+    def test_drifted_counters_stay_at_zero(self):
+        copy = BookInstance.objects.create(book=self.book, imprint='-', status='a')
+        Book.objects.filter(pk=self.book.pk).update(available_copies=0)
+        copy.status = 'o'
+        copy.save()
+        self.assertEqual(self.counters(self.book)['available_copies'], 0)
+
+    def test_filter_and_order_by_counters(self):
+        BookInstance.objects.create(book=self.other, imprint='-', status='a')
+        for param in ('available_copies__gt', 'available__gt'):
+            response = APIClient().get('/api/v1/books/', {param: 0})
+            self.assertEqual([book['id'] for book in response.data['results']], [self.other.pk])
+        response = APIClient().get('/api/v1/books/', {'ordering': '-available_copies'})
+        self.assertEqual(response.data['results'][0]['available_copies'], 1)
+
+    def test_rebuild_command(self):
+        BookInstance.objects.create(book=self.book, imprint='-', status='a')
+        Book.objects.update(available_copies=5)
+        with self.assertRaises(CommandError):
+            call_command('rebuild_counters', verify=True, stdout=StringIO())
+        call_command('rebuild_counters', stdout=StringIO())
+        self.assertCounters(self.book, total=1, available=1)
+
+
+class RatingAggregateTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='reader', password='secret')
+        self.client.force_authenticate(self.user)
+        self.book = Book.objects.create(title='Rated', description='-', isbn='1')
+        self.other = Book.objects.create(title='Other', description='-', isbn='2')
+
+    def aggregates(self, book):
+        return Book.objects.filter(pk=book.pk).values(*Book.RATING_FIELDS, 'rating_mean').get()
+
+    def test_upsert_maintains_aggregates(self):
+        response = self.client.put(f'/api/v1/book_relation/{self.book.pk}/', {'rate': 4, 'like': True})
+        self.assertEqual(response.status_code, 201)
+        other_user = User.objects.create_user(username='critic', password='secret')
+        UserBookRelation.objects.create(user=other_user, book=self.book, rate=1, in_bookmarks=True)
+        self.assertEqual(self.aggregates(self.book), {
+            'rating_count': 2, 'rating_sum': 5, 'like_count': 1, 'bookmark_count': 1, 'rating_mean': 2.5,
+        })
+
+        response = self.client.patch(f'/api/v1/book_relation/{self.book.pk}/', {'rate': 5, 'like': False})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(UserBookRelation.objects.filter(user=self.user).count(), 1)
+        self.assertEqual(self.aggregates(self.book), {
+            'rating_count': 2, 'rating_sum': 6, 'like_count': 0, 'bookmark_count': 1, 'rating_mean': 3.0,
+        })
+
+        UserBookRelation.objects.filter(user=other_user).delete()
+        self.assertEqual(self.aggregates(self.book), {
+            'rating_count': 1, 'rating_sum': 5, 'like_count': 0, 'bookmark_count': 0, 'rating_mean': 5.0,
+        })
+        self.assertFalse(Book.objects.ratings_drift().exists())
+
+    def test_top_books(self):
+        UserBookRelation.objects.create(user=self.user, book=self.book, rate=2, like=True)
+        UserBookRelation.objects.create(user=self.user, book=self.other, rate=5)
+        top = self.client.get('/api/v1/books/top/', {'by': 'rating'}).data
+        self.assertEqual([book['id'] for book in top], [self.other.pk, self.book.pk])
+        top = self.client.get('/api/v1/books/top/', {'by': 'likes', 'limit': 1}).data
+        self.assertEqual([book['id'] for book in top], [self.book.pk])
+        self.assertEqual(self.client.get('/api/v1/books/top/', {'by': 'sales'}).status_code, 400)
+
+
+class FacetCountTests(TestCase):
+    def setUp(self):
+        self.books = [Book.objects.create(title=f'Book {n}', description='-', isbn=str(n)) for n in range(3)]
+        self.fantasy, self.poetry = Genre.objects.create(name='Fantasy'), Genre.objects.create(name='Poetry')
+
+    def assertCounts(self, genre, books, available_books):
+        self.assertEqual(FacetCount.objects.filter(facet='genre', value_id=genre.pk)
+                         .values_list('books', 'available_books').get(), (books, available_books))
+        self.assertFalse(FacetCount.objects.drift().exists())
+
+    def test_counts_follow_links_and_copies(self):
+        first, second, third = self.books
+        first.genre.add(self.fantasy, self.poetry)
+        self.fantasy.book_set.add(second, third)
+        self.assertCounts(self.fantasy, 3, 0)
+        copy = BookInstance.objects.create(book=first, imprint='-', status='a')
+        BookInstance.objects.create(book=first, imprint='-', status='a')
+        self.assertCounts(self.fantasy, 3, 1)
+        self.assertCounts(self.poetry, 1, 1)
+        copy.status = 'o'
+        copy.save()
+        BookInstance.objects.filter(book=first, status='a').update(status='m')
+        self.assertCounts(self.fantasy, 3, 0)
+        BookInstance.objects.filter(book=first).update(status='a')
+        self.assertCounts(self.poetry, 1, 1)
+
+        first.genre.remove(self.poetry, Genre.objects.create(name='Unlinked'))
+        self.assertCounts(self.poetry, 0, 0)
+        self.fantasy.book_set.clear()
+        self.assertCounts(self.fantasy, 0, 0)
+        second.genre.set([self.poetry])
+        third.genre.add(self.poetry)
+        third.delete()
+        self.assertCounts(self.poetry, 1, 0)
+        self.poetry.delete()
+        self.assertFalse(FacetCount.objects.filter(facet='genre', value_id=self.poetry.pk).exists())
+
+    def test_facets_endpoint(self):
+        client = APIClient()
+        first, second, third = self.books
+        for book in self.books:
+            book.genre.add(self.fantasy)
+        first.genre.add(self.poetry)
+        third.authors.add(Author.objects.create(first_name='Jane', last_name='Austen'))
+        BookInstance.objects.create(book=first, imprint='-', status='a')
+        # FacetCount, and the names of the genres and authors (there are no languages).
+        with self.assertNumQueries(5):
+            response = client.get('/api/v1/books/facets/')
+        self.assertEqual(response.data['genre'], [
+            {'id': self.fantasy.pk, 'name': 'Fantasy', 'count': 3},
+            {'id': self.poetry.pk, 'name': 'Poetry', 'count': 1},
+        ])
+        self.assertEqual(response.data['author'], [{'id': third.authors.get().pk, 'name': 'Austen, Jane', 'count': 1}])
+        self.assertEqual(response.data['language'], [])
+        # A filter matching every book gives the same counts, aggregated over the links.
+        self.assertEqual(client.get('/api/v1/books/facets/', {'rating_mean__gte': 0}).data, response.data)
+
+        response = client.get('/api/v1/books/facets/', {'available_copies__gt': 0, 'facet_limit': 1})
+        self.assertEqual(response.data['genre'], [{'id': self.fantasy.pk, 'name': 'Fantasy', 'count': 1}])
+        response = client.get('/api/v1/books/facets/', {'title': 'Book 2'})
+        self.assertEqual([(facet['name'], facet['count']) for facet in response.data['genre']], [('Fantasy', 1)])
+        response = client.get('/api/v1/books/facets/', {'search': 'austen'})
+        self.assertEqual([(facet['name'], facet['count']) for facet in response.data['author']], [('Austen, Jane', 1)])
+        # Cut to the limit per facet, largest first and ties by id.
+        response = client.get('/api/v1/books/facets/', {'rating_mean__gte': 0, 'facet_limit': 1})
+        self.assertEqual([(facet['name'], facet['count']) for facet in response.data['genre']], [('Fantasy', 3)])
+        self.assertEqual(client.get('/api/v1/books/facets/', {'facet_limit': 'x'}).status_code, 400)
+
+
+class AuthorBooksTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user(username='reader', password='secret'))
+        self.author = Author.objects.create(first_name='Prolific', last_name='Writer')
+
+    def book_count(self):
+        self.assertFalse(Author.objects.book_count_drift().exists())
+        return Author.objects.filter(pk=self.author.pk).values_list('book_count', flat=True).get()
+
+    def test_book_count_follows_links(self):
+        first, second, third = [create_book(n, author=self.author) for n in range(3)]
+        self.assertEqual(self.book_count(), 3)
+        first.authors.remove(self.author)
+        self.author.book_set.remove(second)
+        self.assertEqual(self.book_count(), 1)
+        self.author.book_set.add(first, second)
+        third.bookinstance_set.all().delete()
+        third.delete()
+        self.assertEqual(self.book_count(), 2)
+        # A stale instance saved whole keeps the counter.
+        self.author.first_name = 'Renamed'
+        self.author.save()
+        self.assertEqual(self.book_count(), 2)
+        self.author.book_set.clear()
+        self.assertEqual(self.book_count(), 0)
+
+        Author.objects.update(book_count=7)
+        with self.assertRaises(CommandError):
+            call_command('rebuild_counters', verify=True, stdout=StringIO())
+        call_command('rebuild_counters', stdout=StringIO())
+        self.assertEqual(self.book_count(), 0)
+
+    def test_books_are_paged_in_constant_queries(self):
+        for n in range(25):
+            create_book(n, author=self.author)
+        author = self.client.get(f'/api/v1/authors/{self.author.pk}/').data
+        self.assertEqual(author['book_count'], 25)
+        self.assertNotIn('book_set', author)
+
+        url, titles = f'/api/v1/authors/{self.author.pk}/books/', []
+        while url:
+            with self.assertNumQueries(4):
+                response = self.client.get(url)
+            self.assertLessEqual(len(response.data['results']), 10)
+            self.assertEqual(list(response.data['results'][0]), ['id', 'title', 'authors', 'image', 'image_srcset',
+                                                                 'isbn', 'genre', 'available_copies', 'rating_mean'])
+            titles += [book['title'] for book in response.data['results']]
+            url = response.data['next']
+        self.assertEqual(titles, sorted(f'Book {n}' for n in range(25)))
+
+        response = self.client.get(f'/api/v1/authors/{self.author.pk}/books/', {'fields': 'id,title'})
+        self.assertEqual(list(response.data['results'][0]), ['id', 'title'])
+        self.assertEqual(self.client.get('/api/v1/authors/0/books/').status_code, 404)
+
+
+class BookReviewsTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.reader = User.objects.create_user(username='reader', password='secret', email='reader@example.com')
+        self.book = Book.objects.create(title='Popular', description='-', isbn='1')
+        self.other = Book.objects.create(title='Other', description='-', isbn='2')
+
+    def review(self, n, book=None):
+        review = Review.objects.create(title=f'Review {n}', review_text='-', author=self.reader, book=book or self.book)
+        Review.objects.filter(pk=review.pk).update(pub_date=timezone.now() + datetime.timedelta(minutes=n))
+        return review
+
+    def review_count(self, book):
+        self.assertFalse(Book.objects.review_count_drift().exists())
+        return Book.objects.filter(pk=book.pk).values_list('review_count', flat=True).get()
+
+    def test_review_count_follows_reviews(self):
+        first, second = self.review(1), self.review(2)
+        self.assertEqual(self.review_count(self.book), 2)
+        first.book = self.other
+        first.save()
+        self.assertEqual((self.review_count(self.book), self.review_count(self.other)), (1, 1))
+        second.delete()
+        Review.objects.bulk_create([Review(title='Bulk', review_text='-', book=self.book) for _ in range(3)])
+        Review.objects.filter(book=self.other).update(book=self.book)
+        self.assertEqual((self.review_count(self.book), self.review_count(self.other)), (4, 0))
+
+        Book.objects.update(review_count=9)
+        with self.assertRaises(CommandError):
+            call_command('rebuild_counters', verify=True, stdout=StringIO())
+        call_command('rebuild_counters', stdout=StringIO())
+        self.assertEqual(self.review_count(self.book), 4)
+
+    @override_settings(LATEST_REVIEWS=2)
+    def test_book_carries_count_and_latest_reviews(self):
+        for n in range(5):
+            self.review(n)
+        self.review(9, book=self.other)
+        book = self.client.get(f'/api/v1/books/{self.book.pk}/').data
+        self.assertEqual(book['review_count'], 5)
+        self.assertEqual([review['title'] for review in book['latest_reviews']], ['Review 4', 'Review 3'])
+        self.assertEqual(book['latest_reviews'][0]['author'], {'id': self.reader.pk, 'username': 'reader'})
+        books = self.client.get('/api/v1/books/', {'fields': 'title,latest_reviews'}).data['results']
+        self.assertEqual({book['title']: len(book['latest_reviews']) for book in books}, {'Popular': 2, 'Other': 1})
+
+    def test_reviews_are_paged_newest_first(self):
+        for n in range(25):
+            self.review(n)
+        url, titles = f'/api/v1/books/{self.book.pk}/reviews/', []
+        while url:
+            with self.assertNumQueries(2):
+                response = self.client.get(url)
+            titles += [review['title'] for review in response.data['results']]
+            url, last = response.data['next'], response
+        self.assertEqual(titles, [f'Review {n}' for n in reversed(range(25))])
+        previous = self.client.get(last.data['previous']).data['results']
+        self.assertEqual([review['title'] for review in previous], [f'Review {n}' for n in reversed(range(5, 15))])
+        self.assertEqual(self.client.get('/api/v1/books/0/reviews/').status_code, 404)
+
+
+class ResponseCacheTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.book = create_book(1)
+
+    def test_repeated_anonymous_reads_are_served_from_cache(self):
+        first = self.client.get('/api/v1/books/')
+        with self.assertNumQueries(0):
+            second = self.client.get('/api/v1/books/')
+        self.assertEqual(first.content, second.content)
+        self.assertEqual(first['ETag'], second['ETag'])
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get('/api/v1/books/', HTTP_IF_NONE_MATCH=first['ETag']).status_code, 304)
+        self.assertNotEqual(self.client.get('/api/v1/books/', {'page': 1}).content, b'')
+
+    def test_absolute_urls_follow_the_host_and_scheme(self):
+        for n in range(2, 12):
+            create_book(n)
+        for secure, host in ((False, 'testserver'), (True, 'testserver'), (False, 'localhost')):
+            self.client.get('/api/v1/books/', secure=secure, HTTP_HOST=host)
+            response = self.client.get('/api/v1/books/', secure=secure, HTTP_HOST=host)
+            next_page = json.loads(response.content)['next']
+            self.assertTrue(next_page.startswith(f'{"https" if secure else "http"}://{host}/'), next_page)
+
+    def test_changes_invalidate_dependent_responses(self):
+        books = self.client.get(f'/api/v1/books/{self.book.pk}/')
+        with self.captureOnCommitCallbacks(execute=True):
+            Review.objects.create(title='Fresh', review_text='-', book=self.book)
+            # Not before the commit, or a reader could cache the uncommitted state under the new version.
+            self.assertEqual(self.client.get(f'/api/v1/books/{self.book.pk}/').content, books.content)
+        updated = self.client.get(f'/api/v1/books/{self.book.pk}/')
+        self.assertEqual(updated.data['review_count'], 2)
+        self.assertEqual(updated.data['latest_reviews'][0]['title'], 'Fresh')
+        self.assertNotEqual(books['ETag'], updated['ETag'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.book.genre.clear()
+        self.assertEqual(self.client.get(f'/api/v1/books/{self.book.pk}/').data['genre'], [])
+        with self.captureOnCommitCallbacks(execute=True):
+            BookInstance.objects.filter(book=self.book).update(status='a')
+        self.assertEqual(self.client.get(f'/api/v1/books/{self.book.pk}/').data['available_copies'], 2)
+
+    def test_imports_invalidate_named_values(self):
+        before = cache.current_versions([Genre, Language])
+        rows = 'title,isbn,authors,genres,languages\nDune,111,"Herbert, Frank",Science Fiction,English\n'
+        with self.captureOnCommitCallbacks(execute=True):
+            import_catalogue(BytesIO(rows.encode()), 'csv')
+        after = cache.current_versions([Genre, Language])
+        self.assertTrue(all(old != new for old, new in zip(before, after)))
+
+    def test_logins_keep_the_cache(self):
+        self.client.get('/api/v1/books/')
+        user = User.objects.create_user(username='reader', password='secret')
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            self.assertTrue(self.client.login(username='reader', password='secret'))
+        self.assertEqual(callbacks, [])
+        self.client.logout()
+        with self.assertNumQueries(0):
+            self.client.get('/api/v1/books/')
+        user.delete()
+
+    def test_stats(self):
+        admin = User.objects.create_superuser(username='admin', password='secret')
+        self.client.force_authenticate(admin)
+        before = self.client.get('/api/v1/cache-stats/').data
+        self.client.force_authenticate(None)
+        self.client.get('/api/v1/books/')
+        self.client.get('/api/v1/books/')
+        self.client.force_authenticate(admin)
+        after = self.client.get('/api/v1/cache-stats/').data
+        self.assertEqual(after['misses'] - before['misses'], 1)
+        self.assertEqual(after['hits'] - before['hits'], 1)
+
+
+def marc_record(fields):
+    """
+    Encode [(tag, subfields or control text)] as one ISO 2709 record.
+    """
+    directory, data = b'', b''
+    for tag, value in fields:
+        if isinstance(value, str):
+            field = value.encode() + b'\x1e'
+        else:
+            field = b'  ' + b''.join(b'\x1f' + code.encode() + text.encode() for code, text in value) + b'\x1e'
+        directory += f'{tag}{len(field):04d}{len(data):05d}'.encode()
+        data += field
+    base_address = 24 + len(directory) + 1
+    length = base_address + len(data) + 1
+    leader = f'{length:05d}nam a22{base_address:05d} a 4500'.encode()
+    return leader + directory + b'\x1e' + data + b'\x1d'
+
+
+class CatalogueImportTests(TestCase):
+    csv_rows = (
+        'title,isbn,authors,genres,languages,pages,inventory,imprint,status\n'
+        'Dune,111,"Herbert, Frank",Science Fiction,English,412,INV-1,Chilton,a\n'
+        'Dune,111,"Herbert, Frank",Science Fiction,English,412,INV-2,Chilton,o\n'
+        'Emma,222,"Austen, Jane; Doe, John Q",Novel; Classic,English; French,x,INV-3,-,a\n'
+        ',333,,,,,,,\n'
+    )
+
+    def import_csv(self, text):
+        return import_catalogue(BytesIO(text.encode()), 'csv', chunk_size=2)
+
+    def test_csv_import_and_reimport(self):
+        report = self.import_csv(self.csv_rows)
+        self.assertEqual(report.created_books, 1)
+        self.assertEqual(report.created_copies, 2)
+        self.assertEqual([error['line'] for error in report.errors], [4, 5])
+
+        dune = Book.objects.get(isbn='111')
+        self.assertEqual([str(author) for author in dune.authors.all()], ['Herbert, Frank None'])
+        self.assertEqual(FacetCount.objects.get(facet='genre').available_books, 1)
+        self.assertFalse(FacetCount.objects.drift().exists())
+        self.assertFalse(Author.objects.book_count_drift().exists())
+        self.assertEqual((dune.total_copies, dune.available_copies, dune.on_loan_copies), (2, 1, 1))
+        self.assertEqual(search_books(Book.objects.all(), 'herbert').get(), dune)
+
+        report = self.import_csv(self.csv_rows.replace('412', '413').replace('INV-2,Chilton,o', 'INV-2,Chilton,a'))
+        self.assertEqual((report.created_books, report.updated_books), (0, 1))
+        self.assertEqual((report.created_copies, report.updated_copies), (0, 1))
+        self.assertEqual(Author.objects.count(), 1)
+        dune.refresh_from_db()
+        self.assertEqual((dune.pages, dune.available_copies), (413, 2))
+
+    def test_jsonl_import(self):
+        lines = [
+            {'title': 'Emma', 'isbn': '222', 'authors': [{'first_name': 'Jane', 'last_name': 'Austen'}],
+             'genres': ['Novel', 'Classic'], 'languages': ['English'], 'inventory': 'E-1', 'status': 'a'},
+            'not json',
+        ]
+        data = '\n'.join(json.dumps(line) if isinstance(line, dict) else line for line in lines)
+        report = import_catalogue(BytesIO(data.encode()), 'jsonl')
+        self.assertEqual((report.created_books, report.error_count), (1, 1))
+        emma = Book.objects.get(isbn='222')
+        self.assertEqual(sorted(emma.genre.values_list('name', flat=True)), ['Classic', 'Novel'])
+
+    def test_rows_the_models_would_reject_are_reported(self):
+        valid = {'title': 'Ok', 'isbn': 333, 'authors': ['Doe, Jane'], 'pages': 12}
+        lines = [valid] + [{**valid, 'isbn': str(n), **change} for n, change in enumerate([
+            {'title': 'T' * 256},
+            {'title': {'text': 'T'}},
+            {'authors': ['Doe, ' + 'J' * 101]},
+            {'authors': [{'last_name': ['Doe']}]},
+            {'genres': ['G' * 201]},
+            {'pages': 'x'},
+            {'pages': -1},
+            {'imprint': 'I' * 201},
+            {'status': 'x'},
+        ])]
+        report = import_catalogue(BytesIO('\n'.join(map(json.dumps, lines)).encode()), 'jsonl')
+        self.assertEqual(report.created_books, 1)
+        self.assertEqual([error['line'] for error in report.errors], list(range(2, 11)))
+        self.assertEqual(Book.objects.get().isbn, '333')
+
+    def test_marc_import(self):
+        record = marc_record([
+            ('001', 'ctrl-1'),
+            ('020', [('a', '9780141439518 (pbk.)')]),
+            ('100', [('a', 'Austen, Jane,')]),
+            ('245', [('a', 'Pride and prejudice /'), ('c', 'Jane Austen.')]),
+            ('264', [('a', 'London :'), ('b', 'Penguin,'), ('c', '2003.')]),
+            ('300', [('a', '480 p. ;')]),
+            ('650', [('a', 'Courtship.')]),
+            ('041', [('a', 'eng')]),
+            ('852', [('p', 'BC-1')]),
+        ])
+        report = import_catalogue(BytesIO(record + b'00042garbage\x1d' + record), 'marc')
+        self.assertEqual((report.created_books, report.error_count), (1, 1))
+        book = Book.objects.get(isbn='9780141439518')
+        self.assertEqual((book.title, book.pages), ('Pride and prejudice', 480))
+        self.assertEqual(book.authors.get().last_name, 'Austen')
+        self.assertEqual(book.bookinstance_set.get().inventory, 'BC-1')
+
+    def test_api_requires_admin(self):
+        client = APIClient()
+        upload = SimpleUploadedFile('books.csv', self.csv_rows.encode())
+        self.assertEqual(client.post('/api/v1/import/', {'file': upload}).status_code, 403)
+        client.force_authenticate(User.objects.create_superuser(username='admin', password='secret'))
+        upload.seek(0)
+        response = client.post('/api/v1/import/', {'file': upload, 'format': 'csv'})
+        self.assertEqual(response.data['created_books'], 1)
+        self.assertEqual(response.data['error_count'], 2)
+
+
+class CatalogueExportTests(TestCase):
+    def setUp(self):
+        import_catalogue(BytesIO(CatalogueImportTests.csv_rows.encode()), 'csv')
+        self.librarian = User.objects.create_user(username='librarian', password='secret')
+        self.librarian.user_permissions.add(Permission.objects.get(codename='can_mark_returned'))
+        self.client = APIClient()
+        self.client.force_authenticate(self.librarian)
+
+    def export(self, dataset, output):
+        response = self.client.get(f'/api/v1/export/{dataset}/', {'output': output}, HTTP_ACCEPT='text/csv')
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content).decode()
+
+    def test_formats(self):
+        lines = self.export('books', 'csv').splitlines()
+        self.assertEqual(lines[0], ','.join(BOOK_COLUMNS))
+        self.assertIn('Dune,111,"Herbert, Frank",Science Fiction,English,412', lines[1])
+
+        row = json.loads(self.export('books', 'jsonl').splitlines()[0])
+        self.assertEqual((row['isbn'], row['total_copies'], row['on_loan_copies']), ('111', 2, 1))
+
+        columns = json.loads(self.export('copies', 'columnar'))['columns']
+        self.assertEqual(sorted(zip(columns['inventory'], columns['status'])), [('INV-1', 'a'), ('INV-2', 'o')])
+
+    def test_export_reimports_unchanged(self):
+        report = import_catalogue(BytesIO(self.export('books', 'csv').encode()), 'csv')
+        self.assertEqual((report.created_books, report.updated_books, report.error_count), (0, 0, 0))
+
+    def test_requires_librarian(self):
+        self.client.force_authenticate(User.objects.create_user(username='reader', password='secret'))
+        self.assertEqual(self.client.get('/api/v1/export/books/').status_code, 403)
+        self.client.force_authenticate(self.librarian)
+        self.assertEqual(self.client.get('/api/v1/export/books/', {'output': 'xml'}).status_code, 400)
+
+    def test_command(self):
+        out = StringIO()
+        call_command('export_catalogue', 'copies', '--output', 'jsonl', stdout=out)
+        self.assertEqual(len(out.getvalue().splitlines()), 2)
+
+
+class TelegramBotTests(TestCase):
+    def setUp(self):
+        author, genre = Author.objects.create(first_name='Prolific', last_name='Writer'), Genre.objects.create(name='G')
+        for n in range(12):
+            create_book(n, author=author, genre=genre)
+
+    @override_settings(TELEGRAM_BOT_TOKEN='')
+    def test_command_requires_a_token(self):
+        with self.assertRaisesMessage(CommandError, 'TELEGRAM_BOT_TOKEN'):
+            call_command('bot')
+
+    async def test_paged_lists_and_search(self):
+        async with FakeTelegramServer() as server:
+            async with server.polling(build_application(token=server.token, base_url=server.base_url)):
+                server.message(1, '/books')
+                server.inline_query(2, 'book')
+                server.message(3, '/search nothing-like-this')
+                await server.wait_for_calls(3)
+                server.callback_query(1, 1, 'books:10')
+                calls = await server.wait_for_calls(5)
+
+        self.assertTrue(all(latency is not None for _, _, latency in calls))
+        first_page, not_found = sorted(server.calls_to('sendMessage'), key=lambda params: params['chat_id'])
+        self.assertEqual(len(first_page['text'].splitlines()), 10)
+        self.assertEqual(first_page['reply_markup']['inline_keyboard'][0][0]['callback_data'], 'books:10')
+        self.assertEqual(not_found['text'], 'Nothing found.')
+
+        second_page = server.calls_to('editMessageText')[0]
+        self.assertEqual(second_page['text'].splitlines(), [
+            '11. Book 8 (ISBN 978-0-00-000008) - 0 available', '12. Book 9 (ISBN 978-0-00-000009) - 0 available',
+        ])
+
+        answer = server.calls_to('answerInlineQuery')[0]
+        self.assertEqual(len(answer['results']), 12)
+        self.assertEqual(answer['next_offset'], '')
+
+
+@override_settings(REQUEST_METRICS_SAMPLE_RATE=1, REQUEST_METRICS_TOKEN='scrape')
+class RequestMetricsTests(TestCase):
+    def setUp(self):
+        registry.clear()
+        for n in range(3):
+            create_book(n)
+
+    def test_sampled_request_is_logged_and_exported(self):
+        with self.assertLogs('books.metrics', 'INFO') as logs:
+            self.client.get('/api/v1/books/')
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual((record['view'], record['status'], record['db_queries']), ('book-list', 200, 4))
+        self.assertGreater(record['serializer_ms'], 0)
+        self.assertNotIn('repeated_queries', record)
+
+        with self.assertLogs('books.metrics', 'INFO'):
+            self.assertEqual(self.client.get('/metrics').status_code, 403)
+            metrics = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer scrape').content.decode()
+        self.assertIn('library_http_requests_total{method="GET",status="200",view="book-list"} 1', metrics)
+        self.assertIn('library_db_queries_total{view="book-list"} 4', metrics)
+        self.assertIn('library_http_request_duration_seconds_count{view="book-list"} 1', metrics)
+
+    def test_repeated_query_shapes(self):
+        recorder = QueryRecorder()
+        with connection.execute_wrapper(recorder):
+            for book in Book.objects.all():
+                list(book.authors.all())
+        self.assertEqual(list(recorder.repeated_shapes(3).values()), [3])
+        self.assertEqual(recorder.repeated_shapes(4), {})
+
+
+class LoanTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.librarian = User.objects.create_user(username='librarian', password='secret')
+        self.librarian.user_permissions.add(Permission.objects.get(codename='can_mark_returned'))
+        self.reader = User.objects.create_user(username='reader', password='secret')
+        self.book = create_book(1)
+        self.book.bookinstance_set.update(status='a', borrower=None)
+
+    def post(self, url, user, data=None):
+        self.client.force_login(user)
+        return self.client.post(url, data or {})
+
+    def test_checkout_return_and_renew(self):
+        checkout = f'/api/v1/books/{self.book.pk}/checkout/'
+        self.assertEqual(self.post(checkout, self.reader, {'borrower': self.reader.pk}).status_code, 403)
+        copies = [self.post(checkout, self.librarian, {'borrower': self.reader.pk}).data for _ in range(2)]
+        self.assertEqual({copy['status'] for copy in copies}, {'o'})
+        self.assertEqual(copies[0]['due_back'], str(datetime.date.today() + datetime.timedelta(days=21)))
+        self.assertEqual(self.post(checkout, self.librarian, {'borrower': self.reader.pk}).status_code, 409)
+        self.book.refresh_from_db()
+        self.assertEqual((self.book.on_loan_copies, self.book.available_copies), (2, 0))
+
+        copy_id = copies[0]['id']
+        self.assertEqual(self.post(f'/api/v1/bookcopy/{copy_id}/renew/', self.reader).status_code, 200)
+        self.assertEqual(self.post(f'/api/v1/bookcopy/{copy_id}/renew/', self.librarian).status_code, 200)
+        self.assertEqual(self.post(f'/api/v1/bookcopy/{copy_id}/return/', self.reader).status_code, 403)
+        returned = self.post(f'/api/v1/bookcopy/{copy_id}/return/', self.librarian).data
+        self.assertEqual((returned['status'], returned['borrower'], returned['due_back']), ('a', None, None))
+        self.assertEqual(self.post(f'/api/v1/bookcopy/{copy_id}/return/', self.librarian).status_code, 409)
+        self.assertEqual(self.post(f'/api/v1/bookcopy/{copy_id}/renew/', self.reader).status_code, 409)
+
+    def test_loan_fields_are_read_only(self):
+        copy = self.book.bookinstance_set.first()
+        self.client.force_login(self.librarian)
+        self.client.patch(f'/api/v1/bookcopy/{copy.pk}/', {'status': 'o', 'imprint': 'Second'}, format='json')
+        copy.refresh_from_db()
+        self.assertEqual((copy.status, copy.imprint), ('a', 'Second'))
+
+
+class HoldQueueTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.book = create_book(1)
+        self.book.bookinstance_set.update(status='a', borrower=None)
+        self.copies = list(self.book.bookinstance_set.order_by('pk'))
+        self.patrons = [User.objects.create_user(username=f'patron{n}') for n in range(4)]
+
+    def hold(self, patron):
+        self.client.force_login(patron)
+        response = self.client.post(f'/api/v1/books/{self.book.pk}/reserve/')
+        return Hold.objects.get(pk=response.data['id']) if response.status_code == 201 else response
+
+    def copy_of(self, hold):
+        hold.refresh_from_db()
+        return hold.copy and BookInstance.objects.get(pk=hold.copy_id)
+
+    def test_queue_is_served_in_order(self):
+        first, second = self.hold(self.patrons[0]), self.hold(self.patrons[1])
+        self.assertEqual((first.status, second.status), ('r', 'r'))
+        self.assertEqual(self.copy_of(first).borrower, self.patrons[0])
+        self.assertEqual(self.hold(self.patrons[0]).status_code, 409)
+        third, fourth = self.hold(self.patrons[2]), self.hold(self.patrons[3])
+        self.assertEqual((third.status, fourth.status), ('w', 'w'))
+
+        copy = loans.checkout(self.book, self.patrons[0])
+        self.assertEqual(copy.pk, first.copy_id)
+        first.refresh_from_db()
+        self.assertEqual(first.status, 'f')
+        with self.assertRaises(loans.LoanError):
+            loans.renew(copy.pk)
+
+        loans.return_copy(copy.pk)
+        self.assertEqual(self.copy_of(third).pk, copy.pk)
+        self.assertEqual((third.status, BookInstance.objects.get(pk=copy.pk).status), ('r', 'r'))
+
+        self.client.force_login(self.patrons[2])
+        self.assertEqual(self.client.delete(f'/api/v1/holds/{third.pk}/').status_code, 204)
+        self.assertEqual(self.copy_of(fourth).pk, copy.pk)
+        self.assertEqual(self.client.get('/api/v1/holds/').data['count'], 1)
+
+    def test_checkout_respects_the_queue(self):
+        ready = self.hold(self.patrons[0])
+        # Queued while a copy is still available, as a hold placed concurrently with a return can be.
+        waiting = Hold.objects.create(book=self.book, patron=self.patrons[1])
+        with self.assertRaisesMessage(loans.LoanError, 'Other patrons are waiting'):
+            loans.checkout(self.book, self.patrons[2])
+
+        copy = loans.checkout(self.book, self.patrons[0])
+        self.assertEqual(copy.pk, ready.copy_id)
+        self.assertEqual(loans.checkout(self.book, self.patrons[1]).status, 'o')
+        statuses = Hold.objects.filter(pk__in=[ready.pk, waiting.pk]).values_list('status', flat=True)
+        self.assertEqual(list(statuses), ['f', 'f'])
+        self.assertFalse(BookInstance.objects.filter(book=self.book).exclude(status='o').exists())
+
+    def test_expired_holds_are_reaped_in_batches(self):
+        holds = [self.hold(patron) for patron in self.patrons]
+        Hold.objects.filter(status='r').update(expires_at=timezone.now() - datetime.timedelta(minutes=1))
+        out = StringIO()
+        call_command('reap_holds', batch_size=1, stdout=out)
+        self.assertEqual(out.getvalue().strip(), 'Expired 2 holds')
+        statuses = [Hold.objects.get(pk=hold.pk).status for hold in holds]
+        self.assertEqual(statuses, ['x', 'x', 'r', 'r'])
+        self.assertEqual({self.copy_of(hold).borrower for hold in holds[2:]}, set(self.patrons[2:]))
+
+    def test_allocation_cost_does_not_grow_with_the_queue(self):
+        loans.checkout(self.book, self.patrons[0])
+        copy = loans.checkout(self.book, self.patrons[1])
+        queries = []
+        for queue_length in (1, 50):
+            patrons = [User.objects.create_user(username=f'q{n}-{queue_length}') for n in range(queue_length)]
+            Hold.objects.bulk_create(Hold(book=self.book, patron=patron) for patron in patrons)
+            with CaptureQueriesContext(connection) as context:
+                loans.return_copy(copy.pk)
+            queries.append(len(context))
+            copy = loans.checkout(self.book, Hold.objects.get(copy=copy, status='r').patron)
+        self.assertEqual(queries[0], queries[1])
+
+
+class OverdueTests(TestCase):
+    def setUp(self):
+        self.reader = User.objects.create_user(username='reader')
+        self.today = datetime.date.today()
+        copies = [*create_book(1, borrower=self.reader).bookinstance_set.order_by('inventory'),
+                  *create_book(2, borrower=self.reader).bookinstance_set.order_by('inventory')]
+        for copy, status, days in zip(copies, 'ooor', (-3, -10, 1, -5)):
+            BookInstance.objects.filter(pk=copy.pk).update(status=status, due_back=self.today + datetime.timedelta(days))
+        self.copies = [BookInstance.objects.get(pk=copy.pk) for copy in copies]
+
+    def test_is_overdue_is_annotated_and_filterable(self):
+        annotated = {copy.pk: copy.is_overdue for copy in BookInstance.objects.with_overdue()}
+        self.assertEqual(annotated, {copy.pk: copy.is_overdue for copy in self.copies})
+        self.assertEqual([copy.is_overdue for copy in self.copies], [True, True, False, False])
+
+        self.client.force_login(self.reader)
+        for value, copies in (('true', self.copies[:2]), ('false', self.copies[2:])):
+            response = self.client.get(f'/api/v1/bookcopy/?overdue={value}')
+            self.assertEqual({copy['id'] for copy in response.data['results']}, {str(copy.pk) for copy in copies})
+        response = self.client.get('/api/v1/mybooks/?overdue=true&pagination=keyset')
+        self.assertEqual([copy['id'] for copy in response.data['results']], [str(self.copies[1].pk), str(self.copies[0].pk)])
+
+    def assess(self, today=None, **options):
+        out = StringIO()
+        call_command('process_overdue', date=today and today.isoformat(), chunk_size=1, stdout=out, **options)
+        return out.getvalue().strip()
+
+    def test_processing_is_resumable_and_idempotent(self):
+        self.assertEqual(self.assess(), 'Processed 2 overdue loans')
+        self.assertEqual(self.assess(), 'Processed 0 overdue loans')
+        fines = {fine.copy_id: (fine.days_overdue, fine.amount) for fine in Fine.objects.all()}
+        self.assertEqual(fines, {self.copies[0].pk: (3, 30), self.copies[1].pk: (10, 100)})
+        notices = OverdueNotice.objects.values_list('copy', 'days_overdue')
+        self.assertEqual(set(notices), {(self.copies[0].pk, 1), (self.copies[1].pk, 7)})
+
+        # A run of the next day interrupted after its first chunk resumes with the second.
+        tomorrow = self.today + datetime.timedelta(days=1)
+        run = process_overdue(tomorrow, chunk_size=1)
+        self.assertEqual(next(run), 1)
+        run.close()
+        self.assertEqual(Fine.objects.get(copy=self.copies[1]).days_overdue, 11)
+        self.assertEqual(Fine.objects.get(copy=self.copies[0]).days_overdue, 3)
+        self.assertEqual(self.assess(tomorrow), 'Processed 1 overdue loans')
+        self.assertEqual(Fine.objects.get(copy=self.copies[0]).days_overdue, 4)
+
+        self.assertEqual(self.assess(tomorrow, restart=True), 'Processed 2 overdue loans')
+        self.assertEqual((Fine.objects.count(), OverdueNotice.objects.count()), (2, 2))
+
+
+class AdminTests(TestCase):
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser(username='admin', password='secret'))
+
+    def test_book_changelist_query_count_is_constant(self):
+        create_book(1)
+        with CaptureQueriesContext(connection) as one_book:
+            self.client.get('/admin/books/book/')
+        language = Language.objects.create(name='English')
+        for n in range(2, 8):
+            create_book(n).language.add(language)
+        with self.assertNumQueries(len(one_book)):
+            response = self.client.get('/admin/books/book/')
+        self.assertContains(response, 'Last 7, First 7')
+        self.assertContains(response, 'English')
+
+    def test_copies_inline_is_paginated(self):
+        book = create_book(1)
+        book.language.add(Language.objects.create(name='English'))
+        for copy in range(2, 27):
+            BookInstance.objects.create(book=book, imprint='-', inventory=f'1-{copy}', status='a')
+        url = f'/admin/books/book/{book.pk}/change/'
+        response = self.client.get(url)
+        self.assertEqual(len(response.context['inline_admin_formsets'][0].formset.forms), 20)
+        # The authors are picked by autocomplete: the form renders the chosen ones only.
+        Author.objects.create(first_name='Unrelated', last_name='Writer')
+        response = self.client.get(url, {'bookinstance_set-page': 2})
+        self.assertNotContains(response, 'Unrelated')
+        self.assertContains(response, '27 book instances')
+
+        # The change form posts back to the page it shows.
+        formset = response.context['inline_admin_formsets'][0].formset
+        self.assertEqual(len(formset.forms), 7)
+        data = {}
+        for form in [response.context['adminform'].form, formset.management_form, *formset.forms]:
+            for field in form:
+                if field.value() not in (None, False) and field.name != 'image':
+                    data[field.html_name] = field.value()
+        data[formset.forms[0]['imprint'].html_name] = 'Second printing'
+        response = self.client.post(f'{url}?bookinstance_set-page=2', data)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(BookInstance.objects.get(pk=formset.forms[0].instance.pk).imprint, 'Second printing')
+        self.assertEqual(book.bookinstance_set.count(), 27)
+
+    @skipUnless(connection.vendor == 'postgresql', 'estimates from the PostgreSQL statistics')
+    @patch.object(EstimatedCountPaginator, 'estimate_above', 0)
+    def test_estimated_count(self):
+        for n in range(3):
+            Book.objects.create(title=f'Book {n}', description='-', isbn=f'978-0-00-{n:06d}')
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE books_book')
+        Book.objects.filter(title='Book 0').delete()
+        self.assertEqual(EstimatedCountPaginator(Book.objects.all(), 10).count, 3)
+        self.assertEqual(EstimatedCountPaginator(Book.objects.filter(title__startswith='Book'), 10).count, 2)
+
+
+class SimilarBooksTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.author = Author.objects.create(first_name='Prolific', last_name='Writer')
+        self.books = [create_book(n, author=self.author if n < 2 else None) for n in range(5)]
+        self.readers = [User.objects.create_user(username=f'reader{n}') for n in range(3)]
+
+    def relate(self, reader, book, **kwargs):
+        UserBookRelation.objects.create(user=reader, book=book, rate=kwargs.pop('rate', 5), **kwargs)
+
+    def stored(self):
+        return list(BookSimilarity.objects.values_list('book_id', 'similar_id', 'score'))
+
+    def test_similar_books_best_first(self):
+        book, first, second = self.books[:3]
+        BookSimilarity.objects.create(book=book, similar=second, score=0.2)
+        BookSimilarity.objects.create(book=book, similar=first, score=0.7)
+        BookSimilarity.objects.create(book=first, similar=self.books[3], score=0.9)
+        with self.assertNumQueries(4):
+            response = self.client.get(f'/api/v1/books/{book.pk}/similar/')
+        self.assertEqual([item['id'] for item in response.data], [first.pk, second.pk])
+        self.assertEqual(self.client.get('/api/v1/books/0/similar/').status_code, 404)
+
+    def test_reader_writes_queue_their_book(self):
+        self.relate(self.readers[0], self.books[0])
+        BookInstance.objects.create(book=self.books[1], imprint='-', status='a')
+        loans.checkout(self.books[1], self.readers[0])
+        self.assertEqual(sorted(StaleSimilarity.objects.values_list('book_id', flat=True)),
+                         [self.books[0].pk, self.books[1].pk])
+
+    def test_build_and_refresh(self):
+        from . import similarity
+
+        for reader in self.readers[:2]:
+            self.relate(reader, self.books[2], like=True)
+            self.relate(reader, self.books[3])
+        self.relate(self.readers[2], self.books[4], rate=1)
+        call_command('build_similarities', stdout=StringIO())
+        neighbours = BookSimilarity.objects.filter(book=self.books[2]).values_list('similar_id', flat=True)
+        self.assertEqual(list(neighbours), [self.books[3].pk])
+        # Books nobody read are paired by their authors.
+        neighbours = BookSimilarity.objects.filter(book=self.books[0]).values_list('similar_id', flat=True)
+        self.assertEqual(list(neighbours), [self.books[1].pk])
+        self.assertFalse(StaleSimilarity.objects.exists())
+
+        self.relate(self.readers[2], self.books[2])
+        UserBookRelation.objects.filter(user=self.readers[1], book=self.books[3]).delete()
+        out = StringIO()
+        call_command('build_similarities', incremental=True, stdout=out)
+        self.assertEqual(out.getvalue(), 'Refreshed the similar books of 3 books\n')
+        self.assertFalse(StaleSimilarity.objects.exists())
+        refreshed = self.stored()
+        similarity.build()
+        self.assertCountEqual(refreshed, self.stored())
+        self.assertIn(self.books[4].pk, BookSimilarity.objects.filter(book=self.books[2])
+                      .values_list('similar_id', flat=True))
+
+
+class IndexAuditTests(TestCase):
+    def test_explain_querysets_reports_sequential_scans(self):
+        create_book(1)
+        User.objects.create_user(username='reader')
+        out = StringIO()
+        call_command('explain_querysets', stdout=out)
+        lines = dict(line.split(': ', 1) for line in out.getvalue().splitlines())
+        self.assertEqual(lines['genre-list'], 'sequential scan of books_genre')
+        self.assertTrue({'book-list', 'book-retrieve', 'my-borrowed-list', 'hold-list'} <= lines.keys())
+        with self.assertRaises(CommandError):
+            call_command('explain_querysets', fail_on_seq_scan=True, stdout=StringIO())
+
+
+@skipUnless('replica' in settings.DATABASES, 'needs the replica database of library.test_settings')
+@override_settings(REPLICA_DATABASES=['replica'])
+class ReplicaRoutingTests(TestCase):
+    """
+    Nothing replicates to the replica database, so reads served from it miss every write.
+    """
+    databases = '__all__'
+
+    def setUp(self):
+        self.book = create_book(1)
+        self.reader = User.objects.create_user(username='reader')
+        self.reader.save(using='replica')
+        self.client.force_login(self.reader)
+
+    def review_count(self):
+        return self.client.get('/api/v1/reviews/').data['count']
+
+    def test_clients_read_their_own_writes(self):
+        self.assertEqual(self.review_count(), 0)
+        response = self.client.post('/api/v1/reviews/', {'title': 'Mine', 'review_text': '-', 'book': self.book.pk})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.cookies[PIN_COOKIE]['max-age'], settings.REPLICA_PIN_SECONDS)
+        self.assertEqual(self.review_count(), 2)
+        # Once the pin expires the client is back on the replica.
+        del self.client.cookies[PIN_COOKIE]
+        self.assertEqual(self.review_count(), 0)
+
+    @override_settings(REPLICA_DATABASES=['replica', 'default'])
+    def test_a_request_reads_from_one_replica(self):
+        # One of the two "replicas" has the review and the other doesn't: a page and its count
+        # read from different ones would disagree.
+        for _ in range(20):
+            data = self.client.get('/api/v1/reviews/').data
+            self.assertEqual(data['count'], len(data['results']))
+
+    def test_cached_responses_are_read_from_the_primary(self):
+        self.client.logout()
+        response = self.client.get('/api/v1/books/')
+        self.assertEqual(json.loads(response.content)['count'], 1)
+
+
+# ROOT_URLCONF of AsyncReadViewTests: the API with the async read views in front of the router.
+urlpatterns = [path('api/v1/', include(async_views.urlpatterns(library_urls.router))), *library_urls.urlpatterns]
+
+
+@override_settings(ROOT_URLCONF=__name__)
+class AsyncReadViewTests(TestCase):
+    """
+    The async read views must render the same bytes as the viewsets and leave them whatever else comes.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_superuser(username='librarian', password='secret')
+        self.books = [create_book(n, borrower=self.user) for n in range(12)]
+        self.client.force_login(self.user)
+        self.async_client.force_login(self.user)
+
+    def get(self, url):
+        """
+        The async response to url and whether the viewset had to answer it.
+        """
+        with patch.object(SparseFieldsetMixin, 'list', autospec=True, side_effect=SparseFieldsetMixin.list) as list_, \
+                patch.object(SparseFieldsetMixin, 'retrieve', autospec=True,
+                             side_effect=SparseFieldsetMixin.retrieve) as retrieve:
+            response = self.request('get', url)
+        return response, list_.called or retrieve.called
+
+    def request(self, method, *args, **kwargs):
+        async def send():
+            return await getattr(self.async_client, method)(*args, **kwargs)
+        return async_to_sync(send)()
+
+    def assertSameResponses(self, *urls, answered=True):
+        for url in urls:
+            response, fell_back = self.get(url)
+            with override_settings(ROOT_URLCONF='library.urls'):
+                expected = self.client.get(url)
+            self.assertEqual(fell_back, not answered, url)
+            self.assertEqual(response.status_code, expected.status_code, url)
+            self.assertEqual(response.content, expected.content, url)
+
+    def test_answers_plain_reads(self):
+        book, author = self.books[0], self.books[0].authors.get()
+        self.assertSameResponses(
+            '/api/v1/books/', '/api/v1/books/?page=2', '/api/v1/books/?page=last&fields=id,title',
+            '/api/v1/books/?fields=id,latest_reviews&expand=authors', f'/api/v1/books/{book.pk}/', '/api/v1/authors/?page=2',
+            f'/api/v1/authors/{author.pk}/', '/api/v1/genres/', '/api/v1/reviews/',
+            f'/api/v1/reviews/{book.review_set.get().pk}/',
+        )
+
+    def test_leaves_the_rest_to_the_viewsets(self):
+        self.assertSameResponses(
+            '/api/v1/books/?title=Book 1', '/api/v1/books/?page=3', '/api/v1/books/?page=x', '/api/v1/books/0/',
+            '/api/v1/books/x/', '/api/v1/books/?pagination=keyset', '/api/v1/books/?format=json',
+            answered=False,
+        )
+        response = self.request(
+            'post', '/api/v1/reviews/', {'title': 'Async', 'review_text': '-', 'book': self.books[0].pk},
+            content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+
+    def test_answers_refused_requests(self):
+        self.client.logout()
+        self.async_client.logout()
+        self.assertSameResponses('/api/v1/genres/', '/api/v1/books/?format=nope')
+        # The viewset doesn't get the request to authenticate and throttle again.
+        for url, status_code in (('/api/v1/genres/', 403), ('/api/v1/books/?format=nope', 404)):
+            with patch.object(APIView, 'initial', autospec=True, side_effect=APIView.initial) as initial:
+                self.assertEqual(self.request('get', url).status_code, status_code)
+            self.assertEqual(initial.call_count, 1)
+
+    @override_settings(REQUEST_METRICS_SAMPLE_RATE=1)
+    def test_async_requests_are_sampled(self):
+        with self.assertLogs('books.metrics', 'INFO') as logs:
+            response, fell_back = self.get('/api/v1/books/')
+        record = json.loads(logs.records[0].getMessage())
+        self.assertFalse(fell_back)
+        # Session, user, count and rows, all run in sync_to_async() threads.
+        self.assertEqual((record['status'], record['db_queries']), (200, 6))
+        self.assertGreater(record['serializer_ms'], 0)
+
+    def test_anonymous_reads_use_the_response_cache(self):
+        self.async_client.logout()
+        first, _ = self.get('/api/v1/books/')
+        with self.assertNumQueries(0):
+            second, fell_back = self.get('/api/v1/books/')
+        self.assertFalse(fell_back)
+        self.assertEqual(first.content, second.content)
+        self.assertEqual(first['ETag'], second['ETag'])
+
+
+def png(width, height, mode='RGBA'):
+    buffer = BytesIO()
+    Image.new(mode, (width, height), 'red').save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+def save_default_images():
+    """
+    The field defaults of the image models, which rows show until they get images of their own.
+    """
+    names = {model._meta.get_field('image').default for model in images.IMAGE_MODELS}
+    for name in names:
+        if not default_storage.exists(name):
+            default_storage.save(name, ContentFile(png(600, 900)))
+    return sorted(names)
+
+
+def setUpModule():
+    # The rows the tests create show the default images, and the image workers derive them.
+    save_default_images()
+
+
+class ImageDerivativeTests(TransactionTestCase):
+    """
+    Transactional: process_images works in threads, on connections of their own.
+    """
+
+    def setUp(self):
+        # The tests process the images themselves, not in the worker threads.
+        schedule = patch.object(images, 'schedule')
+        self.schedule = schedule.start()
+        self.addCleanup(schedule.stop)
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        media_root = override_settings(MEDIA_ROOT=media.name)
+        media_root.enable()
+        self.addCleanup(media_root.disable)
+        self.client.force_login(User.objects.create_superuser(username='librarian', password='secret'))
+        self.book = create_book(1)
+        self.book.image.save('cover.png', ContentFile(png(800, 600)))
+
+    def test_derivatives_are_named_after_the_content(self):
+        self.assertEqual(images.process_image(Book, self.book.image.name), 1)
+        self.book.refresh_from_db()
+        srcset = self.book.image_srcset
+        self.assertEqual(srcset['source'], self.book.image.name)
+        self.assertEqual([width for width, _ in srcset['webp']], [160, 320, 640])
+        for fmt, pil_format in (('webp', 'WEBP'), ('jpeg', 'JPEG')):
+            for width, name in srcset[fmt]:
+                with default_storage.open(name) as derivative, Image.open(derivative) as image:
+                    self.assertEqual((image.format, image.size), (pil_format, (width, width * 3 // 4)))
+
+        other = create_book(2)
+        other.image.save('copy.png', ContentFile(png(800, 600)))
+        images.process_image(Book, other.image.name)
+        other.refresh_from_db()
+        self.assertEqual(other.image_srcset['jpeg'], srcset['jpeg'])
+
+        small = create_book(3)
+        small.image.save('small.png', ContentFile(png(200, 100, 'P')))
+        images.process_image(Book, small.image.name)
+        small.refresh_from_db()
+        self.assertEqual([width for width, _ in small.image_srcset['jpeg']], [160, 200])
+
+    def test_derivatives_are_saved_once(self):
+        srcset = images.make_derivatives(self.book.image.name)
+        name = srcset['jpeg'][0][1]
+        looked = set()
+        stored = default_storage.exists
+
+        def exists(path):
+            # The first look misses it, as for a worker looking just before another one saved it.
+            first = path not in looked
+            looked.add(path)
+            return not first and stored(path)
+
+        with patch.object(default_storage, 'exists', side_effect=exists):
+            saved = images.save_derivative(default_storage, name, Image.new('RGB', (200, 150)), 160, 'jpeg')
+        self.assertEqual(saved, name)
+        self.assertEqual(images.make_derivatives(self.book.image.name), srcset)
+        directory = name.rsplit('/', 1)[0]
+        derivatives = [derivative for fmt in ('webp', 'jpeg') for _, derivative in srcset[fmt]]
+        self.assertEqual(sorted(f'{directory}/{file}' for file in default_storage.listdir(directory)[1]),
+                         sorted(derivatives))
+
+    def test_serializers_render_srcset(self):
+        images.process_image(Book, self.book.image.name)
+        url = f'/api/v1/books/{self.book.pk}/'
+        fast = self.client.get(url)
+        with patch.object(SparseFieldsetMixin, 'fast_plan', return_value=None):
+            slow = self.client.get(url)
+        self.assertEqual(fast.content, slow.content)
+        webp = fast.json()['image_srcset']['webp'].split(', ')
+        self.assertEqual(len(webp), 3)
+        self.assertRegex(webp[0], r'^http://testserver/media/derivatives/\w\w/\w{32}-160w\.webp 160w$')
+
+    def test_new_image_is_queued(self):
+        images.process_image(Book, self.book.image.name)
+        self.book.refresh_from_db()
+        self.schedule.reset_mock()
+        self.book.title = 'Renamed'
+        self.book.save()
+        self.schedule.assert_not_called()
+        self.book.image.save('new.png', ContentFile(png(400, 300)))
+        self.schedule.assert_called_once_with(Book, self.book.image.name)
+        self.assertEqual(Book.objects.get(pk=self.book.pk).image_srcset, {})
+
+    def test_default_images_are_derived_once(self):
+        defaults = save_default_images()
+        create_book(2)
+        out = StringIO()
+        with patch.object(default_storage, 'save', wraps=default_storage.save) as save:
+            call_command('process_images', stdout=out)
+            # Three widths in two formats of the first book's cover and of the defaults, which
+            # share their bytes here and so their derivatives.
+            self.assertEqual(save.call_count, 2 * 3 * 2)
+            call_command('process_images', everything=True, stdout=out)
+            self.assertEqual(save.call_count, 2 * 3 * 2)
+        self.assertEqual(out.getvalue().splitlines()[:2], ['books: 2 images, 2 rows updated',
+                                                           'authors: 1 images, 2 rows updated'])
+        self.assertEqual({author.image_srcset['source'] for author in Author.objects.all()}, {defaults[0]})
+
+    def test_backfill(self):
+        Author.objects.update(image=self.book.image.name)
+        self.book.image.save('unreadable.png', ContentFile(b'not an image'))
+        out = StringIO()
+        with self.assertLogs('books.images', 'WARNING'):
+            call_command('process_images', workers=2, stdout=out)
+        self.assertEqual(out.getvalue().splitlines(), ['books: 1 images, 0 rows updated',
+                                                       'authors: 1 images, 1 rows updated'])
+        self.assertIn('webp', Author.objects.get().image_srcset)
+        with self.assertLogs('books.images', 'WARNING'):
+            call_command('process_images', stdout=out)
+        self.assertIn('authors: 0 images', out.getvalue())
+
+
+class ConcurrentCheckoutTests(TransactionTestCase):
+    """
+    Many librarians lending out the same book at once must never hand one copy to two borrowers.
+    """
+    threads = 24
+    copies = 5
+
+    def test_no_double_loans(self):
+        book = Book.objects.create(title='Popular', description='-', isbn='978-0-00-999999')
+        for n in range(self.copies):
+            BookInstance.objects.create(book=book, imprint='-', inventory=f'popular-{n}', status='a')
+        borrowers = [User.objects.create_user(username=f'borrower{n}') for n in range(self.threads)]
+        start, lent, refused = threading.Barrier(self.threads), [], []
+
+        def lend(borrower):
+            try:
+                start.wait()
+                lent.append(loans.checkout(book, borrower))
+            except loans.LoanError:
+                refused.append(borrower)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=lend, args=(borrower,)) for borrower in borrowers]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        self.assertEqual((len(lent), len(refused)), (self.copies, self.threads - self.copies))
+        self.assertEqual(len({copy.pk for copy in lent}), self.copies)
+        on_loan = dict(BookInstance.objects.filter(book=book).values_list('pk', 'borrower'))
+        self.assertEqual(on_loan, {copy.pk: copy.borrower_id for copy in lent})
+        book.refresh_from_db()
+        self.assertEqual((book.on_loan_copies, book.available_copies), (self.copies, 0))
+
+
+class RowLockTests(TransactionTestCase):
+    """
+    The counters' pre_save row locks must run in a transaction outside the atomic block of
+    a TestCase, on a backend that takes them (SQLite has no FOR UPDATE clause to write).
+    """
+
+    def test_saves_lock_rows_in_a_transaction(self):
+        reader = User.objects.create_user(username='reader')
+        book = Book.objects.create(title='Popular', description='-', isbn='1')
+        other = Book.objects.create(title='Other', description='-', isbn='2')
+        review = Review.objects.create(title='Review', review_text='-', author=reader, book=book)
+        copy = BookInstance.objects.create(book=book, imprint='-', inventory='1', status='a')
+        relation = UserBookRelation.objects.create(user=reader, book=book, rate=4)
+        with patch.object(connection.features, 'has_select_for_update', True), \
+                patch.object(connection.ops, 'for_update_sql', return_value=''):
+            review.book = other
+            review.save()
+            copy.status = 'o'
+            copy.save()
+            relation.rate = 5
+            relation.save()
+            review.delete()
+        self.assertEqual(list(Book.objects.order_by('pk').values_list('review_count', 'on_loan_copies', 'rating_sum')),
+                         [(0, 1, 5), (0, 0, 0)])
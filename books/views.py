@@ -1,14 +1,32 @@
+from django.conf import settings
 from django.contrib.auth import login, logout, get_user_model
 from django.contrib.auth.mixins import PermissionRequiredMixin
-
-from rest_framework import viewsets, views, permissions, status, generics, authentication
-from rest_framework.mixins import UpdateModelMixin
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import IntegrityError, transaction
+from django.http import HttpResponse, HttpResponseForbidden, StreamingHttpResponse
+
+from django_filters.rest_framework import DjangoFilterBackend
+from rest_framework import viewsets, views, permissions, status, generics, authentication, filters
+from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.mixins import DestroyModelMixin, ListModelMixin, RetrieveModelMixin, UpdateModelMixin
+from rest_framework.parsers import MultiPartParser
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
 
-from .models import Book, Author, User, BookInstance, Genre, Review, UserBookRelation
-from .permissions import IsAuthorOrReadOnly
+from . import cache, facets, loans
+from .cache import CachedResponseMixin
+from .exporters import DATASETS, FORMATS, export
+from .fieldsets import SparseFieldsetMixin
+from .filters import AuthorSearchFilter, BookFilter, BookInstanceFilter, BookSearchFilter
+from .importers import READERS, import_catalogue
+from .metrics import registry
+from .models import Book, Author, User, BookInstance, Genre, Hold, Language, Review, UserBookRelation
+from .pagination import KeysetPaginationMixin, BookKeysetPagination, LoanKeysetPagination, ReviewKeysetPagination
+from .permissions import IsAuthorOrReadOnly, IsLibrarian
 from .serializers import BookSerializer, AuthorSerializer, LoginSerializer, UserSerializer, EmptySerializer, \
-    BookInstanceSerializer, GenreSerializer, ReviewSerializer, UserBookRelationSerializer
+    BookInstanceSerializer, GenreSerializer, ReviewSerializer, UserBookRelationSerializer, BookListSerializer, \
+    AuthorListSerializer, BookReviewSerializer, CheckoutSerializer, HoldSerializer
 
 
 class SignUpView(generics.CreateAPIView):
@@ -50,58 +68,282 @@ class LogoutView(views.APIView):
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
-class UserViewSet(viewsets.ModelViewSet):
+class CacheStatsView(views.APIView):
+    """
+    Hit and miss counters of the response cache.
+    """
+    permission_classes = (permissions.IsAdminUser,)
+
+    def get(self, request, format=None):
+        return Response(cache.stats())
+
+
+class CatalogueImportView(views.APIView):
+    """
+    Bulk import of a CSV, JSON Lines or MARC21 ``file`` upload; ``format`` is csv, jsonl or marc.
+    Responds with the per-row import report.
+    """
+    permission_classes = (permissions.IsAdminUser,)
+    parser_classes = (MultiPartParser,)
+
+    def post(self, request, format=None):
+        upload = request.FILES.get('file')
+        fmt = request.data.get('format', 'csv')
+        if upload is None:
+            raise ValidationError({'file': 'A file upload is required.'})
+        if fmt not in READERS:
+            raise ValidationError({'format': f'Choose one of: {", ".join(READERS)}'})
+        report = import_catalogue(upload, fmt)
+        return Response(report.as_dict(), status=status.HTTP_200_OK)
+
+
+def metrics(request):
+    """
+    Request metrics of this process in the Prometheus text format.
+    """
+    token = settings.REQUEST_METRICS_TOKEN
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        return HttpResponseForbidden()
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+class AnyMediaTypeRenderer(JSONRenderer):
+    """
+    Accepts any Accept header for views that build their own response; errors still render as JSON.
+    """
+    media_type = '*/*'
+    format = None
+
+
+class CatalogueExportView(views.APIView):
+    """
+    Streaming dump of ``books`` or ``copies`` as ``?output=csv|jsonl|columnar``.
+    """
+    permission_classes = (IsLibrarian,)
+    renderer_classes = (JSONRenderer, AnyMediaTypeRenderer)
+
+    def get(self, request, dataset, format=None):
+        output = request.query_params.get('output', 'csv')
+        if dataset not in DATASETS:
+            raise NotFound(f'Choose one of: {", ".join(DATASETS)}')
+        if output not in FORMATS:
+            raise ValidationError({'output': f'Choose one of: {", ".join(FORMATS)}'})
+        _, content_type, extension = FORMATS[output]
+        response = StreamingHttpResponse(export(dataset, output), content_type=f'{content_type}; charset=utf-8')
+        response['Content-Disposition'] = f'attachment; filename="{dataset}.{extension}"'
+        return response
+
+
+class UserViewSet(SparseFieldsetMixin, viewsets.ModelViewSet):
     queryset = User.objects.all()
     serializer_class = UserSerializer
 
 
-class AuthorViewSet(viewsets.ModelViewSet):
+class AuthorViewSet(CachedResponseMixin, SparseFieldsetMixin, viewsets.ModelViewSet):
     authentication_classes = (CsrfExemptSessionAuthentication,)
+    cache_models = (Author,)
     queryset = Author.objects.all()
     serializer_class = AuthorSerializer
+    compact_serializer_class = AuthorListSerializer
+    fast_read_actions = ('list', 'retrieve', 'books')
+    filter_backends = [AuthorSearchFilter]
     search_fields = ['first_name', 'last_name']
 
+    @action(detail=True, serializer_class=BookListSerializer, pagination_class=BookKeysetPagination,
+            filter_backends=[], cache_models=(Book, Author, Genre, BookInstance, Review, User))
+    def books(self, request, pk=None):
+        """
+        The author's books as the book list renders them (``?fields=``, ``?expand=``), by title,
+        a keyset page at a time: any page costs the same however many books the author has.
+        """
+        return self.cached(self.author_books, request, pk)
+
+    def author_books(self, request, pk):
+        author = generics.get_object_or_404(Author.objects.only('pk'), pk=pk)
+        return self.list_response(Book.objects.filter(authors=author))
+
 
-class BookViewSet(viewsets.ModelViewSet):
+class BookViewSet(CachedResponseMixin, SparseFieldsetMixin, KeysetPaginationMixin, viewsets.ModelViewSet):
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+    cache_models = (Book, Author, Genre, Language, BookInstance, Review, User, UserBookRelation)
+    keyset_pagination_class = BookKeysetPagination
+    # Search results come ranked by relevance and ?ordering= picks its own order: keyset
+    # pagination seeks on (title, id) only.
+    keyset_conflicting_params = (BookSearchFilter.search_param, filters.OrderingFilter.ordering_param)
     queryset = Book.objects.all()
     serializer_class = BookSerializer
-    filterset_fields = ['title']
-    search_fields = ['title', 'authors__first_name', 'authors__last_name']
+    compact_serializer_class = BookListSerializer
+    compact_actions = ('list', 'top', 'similar')
+    fast_read_actions = ('list', 'retrieve', 'reviews')
+    filter_backends = [DjangoFilterBackend, BookSearchFilter, filters.OrderingFilter]
+    filterset_class = BookFilter
+    ordering_fields = ['title', *Book.AVAILABILITY_FIELDS, *Book.RATING_FIELDS, 'rating_mean']
+    top_limit = 10
+    max_top_limit = 100
+    facet_limit = 20
+    max_facet_limit = 100
+
+    @action(detail=False)
+    def top(self, request):
+        """
+        Top-N books by ``?by=rating|likes|bookmarks`` (``?limit=``, default 10),
+        read straight off the per-metric index.
+        """
+        metric = request.query_params.get('by', 'rating')
+        if metric not in Book.TOP_METRICS:
+            raise ValidationError({'by': f'Choose one of: {", ".join(Book.TOP_METRICS)}'})
+        try:
+            limit = min(int(request.query_params.get('limit', self.top_limit)), self.max_top_limit)
+        except ValueError:
+            raise ValidationError({'limit': 'A whole number is required.'})
+        books = self.filter_queryset(self.get_queryset()).top(metric, max(limit, 1))
+        return Response(self.response_data(books, many=True))
+
+    @action(detail=False)
+    def facets(self, request):
+        """
+        Books per genre, language and author among those the list returns for the same
+        filters and ``?search=``: the ``?facet_limit=`` largest values of each (default 20).
+        """
+        return self.cached(self.facet_counts, request)
+
+    def facet_counts(self, request):
+        try:
+            limit = min(int(request.query_params.get('facet_limit', self.facet_limit)), self.max_facet_limit)
+        except ValueError:
+            raise ValidationError({'facet_limit': 'A whole number is required.'})
+        names = {*self.filterset_class.base_filters, BookSearchFilter.search_param}
+        filters = {name: value for name, value in request.query_params.items() if name in names and value}
+        if not filters or filters in ({'available_copies__gt': '0'}, {'available__gt': '0'}):
+            counts = facets.stored_counts(max(limit, 1), available=bool(filters))
+        else:
+            counts = facets.aggregate_counts(self.filter_queryset(self.get_queryset()), max(limit, 1))
+        return Response(facets.named(counts))
+
+    @action(detail=True)
+    def similar(self, request, pk=None):
+        """
+        The books whose readers also read this one, most similar first, as stored by
+        ``manage.py build_similarities``: at most SIMILAR_BOOKS rows off the (book, similar) index.
+        """
+        book = generics.get_object_or_404(Book.objects.only('pk'), pk=pk)
+        books = self.get_queryset().filter(neighbour_of__book=book).order_by('-neighbour_of__score', 'pk')
+        return Response(self.response_data(self.filter_queryset(books), many=True))
+
+    @action(detail=True, serializer_class=BookReviewSerializer, pagination_class=ReviewKeysetPagination,
+            keyset_pagination_class=None, filter_backends=[], cache_models=(Book, Review, User))
+    def reviews(self, request, pk=None):
+        """
+        The book's reviews, newest first, a keyset page at a time off review_book_pub_date_id_idx;
+        the book itself carries review_count and its latest_reviews.
+        """
+        return self.cached(self.book_reviews, request, pk)
+
+    def book_reviews(self, request, pk):
+        book = generics.get_object_or_404(Book.objects.only('pk'), pk=pk)
+        return self.list_response(Review.objects.filter(book=book))
+
+    @action(detail=True, methods=['post'], permission_classes=[IsLibrarian])
+    def checkout(self, request, pk=None):
+        """
+        Lend a copy of the book to ``borrower`` (a user id): the copy reserved for them, else any available one.
+        """
+        serializer = CheckoutSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        book = generics.get_object_or_404(Book.objects.only('pk'), pk=pk)
+        copy = loans.checkout(book, serializer.validated_data['borrower'])
+        return Response(BookInstanceSerializer(copy, context=self.get_serializer_context()).data)
+
+    @action(detail=True, methods=['post'], permission_classes=[permissions.IsAuthenticated])
+    def reserve(self, request, pk=None):
+        """
+        Place a hold on the book for the current user; it is ready at once if a copy is available.
+        """
+        book = generics.get_object_or_404(Book.objects.only('pk'), pk=pk)
+        hold = loans.place_hold(book, request.user)
+        return Response(HoldSerializer(hold).data, status=status.HTTP_201_CREATED)
 
 
-class LoanedBooksByUserListView(viewsets.ModelViewSet):
+class LoanedBooksByUserListView(SparseFieldsetMixin, KeysetPaginationMixin, viewsets.ModelViewSet):
     """
     Generic class-based view listing books on loan to current user.
     """
     serializer_class = BookInstanceSerializer
+    keyset_pagination_class = LoanKeysetPagination
+    fast_read_actions = ('list', 'retrieve')
+    filterset_class = BookInstanceFilter
 
     def get_queryset(self):
         return BookInstance.objects.filter(borrower=self.request.user).filter(status__exact='o').order_by('due_back')
 
 
-class AllBorrowedBooks(PermissionRequiredMixin, viewsets.ModelViewSet):
+class AllBorrowedBooks(PermissionRequiredMixin, SparseFieldsetMixin, KeysetPaginationMixin, viewsets.ModelViewSet):
     serializer_class = BookInstanceSerializer
+    keyset_pagination_class = LoanKeysetPagination
+    fast_read_actions = ('list', 'retrieve')
+    filterset_class = BookInstanceFilter
     permission_required = 'books.can_mark_returned'
 
     def get_queryset(self):
         return BookInstance.objects.filter(status__exact='o').order_by('due_back')
 
 
-class BookInstanceViewSet(viewsets.ModelViewSet):
+class BookInstanceViewSet(SparseFieldsetMixin, viewsets.ModelViewSet):
     serializer_class = BookInstanceSerializer
     queryset = BookInstance.objects.all()
+    fast_read_actions = ('list', 'retrieve')
+    filterset_class = BookInstanceFilter
+
+    @action(detail=True, methods=['post'], url_path='return', permission_classes=[IsLibrarian])
+    def return_copy(self, request, pk=None):
+        return Response(self.response_data(self.change_copy(loans.return_copy, pk)))
+
+    @action(detail=True, methods=['post'], permission_classes=[permissions.IsAuthenticated])
+    def renew(self, request, pk=None):
+        """
+        Extend a loan; borrowers can renew their own loans, librarians any loan.
+        """
+        borrower = None if IsLibrarian().has_permission(request, self) else request.user
+        return Response(self.response_data(self.change_copy(loans.renew, pk, borrower)))
+
+    @staticmethod
+    def change_copy(operation, pk, *args):
+        try:
+            return operation(pk, *args)
+        except (BookInstance.DoesNotExist, DjangoValidationError):
+            raise NotFound()
+
+
+class HoldViewSet(ListModelMixin, RetrieveModelMixin, DestroyModelMixin, viewsets.GenericViewSet):
+    """
+    The current user's holds (every hold for librarians); DELETE cancels an active hold.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    serializer_class = HoldSerializer
+    filterset_fields = ['book', 'status']
+
+    def get_queryset(self):
+        holds = Hold.objects.all()
+        if not IsLibrarian().has_permission(self.request, self):
+            holds = holds.filter(patron=self.request.user)
+        return holds
 
+    def perform_destroy(self, instance):
+        loans.cancel_hold(instance.pk)
 
-class GenreViewSet(viewsets.ModelViewSet):
+
+class GenreViewSet(CachedResponseMixin, SparseFieldsetMixin, viewsets.ModelViewSet):
+    cache_models = (Genre,)
     serializer_class = GenreSerializer
     queryset = Genre.objects.all()
+    fast_read_actions = ('list', 'retrieve')
 
 
-class ReviewViewSet(viewsets.ModelViewSet):
+class ReviewViewSet(SparseFieldsetMixin, viewsets.ModelViewSet):
     permission_classes = [IsAuthorOrReadOnly]
     serializer_class = ReviewSerializer
     queryset = Review.objects.all()
+    fast_read_actions = ('list', 'retrieve')
 
     def perform_create(self, serializer):
         serializer.validated_data['author'] = self.request.user
@@ -109,7 +351,31 @@ class ReviewViewSet(viewsets.ModelViewSet):
 
 
 class UserBookRelationView(UpdateModelMixin, viewsets.GenericViewSet):
+    """
+    Upsert of the current user's relation to a book; the book's rating aggregates follow via books.signals.
+    """
     permission_classes = [permissions.IsAuthenticated]
     queryset = UserBookRelation.objects.all()
     serializer_class = UserBookRelationSerializer
     lookup_field = 'book'
+
+    def get_queryset(self):
+        return super().get_queryset().filter(user=self.request.user)
+
+    def update(self, request, *args, **kwargs):
+        partial = kwargs.pop('partial', False)
+        try:
+            with transaction.atomic():
+                return self.upsert(request, kwargs[self.lookup_field], partial)
+        except IntegrityError:
+            # A concurrent request created the relation first (it is unique per user and book): update that one.
+            return self.upsert(request, kwargs[self.lookup_field], partial)
+
+    def upsert(self, request, book, partial):
+        instance = self.get_queryset().filter(book=book).first()
+        data = request.data.copy()
+        data['book'] = book
+        serializer = self.get_serializer(instance, data=data, partial=partial and instance is not None)
+        serializer.is_valid(raise_exception=True)
+        serializer.save(user=request.user)
+        return Response(serializer.data, status=status.HTTP_200_OK if instance else status.HTTP_201_CREATED)
@@ -0,0 +1,35 @@
+"""
+gunicorn settings, read from the working directory: ``gunicorn library.wsgi``.
+
+The same settings serve the ASGI application with an ASGI worker class, e.g.
+``GUNICORN_WORKER_CLASS=uvicorn.workers.UvicornWorker gunicorn library.asgi``
+(uvicorn is in the optional ``deploy`` dependency group: ``poetry install --with deploy``).
+Under ASGI the catalogue reads are async views (see books.async_views), so slow
+clients and long-polling consumers wait on the event loop rather than in a thread.
+
+Every worker thread holds one persistent PostgreSQL connection per database it
+reads from (CONN_MAX_AGE in library/settings.py), so the connections in use are
+about ``workers * threads * (1 + replicas)``; keep that below the server's
+max_connections, or put PgBouncer in front of it.
+"""
+import multiprocessing
+import os
+
+bind = os.environ.get('GUNICORN_BIND', '127.0.0.1:8000')
+workers = int(os.environ.get('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+# Threads per worker: the per-process connection pool size.
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread' if threads > 1 else 'sync')
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+graceful_timeout = timeout
+keepalive = 5
+# Recycle workers now and then, so the connections and memory of a long-lived worker are renewed too.
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 5000))
+max_requests_jitter = max_requests // 10
+# Load the app in every worker: a connection opened while importing it in the master would
+# otherwise be inherited, and shared, by all the workers.
+preload_app = False
+
+# A query still running when its worker is killed for timing out gets cancelled by the server as well.
+os.environ.setdefault('DJANGO_DB_STATEMENT_TIMEOUT_MS', str(timeout * 1000))
+
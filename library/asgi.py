@@ -12,5 +12,11 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'library.settings')
+# Django runs the sync code of each ASGI request in a thread of its own, so a persistent
+# connection would never be reused, only left open until its thread is collected. Connect per
+# request here, and put a pooler such as PgBouncer in front of PostgreSQL when serving over ASGI.
+os.environ.setdefault('DJANGO_DB_CONN_MAX_AGE', '0')
+# Plain reads of the catalogue endpoints are answered by async views, see books.async_views.
+os.environ.setdefault('DJANGO_ASYNC_READ_VIEWS', '1')
 
 application = get_asgi_application()
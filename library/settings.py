@@ -10,6 +10,8 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.1/ref/settings/
 """
 import os
+import tempfile
+from decimal import Decimal
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -46,17 +48,24 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'books.middleware.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'books.routers.ReplicaRoutingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
 ROOT_URLCONF = 'library.urls'
+# Answer the plain list and detail reads of books, authors, genres and reviews with async views,
+# see books.async_views. library/asgi.py turns it on: under WSGI each request has its thread anyway.
+ASYNC_READ_VIEWS = bool(os.environ.get('DJANGO_ASYNC_READ_VIEWS', ''))
+# Async reads one worker runs at once, each on a database connection of its own.
+ASYNC_READ_CONCURRENCY = int(os.environ.get('DJANGO_ASYNC_READ_CONCURRENCY', 16))
 
 TEMPLATES = [
     {
@@ -88,9 +97,91 @@ DATABASES = {
         'PASSWORD': 'u9bqt8gf',
         'HOST': 'localhost',
         'PORT': '',
+        # Persistent connections: each gunicorn worker thread keeps its connection for up to
+        # CONN_MAX_AGE seconds instead of connecting on every request, and checks it is still
+        # alive before reusing it. Set DJANGO_DB_CONN_MAX_AGE=0 to connect per request.
+        'CONN_MAX_AGE': int(os.environ.get('DJANGO_DB_CONN_MAX_AGE', 60)),
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'connect_timeout': int(os.environ.get('DJANGO_DB_CONNECT_TIMEOUT', 5)),
+            # 0 (no limit) for management commands; gunicorn.conf.py sets it to the worker timeout.
+            'options': f"-c statement_timeout={int(os.environ.get('DJANGO_DB_STATEMENT_TIMEOUT_MS', 0))}",
+            # Notice dead peers on idle persistent connections.
+            'keepalives': 1,
+            'keepalives_idle': 60,
+        },
     }
 }
 
+# Read replicas of default, see books.routers: DJANGO_DB_REPLICA_HOSTS is a comma-separated list of
+# hosts serving a copy of it. A client that wrote reads from default for REPLICA_PIN_SECONDS.
+REPLICA_DATABASES = []
+for number, host in enumerate(filter(None, os.environ.get('DJANGO_DB_REPLICA_HOSTS', '').split(',')), 1):
+    DATABASES[f'replica{number}'] = {**DATABASES['default'], 'HOST': host.strip(), 'TEST': {'MIRROR': 'default'}}
+    REPLICA_DATABASES.append(f'replica{number}')
+REPLICA_PIN_SECONDS = int(os.environ.get('DJANGO_DB_REPLICA_PIN_SECONDS', 5))
+DATABASE_ROUTERS = ['books.routers.ReplicaRouter']
+
+# Cache
+# https://docs.djangoproject.com/en/4.1/topics/cache/
+# DJANGO_CACHE_BACKEND picks one of CACHE_BACKENDS. locmem is per process, so with several
+# gunicorn workers use file or redis to share entries and invalidations; the redis backend
+# talks to anything speaking the Redis protocol (a local redis-server, Valkey, KeyDB...).
+
+CACHE_BACKENDS = {
+    'locmem': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'library',
+    },
+    'file': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get('DJANGO_CACHE_LOCATION', os.path.join(tempfile.gettempdir(), 'library-cache')),
+    },
+    'redis': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ.get('DJANGO_CACHE_LOCATION', 'redis://127.0.0.1:6379'),
+    },
+}
+
+CACHES = {
+    'default': CACHE_BACKENDS[os.environ.get('DJANGO_CACHE_BACKEND', 'locmem')],
+}
+
+# Anonymous read responses of the catalogue endpoints, see books.cache
+RESPONSE_CACHE_ALIAS = 'default'
+RESPONSE_CACHE_TIMEOUT = int(os.environ.get('DJANGO_RESPONSE_CACHE_TIMEOUT', 300))
+
+# Loan and reservation periods of books.loans, in days
+LOAN_PERIOD_DAYS = int(os.environ.get('LIBRARY_LOAN_PERIOD_DAYS', 21))
+RESERVATION_PERIOD_DAYS = int(os.environ.get('LIBRARY_RESERVATION_PERIOD_DAYS', 7))
+
+# Overdue fines and reminders of books.overdue: the fine per day late up to a cap, and the
+# numbers of days late at which the borrower gets a reminder
+FINE_PER_DAY = Decimal(os.environ.get('LIBRARY_FINE_PER_DAY', '10'))
+FINE_MAX = Decimal(os.environ.get('LIBRARY_FINE_MAX', '500'))
+OVERDUE_NOTICE_DAYS = (1, 7, 30)
+
+# Share of requests whose SQL and serializer time are instrumented (see books.middleware).
+REQUEST_METRICS_SAMPLE_RATE = float(os.environ.get('DJANGO_METRICS_SAMPLE_RATE', 0.05))
+REQUEST_METRICS_N_PLUS_ONE_THRESHOLD = int(os.environ.get('DJANGO_METRICS_N_PLUS_ONE_THRESHOLD', 5))
+# When set, /metrics requires "Authorization: Bearer <token>".
+REQUEST_METRICS_TOKEN = os.environ.get('DJANGO_METRICS_TOKEN')
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'books.metrics': {
+            'handlers': ['console'],
+            'level': os.environ.get('DJANGO_METRICS_LOG_LEVEL', 'INFO'),
+            'propagate': False,
+        },
+    },
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
 
@@ -145,6 +236,19 @@ CORS_ALLOWED_ORIGINS = [
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Resized copies of the cover and author images, see books.images: the widths (in pixels) and
+# formats made of every image, and the threads of each process that make them.
+IMAGE_DERIVATIVE_WIDTHS = (160, 320, 640)
+IMAGE_DERIVATIVE_FORMATS = ('webp', 'jpeg')
+IMAGE_DERIVATIVE_QUALITY = int(os.environ.get('LIBRARY_IMAGE_QUALITY', 80))
+IMAGE_WORKERS = int(os.environ.get('LIBRARY_IMAGE_WORKERS', 2))
+
+# Neighbours kept per book by books.similarity, served by /books/{id}/similar/.
+SIMILAR_BOOKS = int(os.environ.get('LIBRARY_SIMILAR_BOOKS', 20))
+
+# Reviews embedded in a book as latest_reviews; the rest are paged at /books/{id}/reviews/.
+LATEST_REVIEWS = int(os.environ.get('LIBRARY_LATEST_REVIEWS', 3))
+
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
         'rest_framework.authentication.SessionAuthentication',
@@ -156,6 +260,17 @@ REST_FRAMEWORK = {
         'django_filters.rest_framework.DjangoFilterBackend',
         'rest_framework.filters.SearchFilter',
     ],
+    'DEFAULT_RENDERER_CLASSES': [
+        'books.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 10
 }
+
+# From the environment only: manage.py bot refuses to start without it.
+TELEGRAM_BOT_TOKEN = os.environ.get('TELEGRAM_BOT_TOKEN', '')
+TELEGRAM_API_URL = os.environ.get('TELEGRAM_API_URL', 'https://api.telegram.org/bot')
+TELEGRAM_BOT_CONCURRENT_UPDATES = int(os.environ.get('TELEGRAM_BOT_CONCURRENT_UPDATES', 64))
+TELEGRAM_BOT_MAX_QUERIES = int(os.environ.get('TELEGRAM_BOT_MAX_QUERIES', 8))
+TELEGRAM_BOT_POOL_TIMEOUT = float(os.environ.get('TELEGRAM_BOT_POOL_TIMEOUT', 30))
@@ -0,0 +1,35 @@
+"""
+Settings for running the tests without PostgreSQL: two SQLite databases stand in for the
+primary and a read replica (see books.routers), e.g. ``manage.py test --settings=library.test_settings``.
+
+The replica is a separate database that nothing replicates to, so it shows what a lagging
+replica would; it is only read from where a test enables REPLICA_DATABASES.
+
+The test primary is a file rather than SQLite's default in-memory database, whose
+connections fail on each other's locks instead of waiting for them: the concurrency
+tests run transactions from several threads at once. The databases and the media
+files the tests write live in the temporary directory, not in the checkout.
+"""
+import tempfile
+from pathlib import Path
+
+from .settings import *  # noqa: F401,F403
+
+TEMP_DIR = Path(tempfile.gettempdir())
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': TEMP_DIR / 'library.sqlite3',
+        'TEST': {'NAME': TEMP_DIR / 'library-test.sqlite3'},
+    },
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': TEMP_DIR / 'library-replica.sqlite3',
+    },
+}
+# Derivatives the image workers make for the rows the tests create.
+MEDIA_ROOT = TEMP_DIR / 'library-media'
+REPLICA_DATABASES = []
+# Tests that look at the request metrics sample every request themselves; the rest sample none.
+REQUEST_METRICS_SAMPLE_RATE = 0
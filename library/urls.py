@@ -6,7 +6,7 @@ from django.views.generic.base import RedirectView
 
 from rest_framework.routers import DefaultRouter
 
-from books import views
+from books import async_views, views
 
 router = DefaultRouter()
 router.register(r'books', views.BookViewSet)
@@ -18,10 +18,18 @@ router.register(r'book_relation', views.UserBookRelationView)
 router.register(r'mybooks', views.LoanedBooksByUserListView, basename='my-borrowed')
 router.register(r'allborrowed', views.AllBorrowedBooks, basename='all-borrowed')
 router.register(r'bookcopy', views.BookInstanceViewSet, basename='book-copy')
+router.register(r'holds', views.HoldViewSet, basename='hold')
 
-urlpatterns = [
+# The async read views go first: they hand whatever they don't answer to the router's views.
+async_read_urls = [path('api/v1/', include(async_views.urlpatterns(router)))] if settings.ASYNC_READ_VIEWS else []
+
+urlpatterns = async_read_urls + [
     path('admin/', admin.site.urls),
     path('api/v1/', include(router.urls)),
+    path('api/v1/cache-stats/', views.CacheStatsView.as_view()),
+    path('api/v1/import/', views.CatalogueImportView.as_view()),
+    path('api/v1/export/<slug:dataset>/', views.CatalogueExportView.as_view()),
+    path('metrics', views.metrics),
     path('account/login/', views.LogInView.as_view()),
     path('account/register/', views.SignUpView.as_view()),
     path('accounts/logout/', views.LogoutView.as_view()),